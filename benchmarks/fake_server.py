@@ -0,0 +1,225 @@
+# Stand-in inference server for load testing without GPUs.
+# Speaks enough of the Ollama API (/api/chat, /api/generate, /api/tags, /api/ps) and the
+# OpenAI chat-completions API (/v1/chat/completions) for the app, with a configurable
+# prompt-eval delay, generation speed, model load time and error rate.
+#
+#   python benchmarks/fake_server.py --port 11435 --prompt-eval-delay 0.5 --tokens-per-second 30
+#
+# Then point the app at it: OLLAMA_URL=http://127.0.0.1:11435, or for OpenAI
+# OPENAI_API_BASE=http://127.0.0.1:11435/v1 with any OPENAI_API_KEY.
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "students will explore the topic through hands on activities and guided practice then share "
+    "their thinking with a partner before the class discusses key ideas and checks for understanding"
+).split()
+
+
+class FakeModelSettings:
+    def __init__(self, prompt_eval_delay=0.2, tokens_per_second=50.0, completion_tokens=200,
+                 load_delay=0.0, error_rate=0.0, models=('llama3:latest',)):
+        self.prompt_eval_delay = prompt_eval_delay
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.load_delay = load_delay # paid once per model, like Ollama loading it into memory
+        self.error_rate = error_rate
+        self.models = list(models)
+        self.loaded = set()
+        self.lock = threading.Lock()
+        self.requests = 0
+
+
+class FakeInferenceHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive, like the real servers
+    settings = None # set by make_server
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        settings = self.settings
+        if self.path == '/api/tags':
+            self._send_json(200, {'models': [
+                {'name': name, 'model': name, 'modified_at': datetime.now(timezone.utc).isoformat(), 'size': 0, 'digest': ''}
+                for name in settings.models
+            ]})
+        elif self.path == '/api/ps':
+            with settings.lock:
+                loaded = sorted(settings.loaded)
+            self._send_json(200, {'models': [{'name': name, 'model': name, 'size': 0, 'digest': ''} for name in loaded]})
+        elif self.path == '/v1/models':
+            self._send_json(200, {'object': 'list', 'data': [{'id': name, 'object': 'model'} for name in settings.models]})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path in ('/api/chat', '/api/generate'):
+            self._ollama(self._read_json(), chat=self.path == '/api/chat')
+        elif self.path == '/v1/chat/completions':
+            self._openai(self._read_json())
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def _prepare(self, model):
+        # Returns (load_seconds, prompt_eval_seconds) after sleeping for them, or None to fail the call
+        settings = self.settings
+        with settings.lock:
+            settings.requests += 1
+            needs_load = model not in settings.loaded
+            settings.loaded.add(model)
+        if random.random() < settings.error_rate:
+            return None
+        load = settings.load_delay if needs_load else 0.0
+        time.sleep(load + settings.prompt_eval_delay)
+        return load, settings.prompt_eval_delay
+
+    def _tokens(self, limit=None):
+        count = self.settings.completion_tokens if not limit else min(limit, self.settings.completion_tokens)
+        for i in range(count):
+            time.sleep(1.0 / self.settings.tokens_per_second)
+            yield WORDS[i % len(WORDS)] + ' '
+
+    def _ollama(self, body, chat):
+        model = body.get('model', '')
+        options = body.get('options') or {}
+        stream = body.get('stream', True)
+        prepared = self._prepare(model)
+        if prepared is None:
+            self._send_json(500, {'error': 'fake server: injected error'})
+            return
+        load, prompt_eval = prepared
+        if chat and not body.get('messages') or not chat and not body.get('prompt'):
+            # Empty request: Ollama just loads the model (used for warm-up)
+            self._send_json(200, {'model': model, 'created_at': datetime.now(timezone.utc).isoformat(), 'done': True,
+                                  'done_reason': 'load', **({'message': {'role': 'assistant', 'content': ''}} if chat else {'response': ''})})
+            return
+
+        limit = options.get('num_predict')
+        prompt_chars = sum(len(m.get('content', '')) for m in body.get('messages', [])) if chat else len(body.get('prompt', ''))
+        start = time.time()
+
+        def message(text, done, **extra):
+            content = {'message': {'role': 'assistant', 'content': text}} if chat else {'response': text}
+            return {'model': model, 'created_at': datetime.now(timezone.utc).isoformat(), 'done': done, **content, **extra}
+
+        tokens = []
+        if stream:
+            self._start_chunked('application/x-ndjson')
+        for token in self._tokens(limit):
+            tokens.append(token)
+            if stream:
+                self._write_chunk((json.dumps(message(token, False)) + '\n').encode('utf-8'))
+        eval_seconds = time.time() - start
+        final = dict(
+            done_reason='length' if limit and len(tokens) >= limit else 'stop',
+            total_duration=int((load + prompt_eval + eval_seconds) * 1e9),
+            load_duration=int(load * 1e9),
+            prompt_eval_count=max(1, prompt_chars // 4),
+            prompt_eval_duration=int(prompt_eval * 1e9),
+            eval_count=len(tokens),
+            eval_duration=int(eval_seconds * 1e9),
+        )
+        if stream:
+            self._write_chunk((json.dumps(message('', True, **final)) + '\n').encode('utf-8'))
+            self._end_chunked()
+        else:
+            self._send_json(200, message(''.join(tokens), True, **final))
+
+    def _openai(self, body):
+        model = body.get('model', '')
+        if self._prepare(model) is None:
+            self._send_json(500, {'error': {'message': 'fake server: injected error', 'type': 'server_error'}})
+            return
+        limit = body.get('max_tokens')
+        prompt_tokens = max(1, sum(len(m.get('content', '')) for m in body.get('messages', [])) // 4)
+        created = int(time.time())
+        if body.get('stream'):
+            self._start_chunked('text/event-stream')
+            count = 0
+            for token in self._tokens(limit):
+                count += 1
+                chunk = {'id': 'chatcmpl-fake', 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                         'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]}
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            finish = 'length' if limit and count >= limit else 'stop'
+            chunk = {'id': 'chatcmpl-fake', 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                     'choices': [{'index': 0, 'delta': {}, 'finish_reason': finish}]}
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._end_chunked()
+            return
+        tokens = list(self._tokens(limit))
+        self._send_json(200, {
+            'id': 'chatcmpl-fake', 'object': 'chat.completion', 'created': created, 'model': model,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(tokens)},
+                         'finish_reason': 'length' if limit and len(tokens) >= limit else 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(tokens), 'total_tokens': prompt_tokens + len(tokens)},
+        })
+
+
+def make_server(host='127.0.0.1', port=11435, settings=None):
+    handler = type('Handler', (FakeInferenceHandler,), {'settings': settings or FakeModelSettings()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stand-in Ollama/OpenAI server for load testing.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--prompt-eval-delay', type=float, default=0.2, help='seconds before the first token')
+    parser.add_argument('--tokens-per-second', type=float, default=50.0)
+    parser.add_argument('--completion-tokens', type=int, default=200, help='tokens per answer (capped by num_predict/max_tokens)')
+    parser.add_argument('--load-delay', type=float, default=0.0, help='one-off model load time per model')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of calls that fail with HTTP 500')
+    parser.add_argument('--model', action='append', dest='models', help='model name to advertise (repeatable)')
+    args = parser.parse_args()
+
+    settings = FakeModelSettings(
+        prompt_eval_delay=args.prompt_eval_delay, tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens, load_delay=args.load_delay,
+        error_rate=args.error_rate, models=args.models or ('llama3:latest',)
+    )
+    server = make_server(args.host, args.port, settings)
+    print(f"Fake inference server listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
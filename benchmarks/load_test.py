@@ -0,0 +1,231 @@
+# Load test for the five tool routes.
+# Drives /social_media_post, /lesson_hook, /math_spiral_review, /decodable_text and
+# /lesson_plan at a fixed concurrency and reports throughput and p50/p95/p99 latency,
+# overall and per tool. Results are written as JSON so runs can be compared.
+#
+# Self-contained run (starts the fake inference server and the app in this process):
+#   python benchmarks/load_test.py --start-fake-server --start-app --requests 200 --concurrency 16
+#
+# Against a running app (which is pointed at real or fake inference servers):
+#   python benchmarks/load_test.py --base-url http://127.0.0.1:5000 --ollama-url http://gpu1:11434
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TOOLS = ('social_media_post', 'lesson_hook', 'math_spiral_review', 'decodable_text', 'lesson_plan')
+
+ERROR_MARKERS = ("An error occurred", "The generation took too long", "The generation queue is full")
+
+
+def tool_form(tool, unique):
+    # Representative inputs for each tool; unique adds a random tag so the response cache doesn't answer
+    tag = f" ({uuid.uuid4().hex[:8]})" if unique else ''
+    if tool == 'social_media_post':
+        return {'topic': 'our school science fair' + tag, 'audience': 'parents', 'tone': 'excited'}
+    if tool == 'lesson_hook':
+        return {'subject_topic': 'photosynthesis' + tag, 'grade_level': '5', 'tone': 'mysterious',
+                'hook_type': 'question', 'time_limit': '5 minutes'}
+    if tool == 'math_spiral_review':
+        return {'grade_level': '4th Grade', 'topics_covered': ['Fractions', 'Multiplication', 'Geometry'],
+                'todays_focus': 'equivalent fractions' + tag, 'difficulty': 'Medium', 'num_questions': '10',
+                'question_types': ['Multiple Choice', 'Word Problems']}
+    if tool == 'decodable_text':
+        return {'phonics_patterns': ['sh /sh/ ship, shop', 'ch /ch/ chin, chip', 'ck /k/ back, duck'],
+                'num_texts': '2', 'special_instructions': 'about a duck' + tag}
+    return {'grade_level': '3rd Grade', 'topic_standard_objective': 'the water cycle' + tag,
+            'additional_criteria': '45 minutes, one hands-on activity'}
+
+
+def percentile(values, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not values:
+        return None
+    rank = max(1, math.ceil(fraction * len(values)))
+    return values[rank - 1]
+
+
+def summarize(samples, wall_time):
+    latencies = sorted(sample['latency'] for sample in samples if sample['ok'])
+    return {
+        'requests': len(samples),
+        'succeeded': len(latencies),
+        'failed': len(samples) - len(latencies),
+        'throughput_rps': round(len(latencies) / wall_time, 3) if wall_time else None,
+        'latency_seconds': {
+            'mean': round(sum(latencies) / len(latencies), 4) if latencies else None,
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1] if latencies else None,
+        },
+    }
+
+
+class LoadTest:
+    def __init__(self, base_url, tools, requests_total, concurrency, mode, unique, ollama_url, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.tools = tools
+        self.requests_total = requests_total
+        self.concurrency = concurrency
+        self.mode = mode
+        self.unique = unique
+        self.ollama_url = ollama_url
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _session(self):
+        # One session (cookie jar + keep-alive connection) per simulated teacher
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            if self.ollama_url:
+                session.post(f"{self.base_url}/", data={
+                    'inference_server': 'ollama', 'ollama_ip': self.ollama_url, 'ollama_model': 'llama3:latest'
+                }, timeout=self.timeout)
+            else:
+                session.get(f"{self.base_url}/", timeout=self.timeout) # picks up the session cookie jobs are charged to
+        return session
+
+    def _run_one(self, index):
+        tool = self.tools[index % len(self.tools)]
+        session = self._session()
+        url = f"{self.base_url}/{tool}"
+        start = time.perf_counter()
+        ok = False
+        status = None
+        try:
+            if self.mode == 'job':
+                ok, status = self._run_job(session, url, tool)
+            else:
+                response = session.post(url, data=tool_form(tool, self.unique), timeout=self.timeout)
+                status = response.status_code
+                ok = status == 200 and not any(marker in response.text for marker in ERROR_MARKERS)
+        except requests.RequestException as e:
+            status = type(e).__name__
+        return {'tool': tool, 'latency': time.perf_counter() - start, 'ok': ok, 'status': status}
+
+    def _run_job(self, session, url, tool):
+        # Submit the way the tool pages' scripts do, then poll until the job finishes. skip_similar
+        # asks for a new generation rather than earlier answers to similar inputs.
+        form = dict(tool_form(tool, self.unique), skip_similar='1')
+        response = session.post(url, data=form, headers={'Accept': 'application/json'}, timeout=self.timeout)
+        if response.status_code != 202:
+            return False, response.status_code
+        status_url = self.base_url + response.json()['status_url']
+        while True:
+            job = session.get(status_url, headers={'Accept': 'application/json'}, timeout=self.timeout).json()
+            if job['status'] not in ('queued', 'running'):
+                return job['status'] == 'done', job['status']
+            time.sleep(0.1)
+
+    def run(self):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            samples = list(pool.map(self._run_one, range(self.requests_total)))
+        wall_time = time.perf_counter() - start
+        return samples, wall_time
+
+
+def start_fake_server(args):
+    from benchmarks.fake_server import FakeModelSettings, make_server
+    settings = FakeModelSettings(
+        prompt_eval_delay=args.prompt_eval_delay, tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens, error_rate=args.error_rate
+    )
+    server = make_server('127.0.0.1', 0, settings)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def start_app():
+    import logging
+    from werkzeug.serving import make_server as make_wsgi_server
+    logging.getLogger('werkzeug').setLevel(logging.WARNING) # one access-log line per request would swamp the report
+    from open_source_magic_tools import create_app
+    app = create_app()
+    server = make_wsgi_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the tool routes and report latency percentiles.')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000', help='app to test (ignored with --start-app)')
+    parser.add_argument('--start-app', action='store_true', help='run the app in this process')
+    parser.add_argument('--start-fake-server', action='store_true', help='run the fake inference server in this process')
+    parser.add_argument('--ollama-url', help='Ollama host(s) to save in each session (defaults to the fake server if started)')
+    parser.add_argument('--tool', action='append', choices=TOOLS, dest='tools', help='tool to drive (repeatable; default all five)')
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--mode', choices=('form', 'job'), default='form',
+                        help='form: plain form posts that wait for the page; job: submit and poll like the page scripts')
+    parser.add_argument('--repeat-inputs', action='store_true', help='send identical inputs so the response cache can answer')
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--output', default=None, help='JSON results file (default benchmarks/results/<timestamp>.json)')
+    fake = parser.add_argument_group('fake inference server (with --start-fake-server)')
+    fake.add_argument('--prompt-eval-delay', type=float, default=0.2)
+    fake.add_argument('--tokens-per-second', type=float, default=50.0)
+    fake.add_argument('--completion-tokens', type=int, default=200)
+    fake.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    ollama_url = args.ollama_url
+    if args.start_fake_server:
+        fake_url = start_fake_server(args)
+        ollama_url = ollama_url or fake_url
+        # The app reads OLLAMA_URL/OLLAMA_HOSTS at import, so set them before starting it
+        os.environ.setdefault('OLLAMA_URL', fake_url)
+        os.environ.setdefault('OLLAMA_HOSTS', fake_url)
+    if args.start_app:
+        # Each simulated teacher submits back to back, far above a real teacher's rate; measure
+        # throughput rather than the per-session rate limits (the caps and fair queuing still apply)
+        os.environ.setdefault('JOB_SESSION_REQUESTS_PER_MINUTE', '0')
+        os.environ.setdefault('JOB_SESSION_TOKENS_PER_MINUTE', '0')
+    base_url = start_app() if args.start_app else args.base_url
+
+    test = LoadTest(base_url, tuple(args.tools or TOOLS), args.requests, args.concurrency,
+                    args.mode, not args.repeat_inputs, ollama_url, args.timeout)
+    samples, wall_time = test.run()
+
+    results = {
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'wall_time_seconds': round(wall_time, 3),
+        'overall': summarize(samples, wall_time),
+        'per_tool': {
+            tool: summarize([sample for sample in samples if sample['tool'] == tool], wall_time)
+            for tool in (args.tools or TOOLS)
+        },
+        'failures': [sample for sample in samples if not sample['ok']][:20],
+    }
+
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results',
+                                         datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    overall = results['overall']
+    latency = overall['latency_seconds']
+    print(f"{overall['succeeded']}/{overall['requests']} succeeded in {results['wall_time_seconds']}s "
+          f"({overall['throughput_rps']} req/s)")
+    print(f"latency p50={latency['p50']} p95={latency['p95']} p99={latency['p99']}")
+    for tool, summary in results['per_tool'].items():
+        tool_latency = summary['latency_seconds']
+        print(f"  {tool:<20} ok={summary['succeeded']:<5} p50={tool_latency['p50']} p95={tool_latency['p95']} p99={tool_latency['p99']}")
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# Prompt-eval savings from sending each tool's fixed instructions as a shared system message.
+# For every tool this prints how much of a typical prompt is the fixed system prefix and,
+# given a real Ollama host, measures prompt_eval_duration for back-to-back calls with different
+# teacher inputs in two layouts:
+#   single  - one user message with the instructions mixed in (the old layout)
+#   system  - fixed system message + variable user message (the current layout)
+# With the system layout the second call only evaluates the tokens after the cached prefix.
+#
+#   python benchmarks/prompt_prefix.py --ollama-url http://localhost:11434 --model llama3:latest
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load_test import TOOLS, tool_form
+from open_source_magic_tools.prompts import PROMPT_BUILDERS, SYSTEM_PROMPTS
+
+
+class Form(dict):
+    # Enough of werkzeug's MultiDict for the prompt builders
+    def get(self, key, default=None):
+        value = super().get(key, default)
+        return value[0] if isinstance(value, list) and value else value
+
+    def getlist(self, key):
+        value = super().get(key, [])
+        return value if isinstance(value, list) else [value]
+
+
+def layouts(tool):
+    user = PROMPT_BUILDERS[tool](Form(tool_form(tool, unique=True)))
+    system = SYSTEM_PROMPTS[tool]
+    return {
+        'single': [{'role': 'user', 'content': f"{user} {system}"}],
+        'system': [{'role': 'system', 'content': system}, {'role': 'user', 'content': user}],
+    }
+
+
+def measure(client, model, tool, layout, calls):
+    # prompt_eval seconds and tokens of each call; the first call primes the cache
+    results = []
+    for _ in range(calls):
+        response = client.chat(model=model, messages=layouts(tool)[layout], options={'num_predict': 1})
+        results.append({
+            'prompt_eval_seconds': (response.get('prompt_eval_duration') or 0) / 1e9,
+            'prompt_eval_count': response.get('prompt_eval_count'),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure prompt-eval savings from the tools' shared system prefixes.")
+    parser.add_argument('--ollama-url', help='Ollama host to measure against (without it only the prefix sizes are printed)')
+    parser.add_argument('--model', default='llama3:latest')
+    parser.add_argument('--calls', type=int, default=4, help='calls per tool and layout')
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    report = {'model': args.model, 'tools': {}}
+    client = None
+    if args.ollama_url:
+        import ollama
+        client = ollama.Client(host=args.ollama_url)
+        client.chat(model=args.model, messages=[]) # load the model so it isn't counted
+
+    print(f"{'tool':<20} {'prefix chars':>12} {'prefix share':>12} {'single (s)':>11} {'system (s)':>11} {'saved':>7}")
+    for tool in TOOLS:
+        messages = layouts(tool)['system']
+        prefix, user = len(messages[0]['content']), len(messages[1]['content'])
+        entry = {'prefix_chars': prefix, 'user_chars': user, 'prefix_share': round(prefix / (prefix + user), 3)}
+        line = f"{tool:<20} {prefix:>12} {entry['prefix_share']:>12.0%}"
+        if client is not None:
+            for layout in ('single', 'system'):
+                calls = measure(client, args.model, tool, layout, args.calls)
+                warm = calls[1:] or calls
+                entry[layout] = {
+                    'calls': calls,
+                    'mean_prompt_eval_seconds': sum(call['prompt_eval_seconds'] for call in warm) / len(warm),
+                }
+            single, system = entry['single']['mean_prompt_eval_seconds'], entry['system']['mean_prompt_eval_seconds']
+            entry['saved_share'] = round(1 - system / single, 3) if single else None
+            line += f" {single:>11.4f} {system:>11.4f} {entry['saved_share'] or 0:>7.0%}"
+        report['tools'][tool] = entry
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
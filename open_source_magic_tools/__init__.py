@@ -7,6 +7,9 @@ def create_app():
     # Configure the application
     app.config.from_object('open_source_magic_tools.config')
 
+    from .logs import configure_logging
+    configure_logging(app.config['LOG_LEVEL'], structured=app.config['LOG_STRUCTURED'])
+
     # Ensure the instance folder exists
     try:
         os.makedirs(app.instance_path)
@@ -23,8 +26,92 @@ def create_app():
 
     app.secret_key = 'your_secret_key'
 
+    # Cache generated responses so repeated submissions skip the model
+    if app.config['RESPONSE_CACHE_ENABLED']:
+        from .cache import ResponseCache
+        app.extensions['response_cache'] = ResponseCache(
+            max_entries=app.config['RESPONSE_CACHE_MAX_ENTRIES'],
+            ttl=app.config['RESPONSE_CACHE_TTL'],
+            db_path=os.path.join(app.instance_path, 'response_cache.sqlite3') if app.config['RESPONSE_CACHE_DISK'] else None,
+            max_db_entries=app.config['RESPONSE_CACHE_DISK_MAX_ENTRIES']
+        )
+
+    # Keep each user's settings on the server instead of in the session cookie
+    from .settings import SettingsStore
+    app.extensions['settings_store'] = SettingsStore(
+        db_path=os.path.join(app.instance_path, 'settings.sqlite3') if app.config['SETTINGS_STORE_DISK'] else None,
+        ttl=app.config['SETTINGS_STORE_TTL']
+    )
+
+    # Remember finished generations so similar requests can reuse them
+    if app.config['GENERATION_INDEX_ENABLED']:
+        from .generation_index import GenerationIndex
+        app.extensions['generation_index'] = GenerationIndex(
+            os.path.join(app.instance_path, 'generations.sqlite3'),
+            threshold=app.config['GENERATION_INDEX_THRESHOLD'],
+            max_entries=app.config['GENERATION_INDEX_MAX_ENTRIES']
+        )
+        app.extensions['generation_index'].load()
+
+    # Phonics pattern tries for scoring decodable texts, built once instead of per request
+    from .phonics import PhonicsMatcher
+    app.extensions['phonics_matcher'] = PhonicsMatcher()
+
+    # Let identical concurrent generations share one upstream inference
+    if app.config['SINGLE_FLIGHT_ENABLED']:
+        from .singleflight import SingleFlight
+        app.extensions['single_flight'] = SingleFlight(
+            lock_dir=os.path.join(app.instance_path, 'inflight') if app.config['SINGLE_FLIGHT_CROSS_PROCESS'] else None,
+            lock_timeout=app.config['SINGLE_FLIGHT_LOCK_TIMEOUT']
+        )
+
+    # Share one background-refreshed Ollama model list per host across all sessions
+    from .model_catalog import ModelCatalog
+    from .ollama_utils import fetch_ollama_models
+    app.extensions['model_catalog'] = ModelCatalog(
+        fetch_ollama_models,
+        ttl=app.config['MODEL_CATALOG_TTL'],
+        error_ttl=app.config['MODEL_CATALOG_ERROR_TTL'],
+        refresh_interval=app.config['MODEL_CATALOG_REFRESH_INTERVAL']
+    )
+
+    # Balance Ollama generations across all configured hosts
+    from .backend_pool import OllamaBackendPool
+    app.extensions['ollama_pool'] = OllamaBackendPool(health_interval=app.config['OLLAMA_HEALTH_INTERVAL'])
+
+    # Load the default model on the configured hosts so the first generation doesn't wait for it
+    if app.config['OLLAMA_WARM_UP']:
+        from .ollama_utils import warm_up_model
+        from .settings import UserSettings, generation_settings
+        with app.app_context():
+            warm_up_model(generation_settings(UserSettings.defaults(app.config), app.config))
+
+    # Run generations on a bounded worker pool instead of inside the request, with per-session
+    # caps and rate limits and fair queuing between sessions
+    from .admission import AdmissionController
+    from .jobs import JobQueue
+    app.extensions['job_queue'] = JobQueue(
+        app,
+        workers=app.config['JOB_WORKERS'],
+        max_queue=app.config['JOB_MAX_QUEUE'],
+        timeout=app.config['JOB_TIMEOUT'],
+        backend_limits=app.config['JOB_BACKEND_LIMITS'],
+        result_ttl=app.config['JOB_RESULT_TTL'],
+        admission=AdmissionController(
+            session_limit=app.config['JOB_SESSION_CONCURRENCY'],
+            session_max_queued=app.config['JOB_SESSION_MAX_QUEUED'],
+            session_requests_per_minute=app.config['JOB_SESSION_REQUESTS_PER_MINUTE'],
+            session_tokens_per_minute=app.config['JOB_SESSION_TOKENS_PER_MINUTE'],
+            backend_rates=app.config['JOB_BACKEND_RATE_LIMITS']
+        )
+    )
+
     # Import and register blueprints or routes here
     from . import routes
     app.register_blueprint(routes.bp)
 
+    # flask bulk-generate: run a CSV/JSONL file of tool inputs without the web forms
+    from .bulk import bulk_generate_command
+    app.cli.add_command(bulk_generate_command)
+
     return app
\ No newline at end of file
@@ -0,0 +1,228 @@
+# Admission control for the generation job queue, so one busy user can't starve the others.
+# Every job belongs to a client (the browser session) and is charged an estimated token cost:
+#   - per client: at most session_limit requests running and session_max_queued waiting, and
+#     token buckets for requests and estimated tokens per minute, where a request is one job or
+#     a group submitted together (the sections of one lesson plan). Going over is refused right
+#     away with RateLimitedError, which carries the seconds until a retry can succeed.
+#   - per backend: optional token buckets (e.g. to stay inside an OpenAI rate limit). A job
+#     whose backend bucket is empty stays queued until it refills instead of failing upstream.
+# Among the jobs allowed to start, the queue uses weighted fair queuing: each job is tagged with
+# a virtual finish time (the client's previous finish tag, or the current virtual time if later,
+# plus cost / weight) and the smallest tag goes first. A client with many queued jobs therefore
+# takes turns with everyone else instead of holding the head of the queue. The virtual time is
+# the finish tag of the latest job to start (self-clocked fair queuing), so it keeps moving as
+# jobs are served and a large job waits for a bounded amount of smaller work, not indefinitely.
+# A job's cost is an estimate: its input plus the typical length of the tool's recent answers
+# (a typical answer of any tool until one has finished), at most its output cap rather than the
+# cap itself, which few answers reach. When the job finishes it is charged what it actually
+# used: the difference goes back into the token buckets and moves the client's finish tag.
+# The controller isn't thread-safe on its own; JobQueue calls it while holding its lock.
+import math
+import time
+
+
+class QueueFullError(Exception):
+    def __init__(self, message, retry_after=10, reason='queue_full'):
+        super().__init__(message)
+        self.retry_after = retry_after # seconds, for the Retry-After header
+        self.reason = reason # label for the rejections metric
+
+
+class RateLimitedError(QueueFullError):
+    pass
+
+
+def estimate_tokens(prompt, system=None, profile=None, continue_from=None, output_tokens=None):
+    # About 4 characters per token for the input, plus the expected output: output_tokens if
+    # given, at most the output cap (or a typical answer without a profile)
+    characters = len(prompt) + len(system or '') + len(continue_from or '')
+    cap = profile.max_tokens if profile is not None else 1000
+    return characters // 4 + (min(cap, output_tokens) if output_tokens is not None else cap)
+
+
+def used_tokens(job):
+    # What a finished job actually cost: its input plus the completion tokens the backend
+    # reported, or about 4 characters per token of its output when it reported none
+    completion = job.usage.get('completion_tokens')
+    if completion is None:
+        completion = len(job.output) // 4
+    return estimate_tokens(job.prompt, job.system, job.profile, job.continue_from, output_tokens=completion)
+
+
+class TokenBucket:
+    def __init__(self, per_minute, burst=None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst or per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        # Seconds until amount can be taken; amounts above the capacity only need a full bucket
+        self._refill()
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def give(self, amount):
+        # Return tokens taken for an estimate that turned out too high
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    @property
+    def full(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+def _bucket(per_minute):
+    return TokenBucket(per_minute) if per_minute else None
+
+
+class AdmissionController:
+    # Expected completion tokens before a tool has any finished answers, and the weight of the
+    # latest answer in the moving average after that
+    DEFAULT_OUTPUT_TOKENS = 1000
+    OUTPUT_SMOOTHING = 0.2
+
+    def __init__(self, session_limit=1, session_max_queued=4, session_requests_per_minute=30,
+                 session_tokens_per_minute=60000, backend_rates=None):
+        self.session_limit = session_limit
+        self.session_max_queued = session_max_queued
+        self.session_requests_per_minute = session_requests_per_minute
+        self.session_tokens_per_minute = session_tokens_per_minute
+        # backend -> {'requests_per_minute': n, 'tokens_per_minute': n}; 0 or missing means no limit
+        self._backend_buckets = {
+            backend: (_bucket(rates.get('requests_per_minute')), _bucket(rates.get('tokens_per_minute')))
+            for backend, rates in (backend_rates or {}).items()
+        }
+        self._sessions = {} # client -> {'queued', 'running', 'requests', 'tokens', 'last_finish'}
+        self._output_tokens = {} # (tool, output cap) -> moving average of its answers' completion tokens
+        self._virtual_time = 0.0
+
+    def reset(self):
+        # Forget queued and running jobs (a forked worker process starts with an empty queue)
+        self._sessions.clear()
+        self._virtual_time = 0.0
+
+    def _session(self, client):
+        session = self._sessions.get(client)
+        if session is None:
+            session = self._sessions[client] = {
+                'queued': {}, 'running': {}, 'last_finish': 0.0, # group -> number of its jobs
+                'requests': _bucket(self.session_requests_per_minute), 'tokens': _bucket(self.session_tokens_per_minute),
+            }
+        return session
+
+    @staticmethod
+    def _add(counts, group, amount):
+        counts[group] = counts.get(group, 0) + amount
+        if not counts[group]:
+            del counts[group]
+
+    def admit(self, jobs):
+        # Charge a request's jobs to its client and give them fair-queuing tags, or raise
+        # RateLimitedError. The jobs of one group (e.g. the sections of a lesson plan) count as
+        # one request towards the caps and the requests bucket, but each pays its own tokens.
+        session = self._session(jobs[0].client)
+        group = jobs[0].group
+        for job in jobs:
+            job.cost = estimate_tokens(job.prompt, job.system, job.profile, job.continue_from, self._typical_output(job))
+        new_request = group not in session['queued'] and group not in session['running']
+        if new_request and len(session['queued']) >= self.session_max_queued:
+            raise RateLimitedError(
+                f"You already have {len(session['queued'])} generations waiting. Please wait for them to finish.",
+                retry_after=10, reason='session_queue'
+            )
+        charges = ((session['requests'], int(new_request)), (session['tokens'], sum(job.cost for job in jobs)))
+        waits = [bucket.wait_time(amount) for bucket, amount in charges if bucket]
+        if waits and max(waits) > 0:
+            raise RateLimitedError(
+                "You're generating faster than the shared server allows. Please try again shortly.",
+                retry_after=math.ceil(max(waits)), reason='session_rate'
+            )
+        for bucket, amount in charges:
+            if bucket:
+                bucket.take(amount)
+        for job in jobs:
+            job.finish_tag = max(self._virtual_time, session['last_finish']) + job.cost / job.weight
+            session['last_finish'] = job.finish_tag
+        self._add(session['queued'], group, len(jobs))
+
+    def _output_key(self, job):
+        return (job.tool, job.profile.max_tokens if job.profile is not None else None)
+
+    def _typical_output(self, job):
+        return round(self._output_tokens.get(self._output_key(job), self.DEFAULT_OUTPUT_TOKENS))
+
+    def _settle(self, job, used, started):
+        # Charge the job what it used instead of its estimate; only started jobs were charged to the backend
+        difference = job.cost - used
+        if not difference:
+            return
+        session = self._session(job.client)
+        buckets = [session['tokens']]
+        if started:
+            buckets.append(self._backend_buckets.get(job.settings.backend, (None, None))[1])
+        for bucket in buckets:
+            if bucket is None:
+                continue
+            if difference > 0:
+                bucket.give(difference)
+            else:
+                bucket.take(-difference)
+        session['last_finish'] -= difference / job.weight
+        job.cost = used
+
+    def backend_wait(self, job):
+        # Seconds until the job's backend buckets allow it to start
+        requests, tokens = self._backend_buckets.get(job.settings.backend, (None, None))
+        return max([bucket.wait_time(amount) for bucket, amount in ((requests, 1), (tokens, job.cost)) if bucket] or [0.0])
+
+    def can_start(self, job):
+        # Jobs of a group that is already running don't take another of the client's slots
+        running = self._session(job.client)['running']
+        return (job.group in running or len(running) < self.session_limit) and self.backend_wait(job) == 0
+
+    def started(self, job):
+        session = self._session(job.client)
+        self._add(session['queued'], job.group, -1)
+        self._add(session['running'], job.group, 1)
+        for bucket, amount in zip(self._backend_buckets.get(job.settings.backend, (None, None)), (1, job.cost)):
+            if bucket:
+                bucket.take(amount)
+        self._virtual_time = max(self._virtual_time, job.finish_tag)
+
+    def dequeued(self, job):
+        # A queued job was cancelled before it used anything
+        self._add(self._session(job.client)['queued'], job.group, -1)
+        self._settle(job, 0, started=False)
+
+    def finished(self, job):
+        self._add(self._session(job.client)['running'], job.group, -1)
+        completion = job.usage.get('completion_tokens')
+        if completion is not None:
+            # Learn the tool's typical answer length from what the backend reported
+            key = self._output_key(job)
+            average = self._output_tokens.get(key)
+            self._output_tokens[key] = completion if average is None else average + self.OUTPUT_SMOOTHING * (completion - average)
+        self._settle(job, used_tokens(job), started=True)
+
+    def client_status(self, client):
+        # Requests (job groups) the client has waiting and running
+        session = self._sessions.get(client)
+        return {'queued': len(session['queued']), 'running': len(session['running'])} if session else {'queued': 0, 'running': 0}
+
+    def prune(self):
+        # Drop clients with nothing queued or running whose buckets have refilled
+        for client in [client for client, session in self._sessions.items()
+                       if not session['queued'] and not session['running']
+                       and all(bucket is None or bucket.full for bucket in (session['requests'], session['tokens']))]:
+            del self._sessions[client]
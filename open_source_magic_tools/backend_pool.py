@@ -0,0 +1,191 @@
+# Load balancing across several Ollama hosts.
+# Every generation asks the pool which hosts to try, in order: healthy hosts first, then hosts
+# that already have the requested model loaded (from /api/ps), then the fewest outstanding
+# requests. A failed call marks the host unhealthy and the caller fails over to the next one;
+# a background thread re-checks recently used hosts so they come back once they recover.
+# warm_up() loads a model ahead of the first call so that call doesn't pay the load time.
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from .clients import get_client
+
+logger = logging.getLogger(__name__)
+
+
+def parse_hosts(value):
+    # "http://gpu1:11434, http://gpu2:11434" -> ('http://gpu1:11434', 'http://gpu2:11434')
+    if isinstance(value, (list, tuple)):
+        items = value
+    else:
+        items = (value or '').replace('\n', ',').split(',')
+    hosts = []
+    for item in items:
+        host = item.strip().rstrip('/')
+        if host and host not in hosts:
+            hosts.append(host)
+    return tuple(hosts)
+
+
+class HostState:
+    def __init__(self, host):
+        self.host = host
+        self.healthy = True
+        self.outstanding = 0
+        self.loaded_models = set()
+        self.last_error = None
+        self.checked_at = None
+        self.used_at = time.time()
+
+    def to_dict(self):
+        return {
+            'host': self.host,
+            'healthy': self.healthy,
+            'outstanding': self.outstanding,
+            'loaded_models': sorted(self.loaded_models),
+            'last_error': self.last_error,
+            'checked_at': self.checked_at,
+        }
+
+
+class OllamaBackendPool:
+    def __init__(self, health_interval=15, idle_timeout=3600):
+        self.health_interval = health_interval
+        self.idle_timeout = idle_timeout # stop health checks for hosts nobody has used
+        self._states = {}
+        self._lock = threading.Lock()
+        self._order = itertools.count() # tie-breaker so equally loaded hosts take turns
+        self._warming = set() # (host, model) warm-ups in progress
+        self._checker_pid = None
+
+    def _state(self, host):
+        state = self._states.get(host)
+        if state is None:
+            state = self._states[host] = HostState(host)
+        return state
+
+    def candidates(self, hosts, model):
+        # The hosts to try for one call, best first
+        self._ensure_checker()
+        with self._lock:
+            states = [self._state(host) for host in hosts]
+            now = time.time()
+            for state in states:
+                state.used_at = now
+            turn = next(self._order)
+            ranked = sorted(
+                enumerate(states),
+                key=lambda item: (
+                    not item[1].healthy,
+                    model not in item[1].loaded_models,
+                    item[1].outstanding,
+                    (item[0] - turn) % len(states),
+                )
+            )
+        return [state.host for _, state in ranked]
+
+    @contextmanager
+    def lease(self, host):
+        # Count the call as outstanding on host while it runs
+        with self._lock:
+            self._state(host).outstanding += 1
+        try:
+            yield get_client('ollama', host)
+        finally:
+            with self._lock:
+                self._state(host).outstanding -= 1
+
+    def mark_failed(self, host, error):
+        logger.warning("Ollama host failed, failing over", extra={'host': host, 'error': str(error)})
+        with self._lock:
+            state = self._state(host)
+            state.healthy = False
+            state.last_error = str(error)
+
+    def mark_succeeded(self, host, model):
+        with self._lock:
+            state = self._state(host)
+            state.healthy = True
+            state.last_error = None
+            # The model is loaded now that it has answered
+            state.loaded_models.add(model)
+
+    def warm_up(self, hosts, model, keep_alive=None, options=None):
+        # Load model on each host in the background, skipping hosts that already have it in memory
+        started = []
+        with self._lock:
+            for host in hosts:
+                if model in self._state(host).loaded_models or (host, model) in self._warming:
+                    continue
+                self._warming.add((host, model))
+                started.append(host)
+        for host in started:
+            threading.Thread(target=self._warm_up, args=(host, model, keep_alive, options), name="ollama-warm-up", daemon=True).start()
+        return started
+
+    def _warm_up(self, host, model, keep_alive, options):
+        start = time.perf_counter()
+        try:
+            with self.lease(host) as client:
+                # A chat without messages only loads the model (and sets its keep_alive); options
+                # carry the num_ctx later calls use, so they don't reload it with another size
+                client.chat(model=model, messages=[], options=options, keep_alive=keep_alive)
+        except Exception as e:
+            # Often just a model this host doesn't have; not a reason to mark the host down
+            logger.warning("Ollama warm-up failed", extra={'host': host, 'model': model, 'error': str(e)})
+        else:
+            self.mark_succeeded(host, model)
+            logger.info("Ollama model warmed up", extra={
+                'host': host, 'model': model, 'duration': round(time.perf_counter() - start, 3)
+            })
+        finally:
+            with self._lock:
+                self._warming.discard((host, model))
+
+    def check(self, host):
+        # Health check: /api/ps answers quickly and tells us which models are in memory
+        try:
+            response = get_client('ollama', host).ps()
+            loaded = {model.model for model in response['models']}
+        except Exception as e:
+            with self._lock:
+                state = self._state(host)
+                state.healthy = False
+                state.last_error = str(e)
+                state.checked_at = time.time()
+            return False
+        with self._lock:
+            state = self._state(host)
+            state.healthy = True
+            state.last_error = None
+            state.loaded_models = loaded
+            state.checked_at = time.time()
+        return True
+
+    def status(self):
+        with self._lock:
+            return [state.to_dict() for state in self._states.values()]
+
+    def _ensure_checker(self):
+        # Threads don't survive a fork, so each worker process starts its own checker
+        if self._checker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._checker_pid == os.getpid():
+                return
+            self._checker_pid = os.getpid()
+            for state in self._states.values():
+                state.outstanding = 0
+        threading.Thread(target=self._check_loop, name="ollama-health-checker", daemon=True).start()
+
+    def _check_loop(self):
+        while True:
+            time.sleep(self.health_interval)
+            now = time.time()
+            with self._lock:
+                hosts = [host for host, state in self._states.items() if now - state.used_at <= self.idle_timeout]
+            for host in hosts:
+                self.check(host)
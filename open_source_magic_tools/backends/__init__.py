@@ -0,0 +1,75 @@
+# Inference backends.
+# Each backend is a class in its own module, registered below by dotted path and imported the
+# first time it is used, so the app only pays for the SDKs it actually talks to.
+# A backend declares what it can do in CAPABILITIES:
+#   streaming - chat_stream() yields the answer as it is produced (otherwise it arrives in one piece)
+#   batching  - the server batches concurrent requests, so running several at once is cheap
+#   usage     - the backend reports token counts for the metrics
+# Backends hold no settings of their own: resolve_settings() turns a user's settings and the
+# app config into a GenerationSettings object once per request, and every call receives it,
+# along with the tool's GenerationProfile (output cap, temperature, stop sequences) if it has one.
+import importlib
+import threading
+
+_REGISTRY = {
+    'ollama': 'open_source_magic_tools.backends.ollama:OllamaBackend',
+    'openai': 'open_source_magic_tools.backends.openai:OpenAIBackend',
+    'openai_compatible': 'open_source_magic_tools.backends.openai_compatible:OpenAICompatibleBackend',
+}
+_instances = {}
+_lock = threading.Lock()
+
+
+class Backend:
+    name = None
+    # usage: blocking calls report token counts; stream_usage: streamed calls (all job queue calls) do too
+    CAPABILITIES = {'streaming': False, 'batching': False, 'usage': False, 'stream_usage': False}
+
+    def resolve_settings(self, user, config):
+        # user is a settings.UserSettings; returns a settings.GenerationSettings
+        raise NotImplementedError
+
+    def available(self, settings):
+        # Whether the settings are complete enough to call the backend
+        return True
+
+    def chat(self, settings, messages, usage=None, profile=None):
+        # One blocking completion; errors are raised to the caller.
+        # Token counts and timings reported by the backend are added to the usage dict, and
+        # usage['truncated'] is set when the answer stopped at the profile's max_tokens.
+        raise NotImplementedError
+
+    def chat_stream(self, settings, messages, usage=None, profile=None):
+        # Backends that can't stream return the whole answer as a single chunk
+        yield self.chat(settings, messages, usage, profile)
+
+
+def register_backend(name, path):
+    # path is "package.module:ClassName"; the module isn't imported until the backend is used
+    with _lock:
+        _REGISTRY[name] = path
+        _instances.pop(name, None)
+
+
+def backend_names():
+    return list(_REGISTRY)
+
+
+def get_backend(name):
+    # The backend instance for name, importing its module on first use; None if unknown
+    with _lock:
+        backend = _instances.get(name)
+        if backend is not None:
+            return backend
+        path = _REGISTRY.get(name)
+    if path is None:
+        return None
+    module_name, class_name = path.split(':')
+    cls = getattr(importlib.import_module(module_name), class_name)
+    with _lock:
+        return _instances.setdefault(name, cls())
+
+
+def capabilities(name):
+    backend = get_backend(name)
+    return dict(backend.CAPABILITIES) if backend is not None else {}
@@ -0,0 +1,105 @@
+# Ollama backend: calls go through the host pool, which picks the host and fails over to the
+# next one when a call errors. The ollama SDK itself is imported by the client registry when
+# the first client is created.
+import itertools
+
+from flask import current_app
+
+from . import Backend
+from ..backend_pool import parse_hosts
+from ..metrics import ollama_usage
+from ..profiles import context_window
+from ..settings import GenerationSettings
+
+
+def keep_alive_for(model, config):
+    # Per-model override, else the default; bare numbers are seconds (-1 keeps the model loaded)
+    value = config.get('OLLAMA_KEEP_ALIVE_MODELS', {}).get(model, config.get('OLLAMA_KEEP_ALIVE'))
+    if value in (None, ''):
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        return value
+    return int(number) if number.is_integer() else number
+
+
+def ollama_options(settings, messages, profile=None):
+    # Ollama request options for a call. num_ctx is always sent (when configured) so every call,
+    # warm-up included, asks for the same context size and the model isn't reloaded for it.
+    options = {}
+    if profile is not None:
+        options['num_predict'] = profile.max_tokens
+        if profile.temperature is not None:
+            options['temperature'] = profile.temperature
+        if profile.stop:
+            options['stop'] = profile.stop
+    if settings.num_ctx:
+        options['num_ctx'] = context_window(messages, profile.max_tokens if profile else 0, settings.num_ctx)
+    return options or None
+
+
+class OllamaBackend(Backend):
+    name = 'ollama'
+    # Ollama runs concurrent requests one after another unless OLLAMA_NUM_PARALLEL is raised
+    CAPABILITIES = {'streaming': True, 'batching': False, 'usage': True, 'stream_usage': True}
+
+    def resolve_settings(self, user, config):
+        # The Ollama IP/URL setting may list several hosts to balance across, comma separated
+        model = user.ollama_model or config['DEFAULT_OLLAMA_MODEL']
+        hosts = parse_hosts(user.ollama_ip or config.get('OLLAMA_HOSTS') or config.get('OLLAMA_URL', 'http://localhost:11434'))
+        return GenerationSettings(
+            self.name, model, hosts=hosts, keep_alive=keep_alive_for(model, config), num_ctx=config.get('OLLAMA_NUM_CTX')
+        )
+
+    def available(self, settings):
+        return bool(settings.hosts)
+
+    def chat(self, settings, messages, usage=None, profile=None):
+        usage = {} if usage is None else usage
+        options = ollama_options(settings, messages, profile)
+        pool = current_app.extensions['ollama_pool']
+        last_error = None
+        # Fail over to the next host when a call errors or times out
+        for ollama_host in pool.candidates(settings.hosts, settings.model):
+            try:
+                with pool.lease(ollama_host) as client:
+                    response = client.chat(model=settings.model, messages=messages, options=options, keep_alive=settings.keep_alive)
+            except Exception as e:
+                pool.mark_failed(ollama_host, e)
+                last_error = e
+                continue
+            pool.mark_succeeded(ollama_host, settings.model)
+            usage.update(ollama_usage(response))
+            return response['message']['content']
+        raise last_error
+
+    def chat_stream(self, settings, messages, usage=None, profile=None):
+        usage = {} if usage is None else usage
+        options = ollama_options(settings, messages, profile)
+        pool = current_app.extensions['ollama_pool']
+        last_error = None
+        for ollama_host in pool.candidates(settings.hosts, settings.model):
+            with pool.lease(ollama_host) as client:
+                # Fail over only until the first chunk arrives; after that the text is already on its way out
+                try:
+                    stream = client.chat(
+                        model=settings.model, messages=messages, stream=True, options=options, keep_alive=settings.keep_alive
+                    )
+                    first = next(stream, None)
+                except Exception as e:
+                    pool.mark_failed(ollama_host, e)
+                    last_error = e
+                    continue
+                pool.mark_succeeded(ollama_host, settings.model)
+                if first is None:
+                    return
+                for part in itertools.chain([first], stream):
+                    content = part['message']['content']
+                    if content:
+                        yield content
+                    if part.get('done'):
+                        # The final chunk carries the token counts, timings and done_reason
+                        usage.update(ollama_usage(part))
+                return
+        raise last_error
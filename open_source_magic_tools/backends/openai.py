@@ -0,0 +1,67 @@
+# OpenAI backend, through the legacy openai SDK (openai.ChatCompletion). The SDK is only
+# imported once someone actually selects OpenAI.
+import openai
+
+from . import Backend
+from ..clients import get_client, request_timeout
+from ..metrics import openai_usage, openai_truncated
+from ..settings import GenerationSettings
+from .openai_compatible import openai_params
+
+class _SharedSession:
+    # The pooled session as the SDK sees it. The SDK closes each thread's session after a few
+    # minutes and asks for a new one; that mustn't close the pool every other thread is using.
+    def __init__(self, session):
+        self._session = session
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+    def close(self):
+        pass
+
+
+# Route the OpenAI SDK through the pooled session from the client registry
+openai.requestssession = lambda: _SharedSession(get_client('openai'))
+
+
+class OpenAIBackend(Backend):
+    name = 'openai'
+    # Streamed responses from the legacy API carry no usage, so only blocking calls report tokens
+    CAPABILITIES = {'streaming': True, 'batching': True, 'usage': True, 'stream_usage': False}
+
+    def resolve_settings(self, user, config):
+        return GenerationSettings(self.name, user.openai_model or config['DEFAULT_OPENAI_MODEL'], api_key=config.get('OPENAI_API_KEY'))
+
+    def available(self, settings):
+        return bool(settings.api_key)
+
+    def chat(self, settings, messages, usage=None, profile=None):
+        usage = {} if usage is None else usage
+        response = openai.ChatCompletion.create(
+            model=settings.model,
+            messages=messages,
+            api_key=settings.api_key,
+            request_timeout=request_timeout(),
+            **openai_params(profile)
+        )
+        usage.update(openai_usage(response))
+        usage['truncated'] = openai_truncated(response.choices[0])
+        return response.choices[0].message['content']
+
+    def chat_stream(self, settings, messages, usage=None, profile=None):
+        usage = {} if usage is None else usage
+        stream = openai.ChatCompletion.create(
+            model=settings.model,
+            messages=messages,
+            stream=True,
+            api_key=settings.api_key,
+            request_timeout=request_timeout(),
+            **openai_params(profile)
+        )
+        for chunk in stream:
+            content = chunk.choices[0].delta.get('content')
+            if content:
+                yield content
+            if chunk.choices[0].get('finish_reason'):
+                usage['truncated'] = openai_truncated(chunk.choices[0])
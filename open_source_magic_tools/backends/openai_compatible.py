@@ -0,0 +1,82 @@
+# Backend for local servers that speak the OpenAI chat-completions API (llama.cpp server,
+# vLLM, LM Studio, ...). Talks plain HTTP through a pooled requests session, so it needs
+# no SDK and works with any server at OPENAI_COMPATIBLE_URL (e.g. http://localhost:8080/v1).
+import json
+
+from . import Backend
+from ..clients import get_client, request_timeout
+from ..metrics import openai_usage, openai_truncated
+from ..settings import GenerationSettings
+
+
+def openai_params(profile):
+    # Chat-completions parameters for a profile (also used by the OpenAI backend)
+    if profile is None:
+        return {}
+    params = {'max_tokens': profile.max_tokens}
+    if profile.temperature is not None:
+        params['temperature'] = profile.temperature
+    if profile.stop:
+        params['stop'] = profile.stop[:4] # the API accepts at most four
+    return params
+
+
+class OpenAICompatibleBackend(Backend):
+    name = 'openai_compatible'
+    # These servers batch concurrent requests (llama.cpp --parallel, vLLM continuous batching)
+    # Streamed token counts depend on the server honouring stream_options.include_usage
+    CAPABILITIES = {'streaming': True, 'batching': True, 'usage': True, 'stream_usage': True}
+
+    def resolve_settings(self, user, config):
+        url = config.get('OPENAI_COMPATIBLE_URL')
+        return GenerationSettings(
+            self.name, user.openai_compatible_model or config['DEFAULT_OPENAI_COMPATIBLE_MODEL'],
+            hosts=(url.rstrip('/'),) if url else (), api_key=config.get('OPENAI_COMPATIBLE_API_KEY')
+        )
+
+    def available(self, settings):
+        return bool(settings.hosts)
+
+    def _post(self, settings, payload, stream=False):
+        base_url = settings.hosts[0]
+        headers = {}
+        if settings.api_key:
+            headers['Authorization'] = f"Bearer {settings.api_key}"
+        response = get_client('openai_compatible', base_url).post(
+            f"{base_url}/chat/completions", json=payload, headers=headers, stream=stream, timeout=request_timeout()
+        )
+        response.raise_for_status()
+        return response
+
+    def chat(self, settings, messages, usage=None, profile=None):
+        usage = {} if usage is None else usage
+        response = self._post(settings, {'model': settings.model, 'messages': messages, **openai_params(profile)}).json()
+        usage.update(openai_usage(response))
+        usage['truncated'] = openai_truncated(response['choices'][0])
+        return response['choices'][0]['message']['content']
+
+    def chat_stream(self, settings, messages, usage=None, profile=None):
+        usage = {} if usage is None else usage
+        # include_usage asks for a last chunk with the token counts (servers that don't know it ignore it)
+        payload = {
+            'model': settings.model, 'messages': messages, 'stream': True, 'stream_options': {'include_usage': True},
+            **openai_params(profile)
+        }
+        with self._post(settings, payload, stream=True) as response:
+            # Decode ourselves: requests assumes ISO-8859-1 for text/event-stream without a charset
+            for line in response.iter_lines():
+                line = line.decode('utf-8')
+                if not line.startswith('data:'):
+                    continue
+                data = line[len('data:'):].strip()
+                if data == '[DONE]':
+                    break
+                chunk = json.loads(data)
+                if chunk.get('usage'):
+                    usage.update(openai_usage(chunk))
+                for choice in chunk.get('choices') or []:
+                    content = (choice.get('delta') or {}).get('content')
+                    if content:
+                        yield content
+                    if choice.get('finish_reason'):
+                        usage['truncated'] = openai_truncated(choice)
@@ -0,0 +1,272 @@
+# Bulk generation from the command line, for pre-generating a batch of tool outputs overnight:
+#
+#   flask --app run bulk-generate plans.csv plans.jsonl --concurrency 4
+#
+# Each input row holds one tool's form fields (CSV with a header, or JSONL objects) plus a
+# `tool` column, unless --tool gives it for every row. Multi-select fields (topics_covered,
+# question_types, phonics_patterns) are JSON lists, or ';'-separated in CSV. Prompts, system
+# messages and generation profiles are built exactly as for the web forms.
+# Rows are read lazily and at most a few per worker are in flight, so memory stays flat however
+# long the file is. Each result is appended to the output JSONL as soon as it finishes, and the
+# checkpoint file next to it records which rows are done: after a crash or Ctrl-C, running the
+# same command again carries on where it stopped. Failed rows are written with status "error"
+# and their input, so they can be pulled out and run again as a new input file.
+import csv
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from .backends import get_backend
+from .generation_index import normalize_inputs
+from .ollama_utils import generate_text
+from .profiles import PROFILE_BUILDERS
+from .prompts import PROMPT_BUILDERS, SYSTEM_PROMPTS, PromptInputError
+from .settings import UserSettings, generation_settings
+
+
+class RowForm:
+    # Read-only stand-in for request.form over one input row
+    def __init__(self, row):
+        self.row = {name: value for name, value in row.items() if name != 'tool' and value not in (None, '', [])}
+
+    def get(self, name, default=None):
+        value = self.row.get(name, default)
+        if isinstance(value, list):
+            return str(value[0]) if value else default
+        return str(value) if value is not None else None
+
+    def getlist(self, name):
+        value = self.row.get(name)
+        if value is None:
+            return []
+        if isinstance(value, list):
+            return [str(item) for item in value]
+        return [part.strip() for part in str(value).split(';') if part.strip()]
+
+    def keys(self):
+        return self.row.keys()
+
+
+def read_rows(path):
+    # (row number, row dict) for every data row, read one at a time; row numbers start at 1
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith('.jsonl'):
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = csv.DictReader(f)
+        for row_number, row in enumerate(rows, 1):
+            yield row_number, row
+
+
+def count_rows(path):
+    return sum(1 for _ in read_rows(path))
+
+
+class Checkpoint:
+    # Which rows are done: every row below next_row, plus the few finished out of order above it.
+    # Saved after every row by writing a new file and renaming it over the old one.
+    def __init__(self, path, input_path):
+        self.path = path
+        self.input_path = os.path.abspath(input_path)
+        self.next_row = 1
+        self.done_above = set()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, encoding='utf-8') as f:
+            state = json.load(f)
+        if state['input'] != self.input_path:
+            raise click.UsageError(f"{self.path} belongs to {state['input']}; use --restart to start over.")
+        self.next_row = state['next_row']
+        self.done_above = set(state['done_above'])
+        return True
+
+    def is_done(self, row_number):
+        return row_number < self.next_row or row_number in self.done_above
+
+    def mark_done(self, row_number):
+        self.done_above.add(row_number)
+        while self.next_row in self.done_above:
+            self.done_above.remove(self.next_row)
+            self.next_row += 1
+        self.save()
+
+    def save(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'input': self.input_path, 'next_row': self.next_row, 'done_above': sorted(self.done_above)}, f)
+        os.replace(temp_path, self.path)
+
+
+class Progress:
+    def __init__(self, total, already_done, interval=5):
+        self.total = total
+        self.already_done = already_done
+        self.interval = interval
+        self.done = 0
+        self.errors = 0
+        self.tokens = 0
+        self.started_at = time.time()
+        self.reported_at = self.started_at
+
+    def add(self, record):
+        self.done += 1
+        self.errors += record['status'] == 'error'
+        self.tokens += record.get('completion_tokens') or 0
+        if time.time() - self.reported_at >= self.interval:
+            self.report()
+
+    def report(self):
+        self.reported_at = time.time()
+        elapsed = max(self.reported_at - self.started_at, 1e-9)
+        rate = self.done / elapsed
+        finished = self.already_done + self.done
+        line = f"{finished}/{self.total} rows ({100 * finished / max(self.total, 1):.1f}%) | {rate:.2f} rows/s | {self.tokens / elapsed:.0f} tokens/s"
+        if self.errors:
+            line += f" | {self.errors} errors"
+        if rate > 0 and finished < self.total:
+            line += f" | ETA {_duration((self.total - finished) / rate)}"
+        click.echo(line, err=True)
+
+
+def _duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{seconds:02d}s"
+
+
+def generate_row(app, settings, row_number, row, default_tool, use_cache):
+    # Runs in a worker thread; returns the output record for the row
+    tool = row.get('tool') or default_tool
+    record = {'row': row_number, 'tool': tool, 'input': row}
+    if tool not in PROMPT_BUILDERS:
+        return dict(record, status='error', error=f"unknown tool {tool!r}")
+    form = RowForm(row)
+    try:
+        prompt = PROMPT_BUILDERS[tool](form)
+    except PromptInputError as e:
+        return dict(record, status='error', error=str(e))
+
+    usage = {}
+    start = time.perf_counter()
+    try:
+        with app.app_context():
+            text = generate_text(
+                prompt, settings, use_cache=use_cache, tool=tool, system=SYSTEM_PROMPTS.get(tool),
+                profile=PROFILE_BUILDERS[tool](form), usage=usage
+            )
+            # Answers from the model join the generation index, as they do for the web forms
+            index = app.extensions.get('generation_index')
+            if index is not None and usage.get('truncated') is False and not usage.get('error'):
+                index.add(tool, normalize_inputs(form), text)
+    except Exception as e:
+        usage['error'] = str(e) or type(e).__name__
+    duration = time.perf_counter() - start
+    if usage.get('error'):
+        return dict(record, status='error', error=usage['error'], duration=round(duration, 3))
+    return dict(
+        record, status='done', output=text, truncated=bool(usage.get('truncated')),
+        completion_tokens=usage.get('completion_tokens'), duration=round(duration, 3)
+    )
+
+
+@click.command('bulk-generate')
+@click.argument('input_path', type=click.Path(exists=True, dir_okay=False))
+@click.argument('output_path', type=click.Path(dir_okay=False))
+@click.option('--tool', type=click.Choice(sorted(PROMPT_BUILDERS)), help="Tool for rows without a tool column.")
+@click.option('--concurrency', default=2, show_default=True, help="Generations running at once.")
+@click.option('--backend', 'inference_server', help="Backend to use (default: ollama).")
+@click.option('--model', help="Model to use (default: the backend's configured default).")
+@click.option('--no-cache', is_flag=True, help="Don't answer rows from the response cache.")
+@click.option('--checkpoint', 'checkpoint_path', type=click.Path(dir_okay=False), help="Default: OUTPUT_PATH.checkpoint")
+@click.option('--restart', is_flag=True, help="Ignore the checkpoint and overwrite the output.")
+@click.option('--progress-interval', default=5.0, show_default=True, help="Seconds between progress lines.")
+@with_appcontext
+def bulk_generate_command(input_path, output_path, tool, concurrency, inference_server, model, no_cache,
+                          checkpoint_path, restart, progress_interval):
+    """Generate tool outputs for every row of a CSV or JSONL file."""
+    app = current_app._get_current_object()
+    user = UserSettings.defaults(app.config)
+    if inference_server:
+        user.inference_server = inference_server
+    if model:
+        setattr(user, f"{user.inference_server}_model", model)
+    settings = generation_settings(user, app.config)
+    backend = get_backend(settings.backend)
+    if backend is None or not backend.available(settings):
+        raise click.UsageError(f"Backend {settings.backend!r} is unknown or not configured.")
+
+    checkpoint = Checkpoint(checkpoint_path or output_path + '.checkpoint', input_path)
+    if restart:
+        for path in (checkpoint.path, output_path):
+            if os.path.exists(path):
+                os.remove(path)
+    resumed = checkpoint.load()
+
+    total = count_rows(input_path)
+    already_done = sum(1 for row_number in range(1, total + 1) if checkpoint.is_done(row_number))
+    click.echo(
+        f"{'Resuming' if resumed else 'Starting'}: {total} rows, {already_done} already done; "
+        f"{settings.backend} {settings.model}, concurrency {concurrency}", err=True
+    )
+    progress = Progress(total, already_done, interval=progress_interval)
+
+    # First Ctrl-C: stop starting rows and let the running ones finish and be recorded.
+    # Second: quit right away; finished rows are already written and checkpointed.
+    stopping = threading.Event()
+    def stop(signum, frame):
+        if stopping.is_set():
+            click.echo("Quitting; rows in progress will run again on resume.", err=True)
+            os._exit(130)
+        stopping.set()
+        click.echo("Stopping after the rows in progress (Ctrl-C again to quit now)...", err=True)
+    previous_handler = signal.signal(signal.SIGINT, stop)
+
+    with open(output_path, 'a', encoding='utf-8') as output, ThreadPoolExecutor(concurrency, thread_name_prefix='bulk') as pool:
+        def record(future):
+            result = future.result()
+            output.write(json.dumps(result, ensure_ascii=False) + '\n')
+            output.flush()
+            checkpoint.mark_done(result['row'])
+            progress.add(result)
+
+        pending = set()
+        try:
+            for row_number, row in read_rows(input_path):
+                if stopping.is_set():
+                    break
+                if checkpoint.is_done(row_number):
+                    continue
+                # Keep a couple of rows per worker queued, no more
+                while len(pending) >= 2 * concurrency:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        record(future)
+                pending.add(pool.submit(generate_row, app, settings, row_number, row, tool, not no_cache))
+            if stopping.is_set():
+                # Rows that haven't started yet are left for the next run
+                for future in pending:
+                    future.cancel()
+                pending = {future for future in pending if not future.cancelled()}
+            while pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    record(future)
+        finally:
+            signal.signal(signal.SIGINT, previous_handler)
+            for future in pending:
+                future.cancel()
+
+    progress.report()
+    if stopping.is_set():
+        click.echo(f"Stopped; run the same command again to resume from {checkpoint.path}.", err=True)
+        sys.exit(130)
@@ -0,0 +1,127 @@
+# Content-addressed cache for generated responses.
+# Entries are keyed on a hash of backend + model + the fully built prompt + generation options.
+# The first tier is an in-memory LRU per process; the optional second tier is a SQLite file
+# (under the app's instance folder) shared by every worker process on the machine.
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(backend, model, prompt, options=None):
+    payload = json.dumps([backend, model, prompt, options or {}], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    # How many disk writes between eviction passes over the SQLite tier
+    EVICT_EVERY = 100
+
+    def __init__(self, max_entries=512, ttl=7 * 24 * 3600, db_path=None, max_db_entries=20000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self.max_db_entries = max_db_entries
+        self._memory = OrderedDict() # key -> (stored_at, value)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0}
+
+        if self.db_path:
+            self._db().execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db().execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+
+    def _db(self):
+        # sqlite3 connections can't be shared between threads, so keep one per thread (and per process)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if now - stored_at <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.counters['memory_hits'] += 1
+                    return value
+                del self._memory[key]
+
+        if self.db_path:
+            try:
+                row = self._db().execute(
+                    "SELECT value, stored_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] <= self.ttl:
+                    self._db().execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                    self._remember(key, row[0], row[1])
+                    self._count('disk_hits')
+                    return row[0]
+            except sqlite3.Error as e:
+                logger.warning("could not read response cache", extra={'error': str(e)})
+
+        self._count('misses')
+        return None
+
+    def set(self, key, value):
+        now = time.time()
+        self._remember(key, value, now)
+        self._count('stores')
+
+        if self.db_path:
+            try:
+                self._db().execute(
+                    "INSERT OR REPLACE INTO responses (key, value, stored_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, value, now, now)
+                )
+                with self._lock:
+                    self._writes += 1
+                    evict = self._writes % self.EVICT_EVERY == 0
+                if evict:
+                    self._evict_disk(now)
+            except sqlite3.Error as e:
+                logger.warning("could not write response cache", extra={'error': str(e)})
+
+    def _remember(self, key, value, stored_at):
+        with self._lock:
+            self._memory[key] = (stored_at, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _evict_disk(self, now):
+        db = self._db()
+        db.execute("DELETE FROM responses WHERE stored_at < ?", (now - self.ttl,))
+        # Keep only the most recently used max_db_entries rows
+        db.execute(
+            "DELETE FROM responses WHERE key IN ("
+            " SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_db_entries,)
+        )
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['memory_entries'] = len(self._memory)
+        return stats
@@ -0,0 +1,88 @@
+# Registry of pooled, reusable inference clients.
+# Clients are created once per (backend, host) and kept for the life of the process so
+# generations reuse keep-alive connections instead of opening a new one every call.
+# The underlying httpx/requests pools are thread-safe; the registry itself is guarded
+# by a lock and is reset after a fork so pre-forking WSGI servers (gunicorn, uWSGI)
+# never share sockets between worker processes.
+# The client libraries are imported when the first client of their kind is built, so the
+# app doesn't load SDKs for backends nobody uses.
+import atexit
+import os
+import threading
+
+from .config import (
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_POOL_MAX_CONNECTIONS,
+    HTTP_POOL_MAX_KEEPALIVE, HTTP_KEEPALIVE_EXPIRY
+)
+
+_lock = threading.Lock()
+_clients = {}
+_pid = os.getpid()
+
+
+def _make_ollama_client(host):
+    import httpx
+    import ollama
+    return ollama.Client(
+        host=host,
+        timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=HTTP_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        )
+    )
+
+
+def _make_openai_session(host):
+    # The legacy openai SDK (and the OpenAI-compatible backend) talk through requests;
+    # give them a session with a sized pool
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_MAX_KEEPALIVE, pool_maxsize=HTTP_POOL_MAX_CONNECTIONS, max_retries=2)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+_FACTORIES = {
+    'ollama': _make_ollama_client,
+    'openai': _make_openai_session,
+    'openai_compatible': _make_openai_session,
+}
+
+
+def get_client(backend, host=None):
+    global _pid
+    key = (backend, host)
+    with _lock:
+        if _pid != os.getpid():
+            # We are in a freshly forked worker: the inherited clients hold the parent's
+            # sockets, so drop them (without closing) and build our own.
+            _clients.clear()
+            _pid = os.getpid()
+        client = _clients.get(key)
+        if client is None:
+            client = _FACTORIES[backend](host)
+            _clients[key] = client
+    return client
+
+
+def request_timeout():
+    # (connect, read) timeout tuple for requests-based clients
+    return (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+
+@atexit.register
+def close_clients():
+    with _lock:
+        if _pid != os.getpid():
+            return
+        for client in _clients.values():
+            try:
+                # ollama.Client wraps an httpx.Client in ._client
+                getattr(client, '_client', client).close()
+            except Exception:
+                pass
+        _clients.clear()
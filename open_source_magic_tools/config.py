@@ -7,6 +7,106 @@ OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 # Default to localhost, but will be updated from user input
 OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434")
 
+# Several Ollama hosts to balance across, comma separated (defaults to OLLAMA_URL alone)
+OLLAMA_HOSTS = os.environ.get("OLLAMA_HOSTS", OLLAMA_URL)
+# Seconds between health checks (/api/ps) of the Ollama hosts in use
+OLLAMA_HEALTH_INTERVAL = int(os.environ.get("OLLAMA_HEALTH_INTERVAL", 15))
+
+# How long Ollama keeps a model in memory after a call (e.g. "30m", "2h", or -1 for forever;
+# empty uses the server's default), with per-model overrides: "llama3:latest=2h,phi3:latest=5m"
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_KEEP_ALIVE_MODELS = {
+    model.strip(): duration.strip()
+    for model, duration in (item.rsplit('=', 1) for item in os.environ.get("OLLAMA_KEEP_ALIVE_MODELS", "").split(',') if '=' in item)
+}
+# Load the model on the Ollama hosts when the app starts and when settings are saved,
+# so the first generation doesn't pay the load time
+OLLAMA_WARM_UP = os.environ.get("OLLAMA_WARM_UP", "1") == "1"
+# Smallest context window (num_ctx) requested from Ollama; a call whose prompt plus output cap
+# doesn't fit gets the next doubling. 0 leaves it to the server/model default.
+OLLAMA_NUM_CTX = int(os.environ.get("OLLAMA_NUM_CTX", "4096"))
+
+# Local server with an OpenAI-compatible API (llama.cpp server, vLLM, ...), e.g. http://localhost:8080/v1
+OPENAI_COMPATIBLE_URL = os.environ.get("OPENAI_COMPATIBLE_URL")
+OPENAI_COMPATIBLE_API_KEY = os.environ.get("OPENAI_COMPATIBLE_API_KEY")
+
 # Default Models
 DEFAULT_OLLAMA_MODEL = "llama3:latest"  # Or any other model you have pulled
-DEFAULT_OPENAI_MODEL = "gpt-3.5-turbo" # Or any other OpenAI model
\ No newline at end of file
+DEFAULT_OPENAI_MODEL = "gpt-3.5-turbo" # Or any other OpenAI model
+DEFAULT_OPENAI_COMPATIBLE_MODEL = os.environ.get("OPENAI_COMPATIBLE_MODEL", "default") # llama.cpp serves whatever it loaded
+
+# Connection pooling and timeouts for the inference clients (seconds / connection counts)
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", 5))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", 300))
+HTTP_POOL_MAX_CONNECTIONS = int(os.environ.get("HTTP_POOL_MAX_CONNECTIONS", 20))
+HTTP_POOL_MAX_KEEPALIVE = int(os.environ.get("HTTP_POOL_MAX_KEEPALIVE", 10))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", 60))
+
+# Response cache: in-memory LRU per process, plus an optional SQLite tier in the instance folder
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 512))
+RESPONSE_CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL", 7 * 24 * 3600))
+RESPONSE_CACHE_DISK = os.environ.get("RESPONSE_CACHE_DISK", "1") == "1"
+RESPONSE_CACHE_DISK_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_DISK_MAX_ENTRIES", 20000))
+
+# Per-user settings (backend, hosts, models) are kept on the server, keyed by an id in the
+# session cookie; with SETTINGS_STORE_DISK they live in a SQLite file all worker processes share
+SETTINGS_STORE_DISK = os.environ.get("SETTINGS_STORE_DISK", "1") == "1"
+SETTINGS_STORE_TTL = int(os.environ.get("SETTINGS_STORE_TTL", 90 * 24 * 3600))
+
+# Index of past generations: before generating, offer earlier answers to similar inputs
+# (estimated similarity of at least GENERATION_INDEX_THRESHOLD, 0-1) for reuse
+GENERATION_INDEX_ENABLED = os.environ.get("GENERATION_INDEX_ENABLED", "1") == "1"
+GENERATION_INDEX_THRESHOLD = float(os.environ.get("GENERATION_INDEX_THRESHOLD", 0.5))
+GENERATION_INDEX_MAX_ENTRIES = int(os.environ.get("GENERATION_INDEX_MAX_ENTRIES", 20000))
+
+# Decodable texts scoring below this percentage of decodable words are offered for regeneration
+DECODABLE_THRESHOLD = float(os.environ.get("DECODABLE_THRESHOLD", 90))
+
+# Ollama model catalog: how long a model list is fresh, how long an unreachable host is
+# remembered as down, and how often recently used hosts are refreshed in the background
+MODEL_CATALOG_TTL = int(os.environ.get("MODEL_CATALOG_TTL", 60))
+MODEL_CATALOG_ERROR_TTL = int(os.environ.get("MODEL_CATALOG_ERROR_TTL", 15))
+MODEL_CATALOG_REFRESH_INTERVAL = int(os.environ.get("MODEL_CATALOG_REFRESH_INTERVAL", 30))
+
+# Generation job queue: worker threads, how many jobs may wait, how long a job may run,
+# how many jobs may run at once against each backend (per host for Ollama; backends without a
+# limit here run one job at a time unless they batch requests), and how long finished results are kept
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 4))
+JOB_MAX_QUEUE = int(os.environ.get("JOB_MAX_QUEUE", 32))
+JOB_TIMEOUT = int(os.environ.get("JOB_TIMEOUT", 300))
+JOB_BACKEND_LIMITS = {
+    'ollama': int(os.environ.get("JOB_OLLAMA_CONCURRENCY", 2)),
+    'openai': int(os.environ.get("JOB_OPENAI_CONCURRENCY", 4)),
+    'openai_compatible': int(os.environ.get("JOB_OPENAI_COMPATIBLE_CONCURRENCY", 8)),
+}
+JOB_RESULT_TTL = int(os.environ.get("JOB_RESULT_TTL", 600))
+
+# Admission control, so one user can't starve the others: per browser session, how many jobs
+# may run and wait at once and how many requests and estimated tokens it may submit per minute
+# (0 = no limit); the queue share of "Regenerate" jobs relative to new ones; and per-backend
+# rate limits, e.g. to stay inside an OpenAI account's limits (0 = no limit)
+JOB_SESSION_CONCURRENCY = int(os.environ.get("JOB_SESSION_CONCURRENCY", 1))
+JOB_SESSION_MAX_QUEUED = int(os.environ.get("JOB_SESSION_MAX_QUEUED", 4))
+JOB_SESSION_REQUESTS_PER_MINUTE = int(os.environ.get("JOB_SESSION_REQUESTS_PER_MINUTE", 20))
+JOB_SESSION_TOKENS_PER_MINUTE = int(os.environ.get("JOB_SESSION_TOKENS_PER_MINUTE", 40000))
+JOB_REGENERATE_WEIGHT = float(os.environ.get("JOB_REGENERATE_WEIGHT", 0.5))
+JOB_BACKEND_RATE_LIMITS = {
+    'openai': {
+        'requests_per_minute': int(os.environ.get("JOB_OPENAI_REQUESTS_PER_MINUTE", 0)),
+        'tokens_per_minute': int(os.environ.get("JOB_OPENAI_TOKENS_PER_MINUTE", 0)),
+    },
+    'openai_compatible': {
+        'requests_per_minute': int(os.environ.get("JOB_OPENAI_COMPATIBLE_REQUESTS_PER_MINUTE", 0)),
+        'tokens_per_minute': int(os.environ.get("JOB_OPENAI_COMPATIBLE_TOKENS_PER_MINUTE", 0)),
+    },
+}
+
+# Coalesce identical in-flight generations; across worker processes too (needs fcntl, not on Windows)
+SINGLE_FLIGHT_ENABLED = os.environ.get("SINGLE_FLIGHT_ENABLED", "1") == "1"
+SINGLE_FLIGHT_CROSS_PROCESS = os.environ.get("SINGLE_FLIGHT_CROSS_PROCESS", "1") == "1"
+SINGLE_FLIGHT_LOCK_TIMEOUT = int(os.environ.get("SINGLE_FLIGHT_LOCK_TIMEOUT", 300))
+
+# Logging: level, and whether to log one JSON object per line (otherwise plain text)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+LOG_STRUCTURED = os.environ.get("LOG_STRUCTURED", "1") == "1"
\ No newline at end of file
@@ -0,0 +1,291 @@
+# Index of past generations, for offering a similar earlier answer instead of a new one.
+# Every completed generation is stored with the tool's normalized form inputs in a SQLite file
+# in the instance folder. A MinHash signature of the inputs (character trigrams of each field's
+# words) is stored alongside, and an in-memory LSH table over the signatures finds earlier
+# inputs that are probably similar ("photosynthesis" vs "Photosynthesis process", 5 of the same
+# 6 topics) without comparing against every row.
+# Fields that have to match exactly for an answer to be reusable (grade level, number of
+# questions or texts) aren't compared fuzzily: they are part of the bucket a row lives in.
+# Signatures are computed once, when a row is written, so starting up only reads them back: a
+# background thread loads the rows in batches, and later lookups pick up rows added since
+# (by this or any other worker process) by reading only ids above the last one seen.
+# Rows are handed out under a random key rather than their row id, so stored answers and their
+# inputs can't be listed by counting.
+import array
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import secrets
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Form fields that are buttons or flags rather than inputs
+CONTROL_FIELDS = ('action', 'skip_similar', 'sectioned')
+# Fields whose values have to be equal for an earlier answer to fit
+EXACT_FIELDS = ('grade_level', 'num_questions', 'num_texts')
+STOP_WORDS = {'a', 'an', 'and', 'the', 'of', 'for', 'to', 'in', 'on', 'with', 'about', 'my', 'our'}
+
+_MASK = (1 << 64) - 1
+
+
+def _normalize(value):
+    # For comparing only: lowercase words without punctuation, plural s dropped ("Fractions!" -> "fraction")
+    words = re.findall(r'[a-z0-9]+', value.lower())
+    return ' '.join(word[:-1] if len(word) > 3 and word.endswith('s') and not word.endswith('ss') else word for word in words)
+
+
+def _comparable(inputs):
+    return {name: sorted({_normalize(value) for value in values} - {''}) for name, values in inputs.items()}
+
+
+def normalize_inputs(form):
+    # The submitted form as {field: sorted list of values} with whitespace collapsed, without
+    # empty fields. These are stored and shown back as typed; _normalize is applied when comparing.
+    inputs = {}
+    for name in form.keys():
+        if name in CONTROL_FIELDS:
+            continue
+        values = sorted({' '.join(value.split()) for value in form.getlist(name)} - {''})
+        if values:
+            inputs[name] = values
+    return inputs
+
+
+def _digest(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def _bucket(tool, inputs):
+    # inputs as returned by _comparable
+    return _digest(tool, {name: inputs.get(name) for name in EXACT_FIELDS})
+
+
+def _shingles(inputs):
+    # Character trigrams of every normalized word, tagged with the field they came from
+    shingles = set()
+    for name, values in _comparable(inputs).items():
+        if name in EXACT_FIELDS:
+            continue
+        for value in values:
+            for word in value.split():
+                if word in STOP_WORDS:
+                    continue
+                padded = f" {word} "
+                shingles.update(f"{name}:{padded[i:i + 3]}" for i in range(len(padded) - 2))
+    return shingles
+
+
+class GenerationIndex:
+    # How many writes between passes that drop rows beyond max_entries
+    PRUNE_EVERY = 100
+
+    def __init__(self, db_path, num_perm=64, bands=16, threshold=0.5, max_results=3, max_entries=20000, load_batch=1000):
+        self.db_path = db_path
+        self.num_perm = num_perm
+        # 16 bands of 4 rows: inputs with similarity 0.7 share a band 98% of the time, 0.5 about
+        # 64%, while unrelated inputs (0.2) rarely do, so few candidates need scoring
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.threshold = threshold # least estimated Jaccard similarity of the inputs to offer a match
+        self.max_results = max_results
+        self.max_entries = max_entries
+        self.load_batch = load_batch
+        # Fixed seed: signatures are stored, so the hash functions must be the same in every process
+        rng = random.Random(20240601)
+        self._perms = [(rng.getrandbits(64) | 1, rng.getrandbits(64)) for _ in range(num_perm)]
+        # Kept compact, as each process holds one entry per stored row
+        self._entries = {} # row id -> (hash of the inputs digest, signature as array('I'))
+        self._bands = {} # hash of (bucket, band number, band values) -> row id, or a list of them
+        self._last_id = 0
+        self._lock = threading.Lock()
+        self._loading = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+        self._loader_pid = None
+
+        self._db().execute(
+            "CREATE TABLE IF NOT EXISTS generations (id INTEGER PRIMARY KEY AUTOINCREMENT, digest TEXT UNIQUE NOT NULL, "
+            "tool TEXT NOT NULL, bucket TEXT NOT NULL, inputs TEXT NOT NULL, inputs_digest TEXT NOT NULL, "
+            "output TEXT NOT NULL, signature BLOB NOT NULL, created_at REAL NOT NULL, key TEXT UNIQUE)"
+        )
+        # Files from before rows had keys: add the column and give the old rows theirs
+        if 'key' not in [column[1] for column in self._db().execute("PRAGMA table_info(generations)")]:
+            self._db().execute("ALTER TABLE generations ADD COLUMN key TEXT")
+            self._db().execute("CREATE UNIQUE INDEX IF NOT EXISTS generations_key ON generations (key)")
+        for (row_id,) in self._db().execute("SELECT id FROM generations WHERE key IS NULL").fetchall():
+            self._db().execute("UPDATE generations SET key = ? WHERE id = ?", (secrets.token_urlsafe(16), row_id))
+
+    def _db(self):
+        # sqlite3 connections can't be shared between threads, so keep one per thread (and per process)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def signature(self, inputs):
+        # One multiply-shift hash function per permutation (top 32 bits of a*h + b mod 2**64).
+        # The cost is shingles x permutations: a short form takes well under a millisecond, a
+        # long lesson plan form (about 270 shingles) 2-5 ms, which is most of a lookup.
+        hashes = [int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'little')
+                  for shingle in _shingles(inputs)]
+        if not hashes:
+            return (0,) * self.num_perm
+        # Taking the top bits commutes with min, so shift once per permutation
+        mask = _MASK
+        return tuple(min([(a * h + b) & mask for h in hashes]) >> 32 for a, b in self._perms)
+
+    def _band_keys(self, bucket, signature):
+        rows = self.rows_per_band
+        return [hash((bucket, band, tuple(signature[band * rows:(band + 1) * rows]))) for band in range(self.bands)]
+
+    def add(self, tool, inputs, output):
+        # Store a finished generation; the same answer for the same inputs is only kept once
+        bucket = _bucket(tool, _comparable(inputs))
+        signature = self.signature(inputs)
+        try:
+            self._db().execute(
+                "INSERT OR IGNORE INTO generations (digest, tool, bucket, inputs, inputs_digest, output, signature, created_at, key) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (_digest(tool, inputs, output), tool, bucket, json.dumps(inputs, sort_keys=True), _digest(_comparable(inputs)),
+                 output, array.array('Q', signature).tobytes(), time.time(), secrets.token_urlsafe(16))
+            )
+            with self._lock:
+                self._writes += 1
+                prune = self._writes % self.PRUNE_EVERY == 0
+            if prune:
+                self._prune()
+        except sqlite3.Error as e:
+            logger.warning("could not store generation", extra={'tool': tool, 'error': str(e)})
+
+    def _prune(self):
+        # Keep the newest max_entries rows
+        row = self._db().execute("SELECT MAX(id) FROM generations").fetchone()
+        cutoff = (row[0] or 0) - self.max_entries
+        if cutoff <= 0:
+            return
+        self._db().execute("DELETE FROM generations WHERE id <= ?", (cutoff,))
+        with self._lock:
+            self._forget(cutoff)
+
+    def _forget(self, cutoff):
+        # Drop rows up to cutoff from memory, entries and band lists both; called with _lock held
+        for row_id in [row_id for row_id in self._entries if row_id <= cutoff]:
+            del self._entries[row_id]
+        for key, row_ids in list(self._bands.items()):
+            if not isinstance(row_ids, list):
+                if row_ids <= cutoff:
+                    del self._bands[key]
+                continue
+            kept = [row_id for row_id in row_ids if row_id > cutoff]
+            if len(kept) > 1:
+                self._bands[key] = kept
+            elif kept:
+                self._bands[key] = kept[0]
+            else:
+                del self._bands[key]
+
+    def load(self):
+        # Start indexing the stored signatures in a background thread; called at startup and
+        # before lookups, so a forked worker process loads its own copy
+        with self._lock:
+            if self._loader_pid == os.getpid():
+                return
+            self._loader_pid = os.getpid()
+            self._loading = threading.Lock() # may have been copied while the parent's loader held it
+            self._entries.clear()
+            self._bands.clear()
+            self._last_id = 0
+        threading.Thread(target=self._catch_up, kwargs={'wait': True}, name="generation-index-loader", daemon=True).start()
+
+    def _catch_up(self, wait=False):
+        # Index rows added since the last pass, in batches. Lookups don't wait for a pass that is
+        # already running (e.g. the startup load); they use what has been indexed so far.
+        loading = self._loading
+        if not loading.acquire(blocking=wait):
+            return
+        try:
+            while True:
+                rows = self._db().execute(
+                    "SELECT id, bucket, inputs_digest, signature FROM generations WHERE id > ? ORDER BY id LIMIT ?",
+                    (self._last_id, self.load_batch)
+                ).fetchall()
+                with self._lock:
+                    for row_id, bucket, inputs_digest, blob in rows:
+                        signature = array.array('I', array.array('Q', blob))
+                        self._entries[row_id] = (hash(inputs_digest), signature)
+                        for key in self._band_keys(bucket, signature):
+                            row_ids = self._bands.get(key)
+                            if row_ids is None:
+                                self._bands[key] = row_id
+                            elif isinstance(row_ids, list):
+                                row_ids.append(row_id)
+                            else:
+                                self._bands[key] = [row_ids, row_id]
+                        self._last_id = row_id
+                    # Rows another process pruned; forgotten in batches, as each pass walks all bands
+                    if len(self._entries) > self.max_entries + self.PRUNE_EVERY:
+                        self._forget(self._last_id - self.max_entries)
+                if len(rows) < self.load_batch:
+                    return
+        except sqlite3.Error as e:
+            logger.warning("could not load generation index", extra={'error': str(e)})
+        finally:
+            loading.release()
+
+    def similar(self, tool, inputs):
+        # Earlier generations whose inputs are similar but not identical (identical inputs are
+        # the response cache's job), best match first
+        self.load()
+        self._catch_up()
+        bucket = _bucket(tool, _comparable(inputs))
+        inputs_key = hash(_digest(_comparable(inputs)))
+        signature = self.signature(inputs)
+        scores = {}
+        with self._lock:
+            for key in self._band_keys(bucket, signature):
+                row_ids = self._bands.get(key, ())
+                for row_id in row_ids if isinstance(row_ids, list) else (row_ids,):
+                    entry = self._entries.get(row_id)
+                    if row_id in scores or entry is None or entry[0] == inputs_key:
+                        continue
+                    scores[row_id] = sum(1 for x, y in zip(signature, entry[1]) if x == y) / self.num_perm
+        best = sorted((row_id for row_id, score in scores.items() if score >= self.threshold),
+                      key=lambda row_id: (scores[row_id], row_id), reverse=True)[:self.max_results]
+        matches = []
+        for row_id in best:
+            match = self._get('id', row_id)
+            if match is not None:
+                match['similarity'] = round(scores[row_id], 2)
+                match['preview'] = match.pop('output')[:300]
+                matches.append(match)
+        return matches
+
+    def get(self, key):
+        # A stored generation by the key similar() gave out (its 'id'), or None
+        return self._get('key', key)
+
+    def _get(self, column, value):
+        try:
+            row = self._db().execute(
+                f"SELECT key, tool, inputs, output, created_at FROM generations WHERE {column} = ?", (value,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("could not read generation", extra={column: value, 'error': str(e)})
+            return None
+        if row is None:
+            return None
+        return {'id': row[0], 'tool': row[1], 'inputs': json.loads(row[2]), 'output': row[3], 'created_at': row[4]}
+
+    def size(self):
+        with self._lock:
+            return len(self._entries)
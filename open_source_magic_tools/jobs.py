@@ -0,0 +1,333 @@
+# Asynchronous generation jobs.
+# Tool submissions are queued and run by a bounded pool of worker threads, so inference no
+# longer ties up the Flask worker that received the request. Each backend has its own
+# concurrency limit (per host for Ollama), so a busy Ollama box doesn't hold up OpenAI jobs
+# queued behind it. Jobs are charged to the client (browser session) that submitted them and
+# admitted by the AdmissionController (per-client caps and rate limits, per-backend rate limits);
+# a worker takes the queued job with the smallest fair-queuing tag among those allowed to start.
+# Jobs stream into job.output as chunks arrive, can be cancelled while queued or running,
+# and are marked 'timeout' once they run longer than the configured limit. A job whose answer
+# stopped at the tool's output cap is marked truncated and can be continued by a follow-up job.
+# Complete answers are added to the app's generation index (if any) with the job's form inputs.
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+from .admission import AdmissionController, QueueFullError, estimate_tokens
+from .backends import capabilities
+from .ollama_utils import generate_text_stream
+from .metrics import JOB_QUEUE_WAIT, JOB_REJECTIONS
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, ERROR, CANCELLED, TIMEOUT = 'queued', 'running', 'done', 'error', 'cancelled', 'timeout'
+FINISHED = (DONE, ERROR, CANCELLED, TIMEOUT)
+
+
+class Job:
+    def __init__(self, tool, prompt, settings, use_cache=True, system=None, profile=None, continue_from=None, inputs=None,
+                 client=None, weight=1.0):
+        self.id = uuid.uuid4().hex
+        self.group = self.id # jobs submitted together share the first one's id
+        self.tool = tool
+        self.prompt = prompt
+        self.system = system
+        self.settings = settings # GenerationSettings resolved by the submitting request
+        self.profile = profile # the tool's GenerationProfile
+        self.continue_from = continue_from # text of the cut-off answer this job continues
+        self.inputs = inputs # the form inputs (see normalize_inputs), for the generation index
+        self.use_cache = use_cache
+        self.client = client # who submitted it, for per-client limits and fair queuing
+        self.weight = weight # share of the queue relative to other clients' jobs
+        self.cost = estimate_tokens(prompt, system, profile, continue_from)
+        self.finish_tag = 0.0 # set by the admission controller
+        self.usage = {} # filled by the backend; usage['truncated'] once the answer hit the cap
+        self.status = QUEUED
+        self.output = ''
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.ttft = None
+        self.cancel_requested = False
+        self._changed = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED
+
+    @property
+    def truncated(self):
+        return self.status == DONE and bool(self.usage.get('truncated'))
+
+    @property
+    def full_output(self):
+        # The whole answer so far, including what earlier jobs in a continuation chain wrote
+        return (self.continue_from or '') + self.output
+
+    def _update(self, **fields):
+        with self._changed:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self._changed.notify_all()
+
+    def _append(self, chunk):
+        with self._changed:
+            if self.ttft is None:
+                self.ttft = time.time() - self.started_at
+            self.output += chunk
+            self._changed.notify_all()
+
+    def wait(self, timeout=None):
+        # Block until the job has finished; returns False if timeout expired first
+        with self._changed:
+            return self._changed.wait_for(lambda: self.finished, timeout)
+
+    def wait_for_output(self, seen, timeout=None):
+        # Block until there is output beyond the first `seen` characters or the job finished
+        with self._changed:
+            self._changed.wait_for(lambda: len(self.output) > seen or self.finished, timeout)
+            return self.output[seen:], self.finished
+
+    def to_dict(self):
+        total = None
+        if self.started_at is not None:
+            total = (self.finished_at or time.time()) - self.started_at
+        return {
+            'id': self.id,
+            'tool': self.tool,
+            'status': self.status,
+            'output': self.output,
+            'error': self.error,
+            'truncated': self.truncated,
+            'ttft': self.ttft,
+            'total': total,
+            'queued_for': (self.started_at or time.time()) - self.created_at,
+        }
+
+
+class JobQueue:
+    def __init__(self, app, workers=4, max_queue=32, timeout=300, backend_limits=None, result_ttl=600, admission=None):
+        self.app = app
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.backend_limits = backend_limits or {}
+        self.result_ttl = result_ttl
+        self.admission = admission or AdmissionController(
+            session_limit=workers, session_max_queued=max_queue, session_requests_per_minute=0, session_tokens_per_minute=0
+        )
+        self._jobs = {}
+        self._queue = []
+        self._running = {} # (backend, hosts) -> number of running jobs
+        # Moving averages of how long jobs wait and run, for Retry-After and the queue status
+        self._average_wait = 0.0
+        self._average_run = 10.0
+        self._cond = threading.Condition()
+        self._pid = None
+
+    def submit(self, tool, prompt, settings, use_cache=True, system=None, profile=None, continue_from=None, inputs=None,
+               client=None, weight=1.0):
+        # Raises QueueFullError (or RateLimitedError, for this client's limits) with a retry_after
+        job = Job(tool, prompt, settings, use_cache, system, profile, continue_from, inputs, client, weight)
+        return self.submit_group([job])[0]
+
+    def submit_group(self, jobs):
+        # Queue jobs of one client that belong together (e.g. the sections of a lesson plan):
+        # they are admitted as one request, all or none, and can run at the same time
+        self._ensure_workers()
+        for job in jobs:
+            job.group = jobs[0].id
+        with self._cond:
+            self._prune()
+            try:
+                if len(self._queue) + len(jobs) > self.max_queue:
+                    raise QueueFullError(
+                        f"The generation queue is full ({self.max_queue} jobs waiting).",
+                        retry_after=math.ceil(max(1.0, self._average_run / self.workers))
+                    )
+                self.admission.admit(jobs)
+            except QueueFullError as e:
+                JOB_REJECTIONS.inc(reason=e.reason, backend=jobs[0].settings.backend)
+                raise
+            for job in jobs:
+                self._jobs[job.id] = job
+                self._queue.append(job)
+            self._cond.notify_all()
+        return jobs
+
+    def submit_continuation(self, job):
+        # A follow-up job that picks up a truncated job's answer where it stopped
+        return self.submit(
+            job.tool, job.prompt, job.settings, system=job.system, profile=job.profile, continue_from=job.full_output,
+            inputs=job.inputs, client=job.client, weight=job.weight
+        )
+
+    def get(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            self._check_timeout(job)
+        return job
+
+    def cancel(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return job
+            if job.status == QUEUED:
+                self._queue.remove(job)
+                self.admission.dequeued(job)
+                job._update(status=CANCELLED, finished_at=time.time())
+                return job
+        # Running jobs stop at the next chunk; the worker marks them cancelled
+        job.cancel_requested = True
+        return job
+
+    def position(self, job):
+        # 1-based position among queued jobs in fair-queuing order, or None if the job isn't waiting
+        with self._cond:
+            if job not in self._queue:
+                return None
+            return 1 + sum(1 for other in self._queue if other.finish_tag < job.finish_tag)
+
+    def depth(self):
+        with self._cond:
+            return len(self._queue)
+
+    def running(self):
+        with self._cond:
+            return sum(self._running.values())
+
+    def depth_by_backend(self):
+        with self._cond:
+            depths = {}
+            for job in self._queue:
+                depths[job.settings.backend] = depths.get(job.settings.backend, 0) + 1
+            return depths
+
+    def status(self, client=None):
+        # Queue overview for the /queue endpoint, with the given client's own jobs
+        with self._cond:
+            status = {
+                'depth': len(self._queue),
+                'running': sum(self._running.values()),
+                'average_wait': round(self._average_wait, 2),
+                'average_run': round(self._average_run, 2),
+            }
+            if client is not None:
+                status['client'] = self.admission.client_status(client)
+        status['depth_by_backend'] = self.depth_by_backend()
+        return status
+
+    def _check_timeout(self, job):
+        if job.status == RUNNING and time.time() - job.started_at > self.timeout:
+            job.cancel_requested = True
+            job._update(status=TIMEOUT, error="The generation took too long and was stopped.", finished_at=time.time())
+
+    def _prune(self):
+        # Forget finished jobs whose results nobody has collected within result_ttl
+        cutoff = time.time() - self.result_ttl
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+        self.admission.prune()
+
+    def _ensure_workers(self):
+        # Threads don't survive a fork, so each worker process starts its own pool
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._queue.clear()
+            self._running.clear()
+            self.admission.reset()
+        for i in range(self.workers):
+            threading.Thread(target=self._work, name=f"generation-worker-{i}", daemon=True).start()
+
+    def _slot_key(self, job):
+        return (job.settings.backend, job.settings.hosts)
+
+    def _has_capacity(self, job):
+        backend = job.settings.backend
+        limit = self.backend_limits.get(backend)
+        if limit is None:
+            # Unlisted backends: no limit if the server batches requests, otherwise one at a time
+            if capabilities(backend).get('batching', True):
+                return True
+            limit = 1
+        if backend == 'ollama':
+            # The Ollama limit is per host, so capacity grows with the pool
+            limit *= max(1, len(job.settings.hosts))
+        return self._running.get(self._slot_key(job), 0) < limit
+
+    def _next_job(self):
+        with self._cond:
+            while True:
+                # Among jobs with a free backend slot whose client is under its running cap and
+                # whose backend rate limit allows a start, take the smallest fair-queuing tag
+                ready = [job for job in self._queue if self._has_capacity(job)]
+                startable = [job for job in ready if self.admission.can_start(job)]
+                if startable:
+                    job = min(startable, key=lambda job: job.finish_tag)
+                    self._queue.remove(job)
+                    self.admission.started(job)
+                    key = self._slot_key(job)
+                    self._running[key] = self._running.get(key, 0) + 1
+                    job._update(status=RUNNING, started_at=time.time())
+                    waited = job.started_at - job.created_at
+                    self._average_wait += 0.2 * (waited - self._average_wait)
+                    JOB_QUEUE_WAIT.observe(waited, tool=job.tool, backend=job.settings.backend)
+                    return job
+                # Jobs held back only by a backend rate limit can start once its bucket refills
+                refills = [self.admission.backend_wait(job) for job in ready]
+                self._cond.wait(timeout=min(refill for refill in refills if refill > 0) if any(refills) else None)
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            try:
+                with self.app.app_context():
+                    self._run(job)
+            finally:
+                with self._cond:
+                    self._running[self._slot_key(job)] -= 1
+                    self.admission.finished(job)
+                    self._average_run += 0.2 * ((job.finished_at or time.time()) - job.started_at - self._average_run)
+                    self._cond.notify_all()
+
+    def _run(self, job):
+        stream = generate_text_stream(
+            job.prompt, job.settings, use_cache=job.use_cache, tool=job.tool, system=job.system,
+            profile=job.profile, continue_from=job.continue_from, usage=job.usage
+        )
+        try:
+            for chunk in stream:
+                self._check_timeout(job)
+                if job.cancel_requested:
+                    break
+                job._append(chunk)
+        except Exception:
+            logger.exception("generation job failed", extra={'job_id': job.id, 'tool': job.tool, 'backend': job.settings.backend})
+            job._update(status=ERROR, error="An error occurred while generating the response.", finished_at=time.time())
+            return
+        finally:
+            # Closing the generator closes the HTTP stream, which stops the upstream inference
+            stream.close()
+
+        if job.finished: # timed out while we were reading
+            return
+        if job.cancel_requested:
+            job._update(status=CANCELLED, finished_at=time.time())
+        else:
+            job._update(status=DONE, finished_at=time.time())
+            self._record(job)
+
+    def _record(self, job):
+        # Only answers the model just finished: cache hits are already recorded, and error
+        # messages and cut-off answers aren't worth offering again
+        index = self.app.extensions.get('generation_index')
+        if index is None or job.inputs is None or job.usage.get('truncated') is not False:
+            return
+        index.add(job.tool, job.inputs, job.full_output)
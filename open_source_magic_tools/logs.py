@@ -0,0 +1,39 @@
+# Structured logging for the package: one JSON object per line, with any `extra={...}`
+# fields passed to the logger included as top-level keys.
+import json
+import logging
+import time
+
+# Attributes every LogRecord has; anything else on a record came from `extra`
+_STANDARD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class StructuredFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in _STANDARD_ATTRIBUTES and not name.startswith('_'):
+                entry[name] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level='INFO', structured=True):
+    logger = logging.getLogger('open_source_magic_tools')
+    logger.setLevel(level)
+    # create_app() may run more than once per process (tests, CLI); only add our handler once
+    if not any(getattr(handler, '_magic_tools_handler', False) for handler in logger.handlers):
+        handler = logging.StreamHandler()
+        handler._magic_tools_handler = True
+        logger.addHandler(handler)
+        logger.propagate = False
+    for handler in logger.handlers:
+        if getattr(handler, '_magic_tools_handler', False):
+            handler.setFormatter(StructuredFormatter() if structured else logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    return logger
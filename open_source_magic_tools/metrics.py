@@ -0,0 +1,255 @@
+# In-process metrics in the Prometheus text exposition format, served on /metrics.
+# Each worker process keeps its own registry (scrape every worker, or run a single
+# multi-threaded worker). Besides the counters and histograms below, app_families() reports
+# point-in-time values (cache, coalescing, job queue, Ollama hosts) at scrape time.
+import bisect
+import threading
+
+# Seconds; covers short cached answers up to long lesson plans on slow hardware
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 90, 120, 300)
+TOKEN_RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 250)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, self.labelnames, key, (), value) for key, value in items]
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {} # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts)) for key, counts in self._values.items()]
+        samples = []
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts[:-1]):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else _format_value(bound)
+                samples.append((self.name + '_bucket', self.labelnames, key, (('le', le),), cumulative))
+            samples.append((self.name + '_count', self.labelnames, key, (), cumulative))
+            samples.append((self.name + '_sum', self.labelnames, key, (), counts[-1]))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self, families=()):
+        # families: extra point-in-time values, [(name, type, documentation, [(labels_dict, value), ...]), ...]
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labelnames, values, extra, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labelnames, values, extra)} {_format_value(value)}")
+        for name, metric_type, documentation, samples in families:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+GENERATION_LABELS = ('tool', 'backend', 'model')
+
+HTTP_REQUEST_DURATION = REGISTRY.register(Histogram(
+    'magic_tools_http_request_duration_seconds', 'Time spent handling HTTP requests, including Flask overhead.',
+    ('endpoint', 'method', 'status')
+))
+GENERATION_REQUESTS = REGISTRY.register(Counter(
+    'magic_tools_generation_requests_total', 'Generation calls by where the answer came from (upstream, cache, error).',
+    GENERATION_LABELS + ('source',)
+))
+GENERATION_DURATION = REGISTRY.register(Histogram(
+    'magic_tools_generation_duration_seconds', 'Total time of upstream model calls.', GENERATION_LABELS
+))
+GENERATION_TTFT = REGISTRY.register(Histogram(
+    'magic_tools_generation_time_to_first_token_seconds', 'Time until the first streamed chunk of an upstream model call.', GENERATION_LABELS
+))
+MODEL_LOAD_DURATION = REGISTRY.register(Histogram(
+    'magic_tools_model_load_seconds', 'Model load time reported by Ollama (load_duration).', GENERATION_LABELS
+))
+PROMPT_EVAL_DURATION = REGISTRY.register(Histogram(
+    'magic_tools_prompt_eval_seconds', 'Prompt evaluation time reported by Ollama (prompt_eval_duration).', GENERATION_LABELS
+))
+EVAL_DURATION = REGISTRY.register(Histogram(
+    'magic_tools_eval_seconds', 'Token generation time reported by Ollama (eval_duration).', GENERATION_LABELS
+))
+TOKENS_PER_SECOND = REGISTRY.register(Histogram(
+    'magic_tools_completion_tokens_per_second', 'Generation speed (eval_count / eval_duration).', GENERATION_LABELS,
+    buckets=TOKEN_RATE_BUCKETS
+))
+JOB_QUEUE_WAIT = REGISTRY.register(Histogram(
+    'magic_tools_job_queue_wait_seconds', 'Time generation jobs spent queued before a worker picked them up.', ('tool', 'backend')
+))
+JOB_REJECTIONS = REGISTRY.register(Counter(
+    'magic_tools_job_rejections_total', 'Generation jobs refused by the queue (full queue, per-client caps and rate limits).',
+    ('reason', 'backend')
+))
+PROMPT_TOKENS = REGISTRY.register(Counter(
+    'magic_tools_prompt_tokens_total', 'Prompt tokens (Ollama prompt_eval_count, OpenAI usage.prompt_tokens).', GENERATION_LABELS
+))
+COMPLETION_TOKENS = REGISTRY.register(Counter(
+    'magic_tools_completion_tokens_total', 'Completion tokens (Ollama eval_count, OpenAI usage.completion_tokens).', GENERATION_LABELS
+))
+TRUNCATED_GENERATIONS = REGISTRY.register(Counter(
+    'magic_tools_truncated_generations_total', "Upstream model calls that stopped at the tool's output cap.", GENERATION_LABELS
+))
+
+
+def observe_generation(tool, backend, model, duration, ttft=None, usage=None):
+    # Record one upstream model call; usage holds the fields the backend reported, if any
+    labels = {'tool': tool or 'unknown', 'backend': backend, 'model': model}
+    GENERATION_REQUESTS.inc(source='upstream', **labels)
+    GENERATION_DURATION.observe(duration, **labels)
+    if ttft is not None:
+        GENERATION_TTFT.observe(ttft, **labels)
+    usage = usage or {}
+    if usage.get('load_duration') is not None:
+        MODEL_LOAD_DURATION.observe(usage['load_duration'], **labels)
+    if usage.get('prompt_eval_duration') is not None:
+        PROMPT_EVAL_DURATION.observe(usage['prompt_eval_duration'], **labels)
+    if usage.get('eval_duration') is not None:
+        EVAL_DURATION.observe(usage['eval_duration'], **labels)
+        if usage.get('completion_tokens') and usage['eval_duration'] > 0:
+            TOKENS_PER_SECOND.observe(usage['completion_tokens'] / usage['eval_duration'], **labels)
+    if usage.get('prompt_tokens') is not None:
+        PROMPT_TOKENS.inc(usage['prompt_tokens'], **labels)
+    if usage.get('completion_tokens') is not None:
+        COMPLETION_TOKENS.inc(usage['completion_tokens'], **labels)
+    if usage.get('truncated'):
+        TRUNCATED_GENERATIONS.inc(**labels)
+
+
+def count_generation(tool, backend, model, source):
+    GENERATION_REQUESTS.inc(tool=tool or 'unknown', backend=backend, model=model, source=source)
+
+
+def ollama_usage(response):
+    # Ollama reports durations in nanoseconds on the final (done) response
+    def seconds(name):
+        value = response.get(name)
+        return value / 1e9 if value is not None else None
+    return {
+        'prompt_tokens': response.get('prompt_eval_count'),
+        'completion_tokens': response.get('eval_count'),
+        'load_duration': seconds('load_duration'),
+        'prompt_eval_duration': seconds('prompt_eval_duration'),
+        'eval_duration': seconds('eval_duration'),
+        'truncated': response.get('done_reason') == 'length',
+    }
+
+
+def openai_usage(response):
+    usage = response.get('usage') or {}
+    return {
+        'prompt_tokens': usage.get('prompt_tokens'),
+        'completion_tokens': usage.get('completion_tokens'),
+    }
+
+
+def openai_truncated(choice):
+    # finish_reason 'length' means the answer was cut off at max_tokens
+    return choice.get('finish_reason') == 'length'
+
+
+def app_families(app):
+    # Point-in-time values from the app's cache, single-flight, job queue and host pool
+    families = []
+    cache = app.extensions.get('response_cache')
+    if cache is not None:
+        stats = cache.stats()
+        families.append(('magic_tools_response_cache_events_total', 'counter', 'Response cache lookups and stores.', [
+            ({'event': name}, stats[name]) for name in ('memory_hits', 'disk_hits', 'misses', 'stores')
+        ]))
+        families.append(('magic_tools_response_cache_memory_entries', 'gauge', 'Entries in the in-memory cache tier.', [
+            ({}, stats['memory_entries'])
+        ]))
+    flight = app.extensions.get('single_flight')
+    if flight is not None:
+        stats = flight.stats()
+        families.append(('magic_tools_single_flight_calls_total', 'counter', 'Generation calls by single-flight role.', [
+            ({'role': name}, stats[name]) for name in ('leaders', 'coalesced', 'coalesced_cross_process')
+        ]))
+    index = app.extensions.get('generation_index')
+    if index is not None:
+        families.append(('magic_tools_generation_index_entries', 'gauge', 'Past generations loaded into the similarity index.', [
+            ({}, index.size())
+        ]))
+    jobs = app.extensions.get('job_queue')
+    if jobs is not None:
+        depths = dict.fromkeys(jobs.backend_limits, 0)
+        depths.update(jobs.depth_by_backend())
+        families.append(('magic_tools_job_queue_depth', 'gauge', 'Generation jobs waiting for a worker.', [
+            ({'backend': backend}, depth) for backend, depth in sorted(depths.items())
+        ]))
+        families.append(('magic_tools_jobs_running', 'gauge', 'Generation jobs currently running.', [({}, jobs.running())]))
+    pool = app.extensions.get('ollama_pool')
+    if pool is not None:
+        hosts = pool.status()
+        families.append(('magic_tools_ollama_host_healthy', 'gauge', 'Whether the Ollama host passed its last check.', [
+            ({'host': host['host']}, int(host['healthy'])) for host in hosts
+        ]))
+        families.append(('magic_tools_ollama_host_outstanding_requests', 'gauge', 'Calls currently running on the Ollama host.', [
+            ({'host': host['host']}, host['outstanding']) for host in hosts
+        ]))
+    return families
@@ -0,0 +1,104 @@
+# Per-host cache of the models available on each Ollama server.
+# Lookups never touch the network: they return whatever is cached and, when the entry is
+# missing or older than the TTL, kick off a refresh in a background thread
+# (stale-while-revalidate). Unreachable hosts are negatively cached for error_ttl seconds so
+# a dead host isn't hammered, and a daemon thread periodically refreshes recently used hosts.
+# The catalog lives on the app, so the model list is shared by every session in the process.
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ModelCatalog:
+    def __init__(self, fetch, ttl=60, error_ttl=15, refresh_interval=30, idle_timeout=3600):
+        self.fetch = fetch # host -> list of model names; raises when the host can't be reached
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self.refresh_interval = refresh_interval
+        self.idle_timeout = idle_timeout # stop background refreshes for hosts nobody has asked about
+        self._entries = {}
+        self._inflight = set()
+        self._lock = threading.Lock()
+        self._refresher_pid = None
+
+    def get(self, host):
+        # Returns (models, status); status is 'fresh', 'stale', 'pending' or 'error'
+        self._ensure_refresher()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.setdefault(host, {'models': [], 'fetched_at': None, 'error': None, 'error_at': None})
+            entry['accessed_at'] = now
+            needs_refresh = self._needs_refresh(entry, now)
+            models = list(entry['models'])
+            if entry['fetched_at'] is not None:
+                status = 'fresh' if now - entry['fetched_at'] <= self.ttl else 'stale'
+            elif entry['error'] is not None:
+                status = 'error'
+            else:
+                status = 'pending'
+        if needs_refresh:
+            self.refresh(host)
+        return models, status
+
+    def refresh(self, host, force=False):
+        # Schedule a background fetch for host unless one is already running
+        with self._lock:
+            if host in self._inflight:
+                return
+            entry = self._entries.setdefault(host, {'models': [], 'fetched_at': None, 'error': None, 'error_at': None})
+            entry.setdefault('accessed_at', time.time())
+            if force:
+                # An explicit refresh (e.g. "Save Settings") overrides the negative cache
+                entry['error_at'] = None
+            self._inflight.add(host)
+        threading.Thread(target=self._refresh, args=(host,), name=f"model-catalog-{host}", daemon=True).start()
+
+    def _needs_refresh(self, entry, now):
+        if entry['error_at'] is not None and now - entry['error_at'] < self.error_ttl:
+            return False
+        return entry['fetched_at'] is None or now - entry['fetched_at'] > self.ttl
+
+    def _refresh(self, host):
+        try:
+            models = self.fetch(host)
+        except Exception as e:
+            logger.warning("could not refresh Ollama models", extra={'host': host, 'error': str(e)})
+            with self._lock:
+                entry = self._entries[host]
+                entry['error'] = str(e)
+                entry['error_at'] = time.time()
+                self._inflight.discard(host)
+            return
+        with self._lock:
+            entry = self._entries[host]
+            entry['models'] = models
+            entry['fetched_at'] = time.time()
+            entry['error'] = None
+            entry['error_at'] = None
+            self._inflight.discard(host)
+
+    def _ensure_refresher(self):
+        # Threads don't survive a fork, so each worker process starts its own refresher
+        if self._refresher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._refresher_pid == os.getpid():
+                return
+            self._refresher_pid = os.getpid()
+            self._inflight.clear()
+        threading.Thread(target=self._refresh_loop, name="model-catalog-refresher", daemon=True).start()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            now = time.time()
+            with self._lock:
+                hosts = [
+                    host for host, entry in self._entries.items()
+                    if now - entry.get('accessed_at', 0) <= self.idle_timeout and self._needs_refresh(entry, now)
+                ]
+            for host in hosts:
+                self.refresh(host)
@@ -1,60 +1,188 @@
-import ollama
-import openai
-from .config import OPENAI_API_KEY, DEFAULT_OLLAMA_MODEL, DEFAULT_OPENAI_MODEL
+# Generation entry points used by the routes and the job queue: backend selection, response
+# cache, single-flight coalescing and metrics. The actual calls live in the backends package.
+import logging
+import time
+from .backends import get_backend
+from .clients import get_client
+from .cache import make_cache_key
+from .metrics import observe_generation, count_generation
+from .prompts import CONTINUE_PROMPT
 from flask import current_app
-import requests
 
-# Configure OpenAI API (only if API key is provided)
-if OPENAI_API_KEY:
-    openai.api_key = OPENAI_API_KEY
+logger = logging.getLogger(__name__)
+
+def _backend(settings):
+    # The backend for the settings if it's known and configured, else None
+    backend = get_backend(settings.backend)
+    return backend if backend is not None and backend.available(settings) else None
+
+def _response_cache():
+    return current_app.extensions.get('response_cache')
+
+class _NoSingleFlight:
+    def do(self, key, fn, recheck=None):
+        return fn()
+
+    def stream(self, key, make_stream, recheck=None):
+        return make_stream()
+
+def _single_flight():
+    return current_app.extensions.get('single_flight') or _NoSingleFlight()
+
+def _messages(prompt, system=None, continue_from=None):
+    # The fixed system message goes first so consecutive calls share the same prompt prefix.
+    # A continuation replays the cut-off answer and asks the model to carry on from there.
+    messages = [{'role': 'system', 'content': system}] if system else []
+    messages.append({'role': 'user', 'content': prompt})
+    if continue_from:
+        messages.append({'role': 'assistant', 'content': continue_from})
+        messages.append({'role': 'user', 'content': CONTINUE_PROMPT})
+    return messages
+
+def _cache_key(settings, prompt, system, profile=None, continue_from=None):
+    options = {}
+    if system:
+        options['system'] = system
+    if profile is not None:
+        options['profile'] = profile.to_dict()
+    if continue_from:
+        options['continue_from'] = continue_from
+    return make_cache_key(settings.backend, settings.model, prompt, options or None)
+
+def _observed_chat(backend, settings, prompt, tool, system=None, profile=None, continue_from=None, usage=None):
+    start = time.perf_counter()
+    usage = {} if usage is None else usage
+    text = backend.chat(settings, _messages(prompt, system, continue_from), usage, profile)
+    usage.setdefault('truncated', False)
+    duration = time.perf_counter() - start
+    observe_generation(tool, settings.backend, settings.model, duration, usage=usage)
+    logger.info("generation finished", extra={
+        'tool': tool, 'backend': settings.backend, 'model': settings.model, 'duration': round(duration, 3), **usage
+    })
+    return text
+
+def _observed_chat_stream(backend, settings, prompt, tool, system=None, profile=None, continue_from=None, usage=None):
+    start = time.perf_counter()
+    usage = {} if usage is None else usage
+    ttft = None
+    for chunk in backend.chat_stream(settings, _messages(prompt, system, continue_from), usage, profile):
+        if ttft is None:
+            ttft = time.perf_counter() - start
+        yield chunk
+    usage.setdefault('truncated', False)
+    duration = time.perf_counter() - start
+    observe_generation(tool, settings.backend, settings.model, duration, ttft=ttft, usage=usage)
+    logger.info("generation finished", extra={
+        'tool': tool, 'backend': settings.backend, 'model': settings.model, 'duration': round(duration, 3),
+        'ttft': round(ttft, 3) if ttft is not None else None, **usage
+    })
+
+def generate_text(prompt, settings, use_cache=True, tool=None, system=None, profile=None, continue_from=None, usage=None):
+    # settings is the request's GenerationSettings (backend, model, hosts, keys); see settings.py.
+    # use_cache=False skips the cache lookup (e.g. "Regenerate"), but the fresh result is still stored.
+    # tool only labels the metrics. system is the fixed system message sent ahead of the prompt.
+    # profile is the tool's GenerationProfile (output cap etc.; see profiles.py). continue_from is
+    # an earlier answer that was cut off, to be continued rather than started over.
+    # usage, if given, receives what the backend reported; usage['truncated'] marks an answer
+    # cut off at the cap. Cache hits and calls coalesced onto another caller's leave it empty.
+    # On failure the returned text is a message for the user and usage['error'] says what went wrong.
+    usage = {} if usage is None else usage
+    backend = _backend(settings)
+    if backend is None:
+        usage['error'] = f"backend {settings.backend!r} is unknown or not configured"
+        return "Please select an inference server."
+    cache = _response_cache()
+    cache_key = _cache_key(settings, prompt, system, profile, continue_from)
+
+    if cache is not None and use_cache:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            count_generation(tool, settings.backend, settings.model, 'cache')
+            return cached
 
-def generate_text(prompt, model_type, model_name=None):
     try:
-        if model_type == 'ollama':
-            model_to_use = model_name if model_name else DEFAULT_OLLAMA_MODEL
-            ollama_host = current_app.config.get('OLLAMA_URL', 'http://localhost:11434')
-            client = ollama.Client(host=ollama_host)
-            response = client.chat(model=model_to_use, messages=[{'role': 'user', 'content': prompt}])
-            return response['message']['content']
-        elif model_type == 'openai' and OPENAI_API_KEY:
-            model_to_use = model_name if model_name else DEFAULT_OPENAI_MODEL
-            response = openai.ChatCompletion.create(
-                model=model_to_use,
-                messages=[{'role': 'user', 'content': prompt}]
-            )
-            return response.choices[0].message['content']
-        else:
-            return "Please select an inference server."
+        # Identical concurrent calls share one upstream inference
+        text = _single_flight().do(
+            cache_key,
+            lambda: _observed_chat(backend, settings, prompt, tool, system, profile, continue_from, usage),
+            recheck=lambda: cache.get(cache_key) if cache is not None and use_cache else None
+        )
     except Exception as e:
-        print(f"Error interacting with inference server: {e}")
+        count_generation(tool, settings.backend, settings.model, 'error')
+        logger.error("error interacting with inference server", extra={
+            'tool': tool, 'backend': settings.backend, 'model': settings.model, 'error': str(e)
+        })
+        usage['error'] = str(e) or type(e).__name__
         return "An error occurred while generating the response."
 
-def list_ollama_models():
-    ollama_host = current_app.config.get('OLLAMA_URL', 'http://localhost:11434')
-    print(f"Attempting to list Ollama models from: {ollama_host}")
+    # Stored by the caller that ran the upstream call (its usage says truncated or not; callers
+    # coalesced onto it have none), and never when cut off, so a cache hit is a complete answer
+    if cache is not None and usage.get('truncated') is False:
+        cache.set(cache_key, text)
+    return text
+
+def generate_text_stream(prompt, settings, use_cache=True, tool=None, system=None, profile=None, continue_from=None, usage=None):
+    # Same as generate_text, but yields the response in chunks as the model produces them.
+    # Errors are raised to the caller so the streaming endpoint can report them mid-stream.
+    backend = _backend(settings)
+    if backend is None:
+        yield "Please select an inference server."
+        return
+    cache = _response_cache()
+    cache_key = _cache_key(settings, prompt, system, profile, continue_from)
+    usage = {} if usage is None else usage
+
+    if cache is not None and use_cache:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            count_generation(tool, settings.backend, settings.model, 'cache')
+            yield cached
+            return
+
+    chunks = []
+    # Identical concurrent calls share one upstream inference
+    stream = _single_flight().stream(
+        cache_key,
+        lambda: _observed_chat_stream(backend, settings, prompt, tool, system, profile, continue_from, usage),
+        recheck=lambda: cache.get(cache_key) if cache is not None and use_cache else None
+    )
     try:
-        client = ollama.Client(host=ollama_host)
-        models_response = client.list()
-        print(f"Successfully received Ollama models response: {models_response}")
-
-        # Check if 'models' key exists and is a list
-        if 'models' in models_response and isinstance(models_response['models'], list):
-            model_names = []
-            for model in models_response['models']:
-                # Access the 'model' attribute of the Model object
-                if hasattr(model, 'model'):
-                     model_names.append(model.model)
-                else:
-                    print(f"Warning: Unexpected model structure in Ollama response: {model}")
-            print(f"Successfully extracted model names: {model_names}")
-            return model_names
-        else:
-            print(f"Error: Ollama response does not contain expected 'models' list: {models_response}")
-            return []
-
-    except requests.exceptions.ConnectionError as e:
-        print(f"Connection Error listing Ollama models from {ollama_host}: {e}")
+        for chunk in stream:
+            chunks.append(chunk)
+            yield chunk
+    except Exception:
+        count_generation(tool, settings.backend, settings.model, 'error')
+        raise
+
+    # Only completed streams are cached, by the caller that ran them, and not when cut off at the cap
+    if cache is not None and usage.get('truncated') is False:
+        cache.set(cache_key, ''.join(chunks))
+
+def warm_up_model(settings):
+    # Start loading the settings' Ollama model on each of its hosts in the background;
+    # returns the hosts being warmed
+    if settings.backend != 'ollama':
         return []
-    except Exception as e:
-        print(f"An unexpected error occurred listing Ollama models from {ollama_host}: {e}")
-        return []
\ No newline at end of file
+    pool = current_app.extensions['ollama_pool']
+    options = {'num_ctx': settings.num_ctx} if settings.num_ctx else None
+    return pool.warm_up(settings.hosts, settings.model, settings.keep_alive, options)
+
+def fetch_ollama_models(ollama_host):
+    # Returns the model names on ollama_host; raises if the host can't be reached.
+    # Doesn't need an app context, so the model catalog can call it from its refresher threads.
+    logger.debug("listing Ollama models", extra={'host': ollama_host})
+    client = get_client('ollama', ollama_host)
+    models_response = client.list()
+
+    # Check if 'models' key exists and is a list
+    if 'models' in models_response and isinstance(models_response['models'], list):
+        model_names = []
+        for model in models_response['models']:
+            # Access the 'model' attribute of the Model object
+            if hasattr(model, 'model'):
+                 model_names.append(model.model)
+            else:
+                logger.warning("unexpected model structure in Ollama response", extra={'host': ollama_host, 'model': str(model)})
+        logger.debug("listed Ollama models", extra={'host': ollama_host, 'models': model_names})
+        return model_names
+    raise ValueError(f"Ollama response does not contain expected 'models' list: {models_response}")
@@ -0,0 +1,225 @@
+# Decodability checking for the decodable text tool.
+# The patterns the teacher selected are the focus of the texts, on top of a base the children
+# already know: every pattern earlier in the list (a scope and sequence) than the first selected
+# one, and at least the single consonants and short vowels. A word is decodable when it can be
+# spelled out entirely with base and focus graphemes, optionally after a selected prefix (un-,
+# re-, ...) and before a selected suffix (-ed, -ing, ...); it practises a focus pattern when one
+# way of spelling it out uses one. Like a reader, the check takes the longest grapheme in the
+# list at each point, so "rain" needs ai and can't be sounded out as r-a-i-n. The pattern spellings go
+# into tries once, at startup, with a bitmask of the patterns behind each spelling on its
+# terminal node; a request only turns its selected patterns into one int mask, and checking a
+# word is a walk over its letters.
+# A few high-frequency words that early readers learn by sight always count as decodable.
+import re
+
+# The phonics patterns offered by the decodable text tool: spelling, sound, example words.
+# Spellings ending in - are prefixes, spellings starting with - are suffixes.
+PHONICS_PATTERNS = [
+    "a /ă/ at, cat", "m /m/ am", "t /t/ at, mat", "s /s/ sat", "p /p/ sat, tap", "i /ĭ/ sit, tip",
+    "f /f/ fit, if", "n /n/ nip, tin", "o /ŏ/ on, pot", "d /d/ mad, dim", "r /r/ rat, rid",
+    "u /ŭ/ pup, sum", "c /k/ cod, cub", "g /g/ gut, dig", "b /b/ ban, bib", "e /ĕ/ set, bed",
+    "h /h/ hem, hip", "l /l/ lid, lag", "k /k/ kid, kin", "j /j/ jug, jam", "w /w/ wax, wit",
+    "v /v/ vet, van", "z /z/ zip, zig", "y /y/ yes, yet", "qu /kw/ quit, quiz", "x /ks/ box, six",
+    "sh /sh/ ship, shop", "ch /ch/ chin, chip", "th /th/ that, them", "th /th/ thin, path",
+    "wh /wh/ when, whip", "ng /ŋ/ ring, sing", "ck /k/ back, duck", "ll /l/ fill, well",
+    "ss /s/ pass, mess", "zz /z/ buzz, jazz", "ff /f/ puff, cliff", "ay /ā/ day, play",
+    "ee /ē/ see, tree", "igh /ī/ high, sigh", "ow /ō/ snow, grow", "ew /ū/ few, new",
+    "oa /ō/ boat, road", "ai /ā/ rain, sail", "ie /ī/ pie, tie", "ou /ou/ out, shout",
+    "oy /oi/ boy, toy", "oi /oi/ boil, coin", "ar /är/ car, star", "or /ôr/ for, horn",
+    "er /ər/ her, fern", "ir /ər/ bird, girl", "ur /ər/ fur, turn", "ear /ēr/ dear, fear",
+    "air /air/ hair, pair", "ure /yoor/ pure, cure", "tch /ch/ catch, match", "dge /j/ bridge, edge",
+    "kn /n/ know, knit", "wr /r/ write, wrong", "le /əl/ table, apple", "mb /m/ comb, lamb",
+    "gn /n/ sign, gnaw", "ph /f/ phone, graph", "oe /ō/ toe, hoe", "au /aw/ haul, sauce",
+    "aw /aw/ jaw, claw", "al /aw/ walk, talk", "eigh /ā/ eight, sleigh", "ei /ā/ vein, weight",
+    "ey /ē/ key, monkey", "y /ē/ happy, bunny", "y /ī/ cry, fly", "ce /s/ face, ice",
+    "ge /j/ cage, stage", "ci /sh/ special, social", "ti /sh/ station, motion", "si /sh/ mansion, tension",
+    "si /zh/ vision, decision", "sc /s/ scene, scent", "gue /g/ league, rogue", "que /k/ antique, plaque",
+    "-ed /t/ looked, jumped", "-ed /d/ played, called", "-ed /id/ wanted, painted", "-ing /ing/ running, jumping",
+    "-er /ər/ runner, jumper", "-est /əst/ biggest, fastest", "un- /ʌn/ unlock, unhappy", "re- /rē/ redo, rewrite",
+    "pre- /prē/ preview, prepare", "mis- /mɪs/ misbehave, misplace", "dis- /dɪs/ disconnect, dislike",
+    "-less /ləs/ helpless, fearless", "-ful /fəl/ helpful, thankful", "-ness /nəs/ darkness, kindness",
+    "-ment /mənt/ payment, movement", "-ly /lē/ slowly, kindly", "-able /əbl/ readable, lovable",
+    "-ible /ɪbl/ visible, possible", "-tion /shən/ action, station", "-sion /zhən/ vision, decision"
+]
+
+# Taught first, so decodable whatever the focus: the single consonants and short vowels
+BASE_PATTERNS = PHONICS_PATTERNS[:PHONICS_PATTERNS.index("sh /sh/ ship, shop")]
+
+# Spellings that only make their sound in some places in a word (the end, before a vowel), so
+# elsewhere their letters are read one by one: let, get, tip, sit, scan, quest
+POSITIONAL_SPELLINGS = {'le', 'ce', 'ge', 'ci', 'ti', 'si', 'sc', 'al', 'que', 'gue'}
+
+# Irregular high-frequency words taught as sight words
+SIGHT_WORDS = {
+    'a', 'the', 'i', 'is', 'to', 'of', 'and', 'was', 'are', 'said', 'you', 'he', 'she', 'we', 'me', 'be',
+    'they', 'his', 'has', 'as', 'do', 'does', 'go', 'no', 'so', 'my', 'by', 'put', 'what', 'who', 'come', 'some',
+}
+
+# The "Text 1", "**Text 2:**", "### Text 3" labels the model puts in front of each text
+TEXT_LABEL = re.compile(r'^[^\w\n]*Text\s+(\d+)\b', re.IGNORECASE | re.MULTILINE)
+WORD = re.compile(r'[a-z]+')
+
+
+def _insert(trie, spelling, bit):
+    node = trie
+    for char in spelling:
+        node = node.setdefault(char, {})
+    node[None] = node.get(None, 0) | bit # patterns spelled this way
+
+
+def _matches(trie, word, start, mask):
+    # (end position, patterns in mask spelled that way) for the spellings that start at word[start]
+    node = trie
+    for position in range(start, len(word)):
+        node = node.get(word[position])
+        if node is None:
+            return
+        bits = node.get(None, 0) & mask
+        if bits:
+            yield position + 1, bits
+
+
+# How a position of a word can be reached: with base spellings only, or using a focus pattern
+_BASE, _FOCUS = 1, 2
+
+
+class PhonicsMatcher:
+    def __init__(self, patterns=PHONICS_PATTERNS, sight_words=SIGHT_WORDS, base_patterns=BASE_PATTERNS):
+        self.sight_words = set(sight_words)
+        self._bits = {}
+        self._graphemes = {}
+        self._prefixes = {}
+        self._suffixes = {} # spelled backwards, to match from the end of the word
+        self._positional_mask = 0
+        # Bits in list order, so the patterns before the lowest selected bit are the ones taught before it
+        for index, pattern in enumerate(patterns):
+            bit = 1 << index
+            self._bits[pattern] = bit
+            spelling = pattern.split()[0].lower()
+            if spelling.endswith('-'):
+                _insert(self._prefixes, spelling[:-1], bit)
+            elif spelling.startswith('-'):
+                _insert(self._suffixes, spelling[:0:-1], bit)
+            else:
+                _insert(self._graphemes, spelling, bit)
+                if spelling in POSITIONAL_SPELLINGS:
+                    self._positional_mask |= bit
+        self._all_mask = (1 << len(patterns)) - 1
+        self.base_mask = self.mask(base_patterns)
+
+    def mask(self, selected_patterns):
+        # One int standing for the selected patterns; patterns not in the list are ignored
+        mask = 0
+        for pattern in selected_patterns:
+            mask |= self._bits.get(pattern, 0)
+        return mask
+
+    def base(self, mask):
+        # The patterns taught before the first selected one, at least the single letters
+        return ((mask & -mask) - 1) | self.base_mask
+
+    def decode(self, word, mask):
+        # word is lowercase letters, mask the focus patterns. Walk the graphemes from after an
+        # optional prefix, keeping per position whether it can be reached with base spellings
+        # and whether by using a focus pattern. Returns 0 if no path reaches the end of the word
+        # (or an optional suffix), _FOCUS if a path there uses a focus pattern, _BASE otherwise.
+        if word in self.sight_words:
+            return _BASE
+        base = self.base(mask)
+        focus = mask & ~base
+        mask |= base
+        length = len(word)
+        reachable = [0] * (length + 1)
+        reachable[0] = _BASE
+
+        def step(start, end, bits):
+            if bits & base:
+                reachable[end] |= reachable[start]
+            if bits & focus:
+                reachable[end] |= _FOCUS
+
+        for end, bits in _matches(self._prefixes, word, 0, mask):
+            step(0, end, bits)
+        for position in range(length):
+            if reachable[position]:
+                # The longest grapheme in the whole list that starts here is the one to read
+                longest = 0
+                for longest, _ in _matches(self._graphemes, word, position, self._all_mask & ~self._positional_mask):
+                    pass
+                for end, bits in _matches(self._graphemes, word, position, mask):
+                    if end >= longest:
+                        step(position, end, bits)
+        result = reachable[length]
+        for end, bits in _matches(self._suffixes, word[::-1], 0, mask):
+            start = length - end
+            if reachable[start]:
+                result |= reachable[start] if bits & base else 0
+                result |= _FOCUS if bits & focus else 0
+        return _FOCUS if result & _FOCUS else result
+
+    def decodable(self, word, mask):
+        return bool(self.decode(word, mask))
+
+    def score(self, text, mask):
+        # (percentage of decodable words, the words that aren't decodable, the words that practise
+        # a focus pattern), the word lists in order of appearance
+        words = WORD.findall(text.lower())
+        if not words:
+            return 100.0, [], []
+        flagged = []
+        focus_words = []
+        decodable = 0
+        results = {}
+        for word in words:
+            if word not in results:
+                results[word] = self.decode(word, mask)
+                if not results[word]:
+                    flagged.append(word)
+                elif results[word] == _FOCUS:
+                    focus_words.append(word)
+            decodable += bool(results[word])
+        return round(100.0 * decodable / len(words), 1), flagged, focus_words
+
+
+def split_texts(output):
+    # The generated output cut at its "Text N" labels: [{'number', 'text'}], with anything
+    # before the first label as number None. Joining the pieces gives back the output.
+    labels = list(TEXT_LABEL.finditer(output))
+    if not labels:
+        return [{'number': 1, 'text': output}]
+    texts = []
+    if labels[0].start() > 0:
+        texts.append({'number': None, 'text': output[:labels[0].start()]})
+    for label, following in zip(labels, labels[1:] + [None]):
+        texts.append({'number': int(label.group(1)), 'text': output[label.start():following.start() if following else len(output)]})
+    return texts
+
+
+def decodability_report(output, matcher, mask):
+    # Each text of the output with its decodability score, flagged words and focus words
+    texts = split_texts(output)
+    for text in texts:
+        if text['number'] is None:
+            text['decodability'], text['flagged'], text['focus_words'] = None, [], []
+            continue
+        # The label itself ("Text 2") isn't part of what the children read
+        label = TEXT_LABEL.match(text['text'])
+        body = text['text'][label.end():] if label else text['text']
+        text['decodability'], text['flagged'], text['focus_words'] = matcher.score(body, mask)
+    return texts
+
+
+def complete_set(report, count):
+    # Whether the report holds exactly Text 1 .. Text count. Otherwise a "text" may really be
+    # several (their labels missing) or one is gone, and replacing texts one by one could lose some.
+    return [text['number'] for text in report if text['number'] is not None] == list(range(1, count + 1))
+
+
+def replace_text(text, output):
+    # A regenerated text in place of an old one: labeled like the old one, same spacing after it
+    label = TEXT_LABEL.match(text['text'])
+    output = output.strip()
+    if label and not TEXT_LABEL.match(output):
+        output = f"Text {text['number']}\n{output}"
+    trailing = text['text'][len(text['text'].rstrip()):]
+    return dict(text, text=output + trailing)
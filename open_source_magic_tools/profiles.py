@@ -0,0 +1,102 @@
+# Per-tool generation profiles: output cap, temperature and stop sequences for one request.
+# Like the prompt builders, each profile builder takes the submitted form, so the budget
+# follows what was asked for (a 5-question review gets less room than a 30-question one).
+# The backends map a profile onto their own API: Ollama options (num_predict, temperature,
+# stop, num_ctx) or OpenAI parameters (max_tokens, temperature, stop).
+import re
+
+
+class GenerationProfile:
+    def __init__(self, max_tokens, temperature=None, stop=()):
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.stop = list(stop)
+
+    def to_dict(self):
+        return {'max_tokens': self.max_tokens, 'temperature': self.temperature, 'stop': self.stop}
+
+
+def _int_field(form, name, default, low, high):
+    # A numeric form field clamped to [low, high]; the prompt builders have already validated it
+    try:
+        value = int(form.get(name) or default)
+    except (TypeError, ValueError):
+        value = default
+    return max(low, min(high, value))
+
+
+def _minutes(time_limit, default=5):
+    # "5 minutes", "10 min", "3-5 min" -> the largest number of minutes mentioned
+    numbers = [int(number) for number in re.findall(r'\d+', time_limit or '')]
+    return max(numbers) if numbers else default
+
+
+def build_social_media_post_profile(form):
+    return GenerationProfile(max_tokens=350, temperature=0.8)
+
+
+def build_lesson_hook_profile(form):
+    # Roughly a spoken minute of hook per 80 tokens, within sensible bounds
+    minutes = _minutes(form.get('time_limit'))
+    return GenerationProfile(max_tokens=max(300, min(1200, 200 + 80 * minutes)), temperature=0.8)
+
+
+def build_math_spiral_review_profile(form):
+    # Each question plus its line in the answer key
+    num_questions = _int_field(form, 'num_questions', 10, 1, 50)
+    return GenerationProfile(max_tokens=150 + 110 * num_questions, temperature=0.3)
+
+
+def decodable_text_count(form):
+    # How many texts the decodable text form asks for
+    return _int_field(form, 'num_texts', 1, 1, 20)
+
+
+def build_decodable_text_profile(form):
+    num_texts = decodable_text_count(form)
+    # The system prompt has each text start with a "Text N" line; stop the model before it starts one too many
+    return GenerationProfile(max_tokens=100 + 250 * num_texts, temperature=0.6, stop=[f"Text {num_texts + 1}"])
+
+
+def build_decodable_text_retry_profile(number):
+    # One text of a set, regenerated on its own; stop before the model writes the next one
+    return GenerationProfile(max_tokens=350, temperature=0.6, stop=[f"Text {number + 1}"])
+
+
+def build_lesson_plan_profile(form):
+    return GenerationProfile(max_tokens=2500, temperature=0.7)
+
+
+# Sectioned lesson plans: each section gets its own share of the whole plan's budget
+LESSON_PLAN_SECTION_TOKENS = {
+    'objectives': 300,
+    'materials': 300,
+    'procedures': 1200,
+    'assessment': 500,
+    'differentiation': 500,
+}
+
+
+def build_lesson_plan_section_profile(form, section):
+    return GenerationProfile(max_tokens=LESSON_PLAN_SECTION_TOKENS[section], temperature=0.7)
+
+
+def context_window(messages, max_tokens, minimum):
+    # Context size (num_ctx) for a call: the smallest power-of-two multiple of minimum that fits
+    # the messages (about 3 characters per token) plus the output cap. Ollama reloads the model
+    # whenever num_ctx changes, so calls stay on a few sizes instead of being fitted exactly.
+    needed = sum(len(message['content']) for message in messages) // 3 + (max_tokens or 0)
+    size = minimum
+    while size < needed:
+        size *= 2
+    return size
+
+
+# Tool name (matches PROMPT_BUILDERS) -> profile builder
+PROFILE_BUILDERS = {
+    'social_media_post': build_social_media_post_profile,
+    'lesson_hook': build_lesson_hook_profile,
+    'math_spiral_review': build_math_spiral_review_profile,
+    'decodable_text': build_decodable_text_profile,
+    'lesson_plan': build_lesson_plan_profile,
+}
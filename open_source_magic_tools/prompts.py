@@ -0,0 +1,221 @@
+# Prompt builders shared by the regular tool routes and the streaming endpoints.
+# Each builder takes the submitted form (anything with .get/.getlist, e.g. request.form)
+# and returns the user message, or raises PromptInputError with the message to show the user.
+# The fixed instructions for each tool live in SYSTEM_PROMPTS and are sent as the system
+# message. Keeping them first and identical on every call lets the backend reuse the already
+# evaluated prefix (Ollama's KV cache, OpenAI's prompt caching) instead of re-reading it.
+
+
+class PromptInputError(ValueError):
+    pass
+
+
+def build_social_media_post_prompt(form):
+    topic = form.get('topic')
+    audience = form.get('audience')
+    tone = form.get('tone')
+
+    if not topic:
+        raise PromptInputError("Please provide a topic.")
+
+    return f"Generate a strong social media post about {topic}. The target audience is {audience if audience else 'general'} and the tone should be {tone if tone else 'neutral'}."
+
+
+def build_lesson_hook_prompt(form):
+    subject_topic = form.get('subject_topic')
+    grade_level = form.get('grade_level')
+    tone = form.get('tone')
+    hook_type = form.get('hook_type')
+    time_limit = form.get('time_limit')
+    special_instructions = form.get('special_instructions')
+
+    if not subject_topic or not grade_level:
+        raise PromptInputError("Please provide the Subject/Topic and Grade Level.")
+
+    prompt = f"Generate a lesson hook for a lesson about {subject_topic} for students in grade {grade_level}. "
+
+    if tone:
+        prompt += f"The tone should be {tone}. "
+    if hook_type:
+        prompt += f"The type of hook should be a {hook_type}. "
+    if time_limit:
+        prompt += f"The hook should be suitable for a {time_limit} introduction. "
+    if special_instructions:
+        prompt += f"Additional instructions: {special_instructions}. "
+
+    return prompt.strip()
+
+
+def build_math_spiral_review_prompt(form):
+    grade_level = form.get('grade_level')
+    topics_covered = form.getlist('topics_covered') # Checkboxes
+    todays_focus = form.get('todays_focus')
+    difficulty = form.get('difficulty')
+    num_questions = form.get('num_questions')
+    question_types = form.getlist('question_types') # Checkboxes
+    special_instructions = form.get('special_instructions')
+
+    if not grade_level or not topics_covered or not num_questions or not question_types:
+        raise PromptInputError("Please provide Grade Level, Topics Covered, Number of Questions, and Question Types.")
+
+    prompt = f"Create a {num_questions}-question spiral math review for {grade_level} students. "
+
+    prompt += f"Topics to pull from: {', '.join(topics_covered)}. "
+
+    if todays_focus:
+        prompt += f"Today's lesson focus is {todays_focus}, so include 1-2 questions on this topic. "
+
+    if difficulty:
+        prompt += f"The questions should be {difficulty} difficulty. "
+
+    prompt += f"Use a mix of question types: {', '.join(question_types)}. "
+
+    if special_instructions:
+        prompt += f"Additional instructions: {special_instructions}. "
+
+    return prompt.strip()
+
+
+def build_decodable_text_prompt(form):
+    selected_patterns = form.getlist('phonics_patterns') # Checkboxes
+    num_texts = form.get('num_texts', 1) # Default to 1 text
+    special_instructions = form.get('special_instructions')
+
+    if not selected_patterns:
+        raise PromptInputError("Please select at least one phonics pattern.")
+
+    prompt = f"Generate {num_texts} short, decodable texts for early readers. "
+    prompt += f"These texts should primarily use words that contain the following phonics patterns: {', '.join(selected_patterns)}. "
+
+    if special_instructions:
+        prompt += f"Additional instructions: {special_instructions}. "
+
+    return prompt.strip()
+
+
+def build_decodable_text_retry_prompt(form, number, flagged_words):
+    # A new version of one text of the set that scored too low on decodability
+    selected_patterns = form.getlist('phonics_patterns')
+    special_instructions = form.get('special_instructions')
+
+    if not selected_patterns:
+        raise PromptInputError("Please select at least one phonics pattern.")
+
+    prompt = f"Generate 1 short, decodable text for early readers, labeled Text {number}. "
+    prompt += f"Focus on words that contain the following phonics patterns: {', '.join(selected_patterns)}. "
+    prompt += "Every other word should be one the readers can sound out with single consonants and short vowels, or a common sight word. "
+
+    if flagged_words:
+        prompt += f"Don't use these words, which the readers can't decode yet: {', '.join(flagged_words)}. "
+    if special_instructions:
+        prompt += f"Additional instructions: {special_instructions}. "
+
+    return prompt.strip()
+
+
+def build_lesson_plan_prompt(form):
+    grade_level = form.get('grade_level')
+    topic_standard_objective = form.get('topic_standard_objective')
+    additional_criteria = form.get('additional_criteria')
+    standards_to_align = form.get('standards_to_align')
+
+    if not grade_level or not topic_standard_objective:
+        raise PromptInputError("Please provide the Grade Level and Topic, Standard, or Objective.")
+
+    prompt = f"Generate a lesson plan for students in {grade_level}. "
+    prompt += f"The lesson is based on the following topic, standard, or objective: {topic_standard_objective}. "
+
+    if additional_criteria:
+        prompt += f"Include the following additional criteria: {additional_criteria}. "
+    if standards_to_align:
+        prompt += f"Align the lesson plan to the following standards: {standards_to_align}. "
+
+    return prompt.strip()
+
+
+# Sections of a lesson plan generated in sectioned mode, in the order they are stitched
+# together: key -> (heading, what to write)
+LESSON_PLAN_SECTIONS = {
+    'objectives': ("Objectives", "List 2-4 measurable learning objectives (\"Students will be able to...\") and the success criteria."),
+    'materials': ("Materials", "List the materials, resources and preparation the teacher needs."),
+    'procedures': ("Procedures", "Describe the lesson step by step with approximate timings: opening, instruction, guided practice, independent practice and closure."),
+    'assessment': ("Assessment", "Describe how the teacher checks for understanding during the lesson and at the end, including an exit ticket."),
+    'differentiation': ("Differentiation", "Describe supports for struggling learners and English learners, and extensions for advanced students."),
+}
+
+
+def build_lesson_plan_context(form):
+    # The lesson's details, shared word for word by every section's prompt so that the
+    # sections agree with each other and the backend can reuse the evaluated prefix
+    grade_level = form.get('grade_level')
+    topic_standard_objective = form.get('topic_standard_objective')
+    additional_criteria = form.get('additional_criteria')
+    standards_to_align = form.get('standards_to_align')
+
+    if not grade_level or not topic_standard_objective:
+        raise PromptInputError("Please provide the Grade Level and Topic, Standard, or Objective.")
+
+    context = f"Lesson plan for students in {grade_level}.\n"
+    context += f"Topic, standard, or objective: {topic_standard_objective}\n"
+
+    if additional_criteria:
+        context += f"Additional criteria: {additional_criteria}\n"
+    if standards_to_align:
+        context += f"Standards to align to: {standards_to_align}\n"
+
+    return context.strip()
+
+
+def build_lesson_plan_section_prompt(form, section):
+    heading, instructions = LESSON_PLAN_SECTIONS[section]
+    prompt = build_lesson_plan_context(form) + "\n\n"
+    prompt += f"Write only the {heading} section of this lesson plan. {instructions} "
+    prompt += "Start with the content itself rather than a heading, and don't write any other section."
+    return prompt
+
+
+# Tool name -> fixed system message. Don't put per-request values in here: any change to the
+# text invalidates the cached prefix for every request of that tool.
+SYSTEM_PROMPTS = {
+    'social_media_post': (
+        "You write social media posts for teachers and schools. "
+        "**Provide only the text of the post, without any introductory or concluding remarks.**"
+    ),
+    'lesson_hook': (
+        "You help teachers write lesson hooks. "
+        "Ensure the hook captures attention, sparks curiosity, connects prior knowledge, and sets the stage for learning."
+    ),
+    'math_spiral_review': (
+        "You create spiral math reviews for teachers. "
+        "Ensure the questions are varied and appropriate for the grade level standards. "
+        "Format the output clearly, numbering each question and indicating the topic and type if possible."
+    ),
+    'decodable_text': (
+        "You write short, decodable texts for early readers. "
+        "Keep sentences simple and repetitive. "
+        "Start every text with a line of its own that says only its label: Text 1, Text 2, Text 3 and so on, "
+        "numbered in order. Don't write anything before Text 1."
+    ),
+    'lesson_plan': (
+        "You write lesson plans for teachers. "
+        "Provide a comprehensive lesson plan structure including objectives, materials, procedures, assessment, and differentiation."
+    ),
+    # Sectioned lesson plans: one request per section (see LESSON_PLAN_SECTIONS)
+    'lesson_plan_section': (
+        "You write lesson plans for teachers, one section at a time. "
+        "Each request gives the lesson's details and names the section to write; write only that section, "
+        "consistent with the details, so it fits together with the other sections."
+    ),
+}
+
+# Sent after a cut-off answer (as the assistant's turn) to have the model pick up where it stopped
+CONTINUE_PROMPT = "Continue exactly where you stopped. Don't repeat anything you already wrote."
+
+# Tool name (matches the route/endpoint name) -> prompt builder
+PROMPT_BUILDERS = {
+    'social_media_post': build_social_media_post_prompt,
+    'lesson_hook': build_lesson_hook_prompt,
+    'math_spiral_review': build_math_spiral_review_prompt,
+    'decodable_text': build_decodable_text_prompt,
+    'lesson_plan': build_lesson_plan_prompt,
+}
@@ -1,67 +1,344 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, current_app
+import json
+import logging
+import time
+import uuid
+from flask import Blueprint, render_template, request, redirect, url_for, session, current_app, abort, jsonify, g, Response, stream_with_context
 # Use relative imports within the package
-from .ollama_utils import generate_text, list_ollama_models
-from .config import DEFAULT_OLLAMA_MODEL, DEFAULT_OPENAI_MODEL, OPENAI_API_KEY, OLLAMA_URL
+from .jobs import Job, QueueFullError, DONE, QUEUED
+from .prompts import (
+    PromptInputError, PROMPT_BUILDERS, SYSTEM_PROMPTS, LESSON_PLAN_SECTIONS, build_social_media_post_prompt,
+    build_lesson_hook_prompt, build_math_spiral_review_prompt, build_decodable_text_prompt, build_lesson_plan_prompt,
+    build_lesson_plan_context, build_lesson_plan_section_prompt, build_decodable_text_retry_prompt
+)
+from .profiles import PROFILE_BUILDERS, build_lesson_plan_section_profile, build_decodable_text_retry_profile, decodable_text_count
+from .phonics import PHONICS_PATTERNS, decodability_report, complete_set, replace_text
+from .generation_index import normalize_inputs
+from .config import DEFAULT_OLLAMA_MODEL, OPENAI_API_KEY, OPENAI_COMPATIBLE_URL
+from .backends import backend_names, get_backend
+from .backend_pool import parse_hosts
+from .settings import USER_SETTING_FIELDS, UserSettings, generation_settings
+from .ollama_utils import warm_up_model
+from .metrics import REGISTRY, HTTP_REQUEST_DURATION, app_families
 
 # Create a Blueprint
 bp = Blueprint('main', __name__)
 
+logger = logging.getLogger(__name__)
+
+@bp.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@bp.before_request
+def identify_client():
+    # Generations are capped, rate limited and queued fairly per browser session. A request
+    # without the session cookie yet is counted against its IP address.
+    g.client = session.get('client_id')
+    if g.client is None:
+        if request.endpoint != 'main.metrics': # don't hand the scraper a new session every time
+            session['client_id'] = uuid.uuid4().hex
+        g.client = 'ip:' + (request.remote_addr or 'unknown')
+
+@bp.after_request
+def observe_request(response):
+    # Time spent in Flask for every route (for streamed responses, until the body starts)
+    duration = time.perf_counter() - g.request_started
+    HTTP_REQUEST_DURATION.observe(duration, endpoint=request.endpoint, method=request.method, status=response.status_code)
+    return response
+
+def regenerate_requested(form):
+    # The "Regenerate" buttons submit action=regenerate / regenerate_*; those skip the response cache
+    return form.get('action', '').startswith('regenerate')
+
+def job_admission(regenerate):
+    # Who the job is charged to, and its queue share: "Regenerate" loops get a smaller one
+    weight = current_app.config['JOB_REGENERATE_WEIGHT'] if regenerate else 1.0
+    return {'client': g.client, 'weight': weight}
+
+def queue_full_response(error):
+    # 429 with Retry-After, so clients back off instead of hanging on a full queue
+    return jsonify(error=str(error), retry_after=error.retry_after), 429, {'Retry-After': str(error.retry_after)}
+
+def wants_json():
+    # The tool pages' scripts submit with Accept: application/json and poll for the result
+    return request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+
+def user_settings():
+    # The user's settings from the server-side store; the session cookie only holds their id
+    if 'user_settings' not in g:
+        settings_id = session.get('settings_id')
+        stored = current_app.extensions['settings_store'].get(settings_id) if settings_id else None
+        # Older cookies carried the settings themselves; move them into the store
+        legacy = {name: session.pop(name) for name in USER_SETTING_FIELDS if name in session}
+        g.user_settings = UserSettings.defaults(current_app.config).update(stored or legacy)
+        if stored is None and legacy:
+            save_user_settings(g.user_settings)
+    return g.user_settings
+
+def save_user_settings(settings):
+    if 'settings_id' not in session:
+        session['settings_id'] = uuid.uuid4().hex
+    current_app.extensions['settings_store'].set(session['settings_id'], settings.to_dict())
+    g.user_settings = settings
+
+def current_generation_settings():
+    # Backend, model, hosts and keys for this request's generations, passed down explicitly
+    return generation_settings(user_settings(), current_app.config)
+
+def current_model():
+    settings = user_settings()
+    return settings.inference_server, settings.model_for(settings.inference_server)
+
+def current_ollama_hosts():
+    # The Ollama IP/URL setting may list several hosts, comma separated
+    return parse_hosts(user_settings().ollama_ip or current_app.config['OLLAMA_HOSTS'])
+
+def catalog_models(hosts):
+    # Union of the cached model lists of all hosts, with an overall status for the page
+    catalog = current_app.extensions['model_catalog']
+    models = []
+    statuses = []
+    for host in hosts:
+        host_models, status = catalog.get(host)
+        statuses.append(status)
+        models.extend(model for model in host_models if model not in models)
+    if models:
+        status = 'fresh' if 'fresh' in statuses else 'stale'
+    elif 'pending' in statuses:
+        status = 'pending'
+    else:
+        status = 'error'
+    return models, status
+
+def similar_generations(tool, inputs):
+    # Earlier answers to similar inputs, unless the user asked for a fresh one
+    index = current_app.extensions.get('generation_index')
+    if index is None or regenerate_requested(request.form) or request.form.get('skip_similar'):
+        return []
+    matches = index.similar(tool, inputs)
+    for match in matches:
+        match['url'] = url_for('main.generation', generation_id=match['id'])
+    return matches
+
+def submit_tool_job(tool):
+    # Queue the generation and return its job id right away; the page polls /jobs/<id>.
+    # If similar inputs were answered before, return those instead so the user can pick one
+    # or resubmit with skip_similar to generate anyway.
+    try:
+        prompt = PROMPT_BUILDERS[tool](request.form)
+    except PromptInputError as e:
+        return jsonify(error=str(e)), 400
+    inputs = normalize_inputs(request.form)
+    similar = similar_generations(tool, inputs)
+    if similar:
+        return jsonify(similar=similar)
+    try:
+        job = current_app.extensions['job_queue'].submit(
+            tool, prompt, current_generation_settings(),
+            use_cache=not regenerate_requested(request.form), system=SYSTEM_PROMPTS.get(tool),
+            profile=PROFILE_BUILDERS[tool](request.form), inputs=inputs,
+            **job_admission(regenerate_requested(request.form))
+        )
+    except QueueFullError as e:
+        return queue_full_response(e)
+    return jsonify(job_id=job.id, status_url=url_for('main.job_status', job_id=job.id)), 202
+
+def submit_generation_job(tool, prompt):
+    return current_app.extensions['job_queue'].submit(
+        tool, prompt, current_generation_settings(),
+        use_cache=not regenerate_requested(request.form), system=SYSTEM_PROMPTS.get(tool),
+        profile=PROFILE_BUILDERS[tool](request.form), inputs=normalize_inputs(request.form),
+        **job_admission(regenerate_requested(request.form))
+    )
+
+def run_generation_job(tool, prompt):
+    # Plain (no JavaScript) form posts go through the same queue, and wait for the result
+    try:
+        job = submit_generation_job(tool, prompt)
+    except QueueFullError as e:
+        return f"{e} Please try again in {e.retry_after} seconds."
+    return job_result(current_app.extensions['job_queue'], job)
+
+def job_result(jobs, job):
+    # Wait for the job; its output, or the message to show instead
+    if not job.wait(timeout=jobs.timeout):
+        jobs.cancel(job.id)
+        return "The generation took too long and was stopped."
+    if job.status != DONE:
+        return job.error or "An error occurred while generating the response."
+    return job.output
+
+def check_decodability(output):
+    # Decodability of each text of a decodable text answer, against the selected patterns
+    matcher = current_app.extensions['phonics_matcher']
+    return decodability_report(output, matcher, matcher.mask(request.form.getlist('phonics_patterns')))
+
+def texts_below_threshold(report):
+    threshold = current_app.config['DECODABLE_THRESHOLD']
+    return [text for text in report if text['decodability'] is not None and text['decodability'] < threshold]
+
+def submit_decodable_retries(texts):
+    # Queue a new version of each given text (together, like lesson plan sections), told which
+    # words to avoid; the rest of the set is kept as it is
+    settings = current_generation_settings()
+    retry_jobs = [
+        Job('decodable_text', build_decodable_text_retry_prompt(request.form, text['number'], text['flagged'][:30]), settings,
+            use_cache=False, system=SYSTEM_PROMPTS['decodable_text'], profile=build_decodable_text_retry_profile(text['number']),
+            **job_admission(True))
+        for text in texts
+    ]
+    return current_app.extensions['job_queue'].submit_group(retry_jobs)
+
+def submit_decodable_regeneration():
+    # Queue the whole set again, for answers that don't split into the texts asked for
+    return current_app.extensions['job_queue'].submit(
+        'decodable_text', build_decodable_text_prompt(request.form), current_generation_settings(), use_cache=False,
+        system=SYSTEM_PROMPTS['decodable_text'], profile=PROFILE_BUILDERS['decodable_text'](request.form),
+        inputs=normalize_inputs(request.form), **job_admission(True)
+    )
+
+def regenerate_decodable_set(output, report):
+    # Plain form posts: generate the whole set once more, keeping it if it does split into the
+    # texts asked for. Returns the output and its decodability report.
+    try:
+        job = submit_decodable_regeneration()
+    except QueueFullError:
+        return output, report
+    result = job_result(current_app.extensions['job_queue'], job)
+    if job.status != DONE:
+        return output, report
+    new_report = check_decodability(result)
+    if not complete_set(new_report, decodable_text_count(request.form)):
+        return output, report
+    return result, new_report
+
+def retry_undecodable_texts(output):
+    # Plain form posts: regenerate the texts that score below the threshold once, keeping a new
+    # version only if it scores better. Returns the output and its decodability report.
+    report = check_decodability(output)
+    low = texts_below_threshold(report)
+    if low and not complete_set(report, decodable_text_count(request.form)):
+        # Replacing one "text" that holds several stories would drop the others
+        return regenerate_decodable_set(output, report)
+    try:
+        retry_jobs = submit_decodable_retries(low) if low else []
+    except QueueFullError:
+        return output, report
+    jobs = current_app.extensions['job_queue']
+    for text, job in zip(low, retry_jobs):
+        result = job_result(jobs, job)
+        if job.status != DONE:
+            continue
+        replacement = replace_text(text, result)
+        scored = check_decodability(replacement['text'])[-1]
+        if scored['decodability'] > text['decodability']:
+            report[report.index(text)] = dict(replacement, decodability=scored['decodability'], flagged=scored['flagged'],
+                                              focus_words=scored['focus_words'])
+    return ''.join(text['text'] for text in report), report
+
+def submit_lesson_plan_sections(sections, regenerate):
+    # Queue one job per lesson plan section, admitted together so they run side by side on the
+    # free backend slots (and hosts); each prompt starts with the same lesson details
+    settings = current_generation_settings()
+    section_jobs = [
+        Job('lesson_plan', build_lesson_plan_section_prompt(request.form, section), settings, use_cache=not regenerate,
+            system=SYSTEM_PROMPTS['lesson_plan_section'], profile=build_lesson_plan_section_profile(request.form, section),
+            **job_admission(regenerate))
+        for section in sections
+    ]
+    return current_app.extensions['job_queue'].submit_group(section_jobs)
+
+def section_heading(section):
+    return f"## {LESSON_PLAN_SECTIONS[section][0]}"
+
+def section_status(section, job):
+    return {
+        'section': section,
+        'heading': section_heading(section),
+        'job_id': job.id,
+        'status_url': url_for('main.job_status', job_id=job.id),
+        'regenerate_url': url_for('main.lesson_plan_section', section=section),
+    }
+
+def submit_sectioned_lesson_plan():
+    # JSON version: the page polls every section's job and stitches them together
+    try:
+        build_lesson_plan_context(request.form)
+    except PromptInputError as e:
+        return jsonify(error=str(e)), 400
+    similar = similar_generations('lesson_plan', normalize_inputs(request.form))
+    if similar:
+        return jsonify(similar=similar)
+    try:
+        section_jobs = submit_lesson_plan_sections(LESSON_PLAN_SECTIONS, regenerate_requested(request.form))
+    except QueueFullError as e:
+        return queue_full_response(e)
+    return jsonify(sections=[section_status(section, job) for section, job in zip(LESSON_PLAN_SECTIONS, section_jobs)]), 202
+
+def run_sectioned_lesson_plan():
+    # Plain form posts: wait for all sections, then stitch them in order
+    try:
+        section_jobs = submit_lesson_plan_sections(LESSON_PLAN_SECTIONS, regenerate_requested(request.form))
+    except PromptInputError as e:
+        return str(e)
+    except QueueFullError as e:
+        return f"{e} Please try again in {e.retry_after} seconds."
+    jobs = current_app.extensions['job_queue']
+    return "\n\n".join(
+        f"{section_heading(section)}\n\n{job_result(jobs, job)}" for section, job in zip(LESSON_PLAN_SECTIONS, section_jobs)
+    )
+
+def choose_ollama_model(selected_model, available_models):
+    # Ensure the selected model is one of the available models, or default
+    if selected_model in available_models:
+        return selected_model
+    return DEFAULT_OLLAMA_MODEL if DEFAULT_OLLAMA_MODEL in available_models else (available_models[0] if available_models else '')
+
 @bp.route('/', methods=['GET', 'POST'])
 def index():
-    ollama_models = []
-    ollama_connection_error = session.pop('ollama_connection_error', None) # Get and remove error from session
+    catalog = current_app.extensions['model_catalog']
+    # Model lists now live in the shared model catalog; drop copies left in older cookies
+    session.pop('ollama_available_models', None)
+    session.pop('ollama_connection_error', None)
 
     if request.method == 'POST':
-        session['inference_server'] = request.form.get('inference_server')
-        session['ollama_ip'] = request.form.get('ollama_ip', 'http://localhost:11434') # Store Ollama IP
-        session['ollama_model'] = request.form.get('ollama_model', DEFAULT_OLLAMA_MODEL)
-        session['openai_model'] = request.form.get('openai_model', DEFAULT_OPENAI_MODEL)
-
-        # Update the OLLAMA_URL in config based on user input
-        current_app.config['OLLAMA_URL'] = session['ollama_ip']
-
-        # If Ollama is selected, try to fetch models AFTER saving settings
-        if session['inference_server'] == 'ollama':
-            ollama_models = list_ollama_models()
-            if not ollama_models:
-                session['ollama_connection_error'] = "Failed to connect to Ollama or list models. Please check the IP and if Ollama is running."
-            else:
-                 # If models are fetched successfully, store them and the selected model in the session
-                 session['ollama_available_models'] = ollama_models
-                 # Ensure the selected model is one of the available models, or default
-                 if session['ollama_model'] not in ollama_models:
-                     session['ollama_model'] = DEFAULT_OLLAMA_MODEL if DEFAULT_OLLAMA_MODEL in ollama_models else (ollama_models[0] if ollama_models else '')
-
+        # Fields left empty fall back to the defaults (e.g. the configured Ollama hosts)
+        settings = UserSettings.defaults(current_app.config).update(request.form)
+        save_user_settings(settings)
+
+        # If Ollama is selected, refresh its model lists in the background; the page never waits on them
+        if settings.inference_server == 'ollama':
+            for host in current_ollama_hosts():
+                catalog.refresh(host, force=True)
+            # Start loading the chosen model now rather than on the first generation
+            if current_app.config['OLLAMA_WARM_UP']:
+                warm_up_model(current_generation_settings())
 
         return redirect(url_for('main.index')) # Redirect to GET after POST
 
     # --- GET Request Handling ---
 
-    # Get current settings from session
-    inference_server = session.get('inference_server', 'ollama')
-    ollama_ip = session.get('ollama_ip', 'http://localhost:11434')
-    ollama_model = session.get('ollama_model', DEFAULT_OLLAMA_MODEL)
-    openai_model = session.get('openai_model', DEFAULT_OPENAI_MODEL)
-
-    # Update the OLLAMA_URL in config based on session data on GET request
-    current_app.config['OLLAMA_URL'] = ollama_ip
-
-    # Get the list of available models from the session (populated on POST)
-    ollama_models = session.get('ollama_available_models', [])
-
-    # If Ollama is selected and no models are in session, try a fetch (fallback for initial load)
-    # This is a less reliable fetch than the POST, but provides a chance on first load
-    if inference_server == 'ollama' and not ollama_models:
-         ollama_models = list_ollama_models()
-         if not ollama_models:
-              ollama_connection_error = "Failed to connect to Ollama or list models on initial load. Please check the IP and click 'Save Settings and Fetch Models'."
-         else:
-              session['ollama_available_models'] = ollama_models
-              # Ensure the selected model is one of the available models, or default
-              if ollama_model not in ollama_models:
-                  ollama_model = DEFAULT_OLLAMA_MODEL if DEFAULT_OLLAMA_MODEL in ollama_models else (ollama_models[0] if ollama_models else '')
-                  session['ollama_model'] = ollama_model
+    # Get current settings from the settings store
+    settings = user_settings()
+    inference_server = settings.inference_server
+    ollama_ip = settings.ollama_ip
+    ollama_model = settings.ollama_model
+    openai_model = settings.openai_model
+    openai_compatible_model = settings.openai_compatible_model
 
+    ollama_models = []
+    ollama_models_status = None
+    ollama_connection_error = None
+    if inference_server == 'ollama':
+        # Cached lookup only: a missing or stale list is refreshed in the background
+        ollama_models, ollama_models_status = catalog_models(current_ollama_hosts())
+        if ollama_models_status == 'error':
+            ollama_connection_error = "Failed to connect to Ollama or list models. Please check the IP and if Ollama is running."
+        elif ollama_models:
+            ollama_model = choose_ollama_model(ollama_model, ollama_models)
+            if ollama_model != settings.ollama_model:
+                settings.ollama_model = ollama_model
+                save_user_settings(settings)
 
     return render_template(
         'index.html',
@@ -69,34 +346,50 @@ def index():
         ollama_ip=ollama_ip,
         ollama_model=ollama_model,
         openai_model=openai_model,
+        openai_compatible_model=openai_compatible_model,
         ollama_models=ollama_models,
+        ollama_models_status=ollama_models_status,
         ollama_connection_error=ollama_connection_error,
-        OPENAI_API_KEY=OPENAI_API_KEY
+        OPENAI_API_KEY=OPENAI_API_KEY,
+        OPENAI_COMPATIBLE_URL=OPENAI_COMPATIBLE_URL
     )
 
+@bp.route('/ollama_models')
+def ollama_models():
+    # JSON view of the model catalog, polled by the settings page while a model list is loading
+    models, status = catalog_models(current_ollama_hosts())
+    return jsonify(models=models, status=status, selected=choose_ollama_model(user_settings().ollama_model, models))
+
+@bp.route('/ollama_hosts')
+def ollama_hosts():
+    # Health, load and loaded models of every Ollama host this process has used
+    return jsonify(hosts=current_app.extensions['ollama_pool'].status())
+
+@bp.route('/backends')
+def backends():
+    # Registered backends, whether each is configured, and what it can do (imports each one)
+    result = []
+    for name in backend_names():
+        backend = get_backend(name)
+        available = backend.available(backend.resolve_settings(user_settings(), current_app.config))
+        result.append({'name': name, 'available': available, 'capabilities': backend.CAPABILITIES})
+    return jsonify(backends=result)
+
 @bp.route('/social_media_post', methods=['GET', 'POST'])
 def social_media_post():
     generated_post = None
-    inference_server = session.get('inference_server', 'ollama')
-    model_name = None
+    inference_server, model_name = current_model()
 
-    if inference_server == 'ollama':
-        model_name = session.get('ollama_model', DEFAULT_OLLAMA_MODEL)
-    elif inference_server == 'openai':
-        model_name = session.get('openai_model', DEFAULT_OPENAI_MODEL)
+    if request.method == 'POST' and wants_json():
+        return submit_tool_job('social_media_post')
 
     if request.method == 'POST':
-        topic = request.form.get('topic')
-        audience = request.form.get('audience')
-        tone = request.form.get('tone')
-
-        if not topic:
-            generated_post = "Please provide a topic."
+        try:
+            prompt = build_social_media_post_prompt(request.form)
+        except PromptInputError as e:
+            generated_post = str(e)
         else:
-            # The generate_text function now uses the OLLAMA_URL from config
-            generated_post = generate_text(prompt=f"Generate a strong social media post about {topic}. The target audience is {audience if audience else 'general'} and the tone should be {tone if tone else 'neutral'}.**Provide only the text of the post, without any introductory or concluding remarks.**",
-                                           model_type=inference_server,
-                                           model_name=model_name)
+            generated_post = run_generation_job('social_media_post', prompt)
 
     return render_template(
         'tool_social_media_post.html',
@@ -112,39 +405,18 @@ def social_media_post():
 @bp.route('/lesson_hook', methods=['GET', 'POST'])
 def lesson_hook():
     generated_hook = None
-    inference_server = session.get('inference_server', 'ollama')
-    model_name = None
+    inference_server, model_name = current_model()
 
-    if inference_server == 'ollama':
-        model_name = session.get('ollama_model', DEFAULT_OLLAMA_MODEL)
-    elif inference_server == 'openai':
-        model_name = session.get('openai_model', DEFAULT_OPENAI_MODEL)
+    if request.method == 'POST' and wants_json():
+        return submit_tool_job('lesson_hook')
 
     if request.method == 'POST':
-        subject_topic = request.form.get('subject_topic')
-        grade_level = request.form.get('grade_level')
-        tone = request.form.get('tone')
-        hook_type = request.form.get('hook_type')
-        time_limit = request.form.get('time_limit')
-        special_instructions = request.form.get('special_instructions')
-
-        if not subject_topic or not grade_level:
-            generated_hook = "Please provide the Subject/Topic and Grade Level."
+        try:
+            prompt = build_lesson_hook_prompt(request.form)
+        except PromptInputError as e:
+            generated_hook = str(e)
         else:
-            prompt = f"Generate a lesson hook for a lesson about {subject_topic} for students in grade {grade_level}. "
-
-            if tone:
-                prompt += f"The tone should be {tone}. "
-            if hook_type:
-                prompt += f"The type of hook should be a {hook_type}. "
-            if time_limit:
-                prompt += f"The hook should be suitable for a {time_limit} introduction. "
-            if special_instructions:
-                prompt += f"Additional instructions: {special_instructions}. "
-
-            prompt += "Ensure the hook captures attention, sparks curiosity, connects prior knowledge, and sets the stage for learning."
-
-            generated_hook = generate_text(prompt, inference_server, model_name)
+            generated_hook = run_generation_job('lesson_hook', prompt)
 
     return render_template(
         'tool_lesson_hook.html',
@@ -164,13 +436,7 @@ def lesson_hook():
 @bp.route('/math_spiral_review', methods=['GET', 'POST'])
 def math_spiral_review():
     generated_review = None
-    inference_server = session.get('inference_server', 'ollama')
-    model_name = None
-
-    if inference_server == 'ollama':
-        model_name = session.get('ollama_model', DEFAULT_OLLAMA_MODEL)
-    elif inference_server == 'openai':
-        model_name = session.get('openai_model', DEFAULT_OPENAI_MODEL)
+    inference_server, model_name = current_model()
 
     # Define lists for dropdowns and checkboxes for the template
     grade_level_options = ['Pre-K', 'K', '1st Grade', '2nd Grade', '3rd Grade', '4th Grade', '5th Grade', '6th Grade', '7th Grade', '8th Grade']
@@ -178,38 +444,16 @@ def math_spiral_review():
     difficulty_options = ['Easy', 'Medium', 'Hard', 'Challenge']
     question_type_options = ['Multiple Choice', 'Open-Ended', 'Word Problems']
 
-    if request.method == 'POST':
-        grade_level = request.form.get('grade_level')
-        topics_covered = request.form.getlist('topics_covered') # Use getlist for checkboxes
-        todays_focus = request.form.get('todays_focus')
-        difficulty = request.form.get('difficulty')
-        num_questions = request.form.get('num_questions')
-        question_types = request.form.getlist('question_types') # Use getlist for checkboxes
-        special_instructions = request.form.get('special_instructions')
-
+    if request.method == 'POST' and wants_json():
+        return submit_tool_job('math_spiral_review')
 
-        if not grade_level or not topics_covered or not num_questions or not question_types:
-            generated_review = "Please provide Grade Level, Topics Covered, Number of Questions, and Question Types."
+    if request.method == 'POST':
+        try:
+            prompt = build_math_spiral_review_prompt(request.form)
+        except PromptInputError as e:
+            generated_review = str(e)
         else:
-            prompt = f"Create a {num_questions}-question spiral math review for {grade_level} students. "
-
-            prompt += f"Topics to pull from: {', '.join(topics_covered)}. "
-
-            if todays_focus:
-                prompt += f"Today's lesson focus is {todays_focus}, so include 1-2 questions on this topic. "
-
-            if difficulty:
-                prompt += f"The questions should be {difficulty} difficulty. "
-
-            prompt += f"Use a mix of question types: {', '.join(question_types)}. "
-
-            if special_instructions:
-                prompt += f"Additional instructions: {special_instructions}. "
-
-            prompt += "Ensure the questions are varied and appropriate for the grade level standards. Format the output clearly, numbering each question and indicating the topic and type if possible."
-
-
-            generated_review = generate_text(prompt, inference_server, model_name)
+            generated_review = run_generation_job('math_spiral_review', prompt)
 
 
     return render_template(
@@ -235,61 +479,23 @@ def math_spiral_review():
 @bp.route('/decodable_text', methods=['GET', 'POST'])
 def decodable_text():
     generated_text = None
-    inference_server = session.get('inference_server', 'ollama')
-    model_name = None
+    decodability = None # score and flagged words per text, for plain form posts
+    inference_server, model_name = current_model()
 
-    if inference_server == 'ollama':
-        model_name = session.get('ollama_model', DEFAULT_OLLAMA_MODEL)
-    elif inference_server == 'openai':
-        model_name = session.get('openai_model', DEFAULT_OPENAI_MODEL)
-
-    # Define the list of phonics patterns for the template
-    phonics_patterns = [
-        "m /m/ am", "t /t/ at, mat", "s /s/ sat", "p /p/ sat, tap", "i /ĭ/ sit, tip",
-        "f /f/ fit, if", "n /n/ nip, tin", "o /ŏ/ on, pot", "d /d/ mad, dim", "r /r/ rat, rid",
-        "u /ŭ/ pup, sum", "c /k/ cod, cub", "g /g/ gut, dig", "b /b/ ban, bib", "e /ĕ/ set, bed",
-        "h /h/ hem, hip", "l /l/ lid, lag", "k /k/ kid, kin", "j /j/ jug, jam", "w /w/ wax, wit",
-        "v /v/ vet, van", "z /z/ zip, zig", "y /y/ yes, yet", "qu /kw/ quit, quiz", "x /ks/ box, six",
-        "sh /sh/ ship, shop", "ch /ch/ chin, chip", "th /th/ that, them", "th /th/ thin, path",
-        "wh /wh/ when, whip", "ng /ŋ/ ring, sing", "ck /k/ back, duck", "ll /l/ fill, well",
-        "ss /s/ pass, mess", "zz /z/ buzz, jazz", "ff /f/ puff, cliff", "ay /ā/ day, play",
-        "ee /ē/ see, tree", "igh /ī/ high, sigh", "ow /ō/ snow, grow", "ew /ū/ few, new",
-        "oa /ō/ boat, road", "ai /ā/ rain, sail", "ie /ī/ pie, tie", "ou /ou/ out, shout",
-        "oy /oi/ boy, toy", "oi /oi/ boil, coin", "ar /är/ car, star", "or /ôr/ for, horn",
-        "er /ər/ her, fern", "ir /ər/ bird, girl", "ur /ər/ fur, turn", "ear /ēr/ dear, fear",
-        "air /air/ hair, pair", "ure /yoor/ pure, cure", "tch /ch/ catch, match", "dge /j/ bridge, edge",
-        "kn /n/ know, knit", "wr /r/ write, wrong", "le /əl/ table, apple", "mb /m/ comb, lamb",
-        "gn /n/ sign, gnaw", "ph /f/ phone, graph", "oe /ō/ toe, hoe", "au /aw/ haul, sauce",
-        "aw /aw/ jaw, claw", "al /aw/ walk, talk", "eigh /ā/ eight, sleigh", "ei /ā/ vein, weight",
-        "ey /ē/ key, monkey", "y /ē/ happy, bunny", "y /ī/ cry, fly", "ce /s/ face, ice",
-        "ge /j/ cage, stage", "ci /sh/ special, social", "ti /sh/ station, motion", "si /sh/ mansion, tension",
-        "si /zh/ vision, decision", "sc /s/ scene, scent", "gue /g/ league, rogue", "que /k/ antique, plaque",
-        "-ed /t/ looked, jumped", "-ed /d/ played, called", "-ed /id/ wanted, painted", "-ing /ing/ running, jumping",
-        "-er /ər/ runner, jumper", "-est /əst/ biggest, fastest", "un- /ʌn/ unlock, unhappy", "re- /rē/ redo, rewrite",
-        "pre- /prē/ preview, prepare", "mis- /mɪs/ misbehave, misplace", "dis- /dɪs/ disconnect, dislike",
-        "-less /ləs/ helpless, fearless", "-ful /fəl/ helpful, thankful", "-ness /nəs/ darkness, kindness",
-        "-ment /mənt/ payment, movement", "-ly /lē/ slowly, kindly", "-able /əbl/ readable, lovable",
-        "-ible /ɪbl/ visible, possible", "-tion /shən/ action, station", "-sion /zhən/ vision, decision"
-    ]
+    if request.method == 'POST' and wants_json():
+        return submit_tool_job('decodable_text')
 
     if request.method == 'POST':
-        selected_patterns = request.form.getlist('phonics_patterns') # Use getlist for checkboxes
-        num_texts = request.form.get('num_texts', 1) # Default to 1 text
-        special_instructions = request.form.get('special_instructions')
-
-        if not selected_patterns:
-            generated_text = "Please select at least one phonics pattern."
+        try:
+            job = submit_generation_job('decodable_text', build_decodable_text_prompt(request.form))
+        except PromptInputError as e:
+            generated_text = str(e)
+        except QueueFullError as e:
+            generated_text = f"{e} Please try again in {e.retry_after} seconds."
         else:
-            prompt = f"Generate {num_texts} short, decodable texts for early readers. "
-            prompt += f"These texts should primarily use words that contain the following phonics patterns: {', '.join(selected_patterns)}. "
-            prompt += "Keep sentences simple and repetitive. "
-
-            if special_instructions:
-                prompt += f"Additional instructions: {special_instructions}. "
-
-            prompt += "Format each text clearly, perhaps labeling them Text 1, Text 2, etc."
-
-            generated_text = generate_text(prompt, inference_server, model_name)
+            generated_text = job_result(current_app.extensions['job_queue'], job)
+            if job.status == DONE:
+                generated_text, decodability = retry_undecodable_texts(generated_text)
 
     return render_template(
         'tool_decodable_text.html',
@@ -300,20 +506,54 @@ def decodable_text():
         selected_patterns=request.form.getlist('phonics_patterns'), # Retain selected checkboxes
         num_texts=request.form.get('num_texts', 1),
         special_instructions=request.form.get('special_instructions', ''),
+        decodability=decodability,
+        decodable_threshold=current_app.config['DECODABLE_THRESHOLD'],
         # Pass the phonics patterns list to the template
-        phonics_patterns=phonics_patterns
+        phonics_patterns=PHONICS_PATTERNS
     )
 
+@bp.route('/decodable_text/check', methods=['POST'])
+def check_decodable_text():
+    # Score each text of a generated answer (field "text") against the selected patterns;
+    # complete says whether the answer splits into the number of texts asked for
+    report = check_decodability(request.form.get('text', ''))
+    return jsonify(
+        threshold=current_app.config['DECODABLE_THRESHOLD'], texts=report,
+        complete=complete_set(report, decodable_text_count(request.form))
+    )
+
+@bp.route('/decodable_text/fix', methods=['POST'])
+def fix_decodable_text():
+    # Queue new versions of the texts of an answer (field "text") that score below the
+    # threshold; the page polls them and puts each in place of the old one. An answer that
+    # doesn't split into the texts asked for gets one job for the whole set (job_id/status_url).
+    report = check_decodability(request.form.get('text', ''))
+    low = texts_below_threshold(report)
+    if not low:
+        return jsonify(texts=report)
+    if not complete_set(report, decodable_text_count(request.form)):
+        try:
+            job = submit_decodable_regeneration()
+        except PromptInputError as e:
+            return jsonify(error=str(e)), 400
+        except QueueFullError as e:
+            return queue_full_response(e)
+        return jsonify(texts=report, job_id=job.id, status_url=url_for('main.job_status', job_id=job.id)), 202
+    try:
+        retry_jobs = submit_decodable_retries(low)
+    except PromptInputError as e:
+        return jsonify(error=str(e)), 400
+    except QueueFullError as e:
+        return queue_full_response(e)
+    for text, job in zip(low, retry_jobs):
+        text['job_id'] = job.id
+        text['status_url'] = url_for('main.job_status', job_id=job.id)
+    return jsonify(texts=report), 202
+
 @bp.route('/lesson_plan', methods=['GET', 'POST'])
 def lesson_plan():
     generated_lesson_plan = None
-    inference_server = session.get('inference_server', 'ollama')
-    model_name = None
-
-    if inference_server == 'ollama':
-        model_name = session.get('ollama_model', DEFAULT_OLLAMA_MODEL)
-    elif inference_server == 'openai':
-        model_name = session.get('openai_model', DEFAULT_OPENAI_MODEL)
+    inference_server, model_name = current_model()
 
     # Define the list of grade levels for the template
     grade_level_options = [
@@ -322,27 +562,20 @@ def lesson_plan():
         '9th Grade', '10th Grade', '11th Grade', '12th Grade', 'University'
     ]
 
-    if request.method == 'POST':
-        grade_level = request.form.get('grade_level')
-        topic_standard_objective = request.form.get('topic_standard_objective')
-        additional_criteria = request.form.get('additional_criteria')
-        standards_to_align = request.form.get('standards_to_align')
-
-        if not grade_level or not topic_standard_objective:
-            generated_lesson_plan = "Please provide the Grade Level and Topic, Standard, or Objective."
-        else:
-            prompt = f"Generate a lesson plan for students in {grade_level}. "
-            prompt += f"The lesson is based on the following topic, standard, or objective: {topic_standard_objective}. "
-
-            if additional_criteria:
-                prompt += f"Include the following additional criteria: {additional_criteria}. "
-            if standards_to_align:
-                prompt += f"Align the lesson plan to the following standards: {standards_to_align}. "
+    sectioned = request.form.get('sectioned') == '1'
 
-            prompt += "Provide a comprehensive lesson plan structure including objectives, materials, procedures, assessment, and differentiation."
+    if request.method == 'POST' and wants_json():
+        return submit_sectioned_lesson_plan() if sectioned else submit_tool_job('lesson_plan')
 
-
-            generated_lesson_plan = generate_text(prompt, inference_server, model_name)
+    if request.method == 'POST' and sectioned:
+        generated_lesson_plan = run_sectioned_lesson_plan()
+    elif request.method == 'POST':
+        try:
+            prompt = build_lesson_plan_prompt(request.form)
+        except PromptInputError as e:
+            generated_lesson_plan = str(e)
+        else:
+            generated_lesson_plan = run_generation_job('lesson_plan', prompt)
 
     return render_template(
         'tool_lesson_plan.html',
@@ -354,8 +587,151 @@ def lesson_plan():
         topic_standard_objective=request.form.get('topic_standard_objective', ''),
         additional_criteria=request.form.get('additional_criteria', ''),
         standards_to_align=request.form.get('standards_to_align', ''),
+        sectioned=sectioned,
         # Pass the grade level options to the template
         grade_level_options=grade_level_options
     )
 
+@bp.route('/lesson_plan/sections/<section>', methods=['POST'])
+def lesson_plan_section(section):
+    # Regenerate one section of a sectioned lesson plan from the same form inputs
+    if section not in LESSON_PLAN_SECTIONS:
+        abort(404)
+    try:
+        job = submit_lesson_plan_sections([section], regenerate=True)[0]
+    except PromptInputError as e:
+        return jsonify(error=str(e)), 400
+    except QueueFullError as e:
+        return queue_full_response(e)
+    return jsonify(section_status(section, job)), 202
+
+@bp.route('/jobs/<job_id>')
+def job_status(job_id):
+    jobs = current_app.extensions['job_queue']
+    job = jobs.get(job_id)
+    if job is None:
+        abort(404)
+    status = job.to_dict()
+    status['queue_position'] = jobs.position(job)
+    return jsonify(status)
+
+@bp.route('/queue')
+def queue_status():
+    # How busy the generation queue is, and this session's own queued and running jobs
+    return jsonify(current_app.extensions['job_queue'].status(client=g.client))
+
+@bp.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = current_app.extensions['job_queue'].cancel(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job.to_dict())
+
+@bp.route('/generations/<generation_id>')
+def generation(generation_id):
+    # An earlier answer from the generation index, for reusing it instead of generating
+    index = current_app.extensions.get('generation_index')
+    result = index.get(generation_id) if index is not None else None
+    if result is None:
+        abort(404)
+    return jsonify(result)
+
+@bp.route('/jobs/<job_id>/continue', methods=['POST'])
+def continue_job(job_id):
+    # Queue a job that carries on a truncated answer; the page appends its output to the old one
+    jobs = current_app.extensions['job_queue']
+    job = jobs.get(job_id)
+    if job is None:
+        abort(404)
+    if not job.truncated:
+        return jsonify(error="Only answers that stopped at the length limit can be continued."), 409
+    try:
+        continuation = jobs.submit_continuation(job)
+    except QueueFullError as e:
+        return queue_full_response(e)
+    return jsonify(job_id=continuation.id, status_url=url_for('main.job_status', job_id=continuation.id)), 202
+
+def sse(data, event=None):
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+def job_events(job, cancel_on_disconnect):
+    # A job's output as Server-Sent Events: 'queued' with the queue position while it waits,
+    # a message per chunk as the model produces it, then 'done' or 'error'
+    jobs = current_app.extensions['job_queue']
+    seen = 0
+    position = None
+    try:
+        while True:
+            if job.status == QUEUED and jobs.position(job) != position:
+                position = jobs.position(job)
+                yield sse({'queue_position': position}, event='queued')
+            # Queued jobs are checked every second for their position; a job that starts wakes us right away
+            chunk, finished = job.wait_for_output(seen, timeout=1.0 if job.status == QUEUED else jobs.timeout)
+            if chunk:
+                seen += len(chunk)
+                yield sse({'text': chunk})
+            if finished:
+                break
+            jobs.get(job.id) # applies the job timeout
+    except GeneratorExit:
+        # The client went away; stop the generation it was waiting for, unless it can pick it up elsewhere
+        if cancel_on_disconnect:
+            jobs.cancel(job.id)
+        raise
+
+    if job.status != DONE:
+        yield sse({'message': job.error or f"The generation was {job.status}."}, event='error')
+        return
+    status = job.to_dict()
+    logger.info("streamed generation", extra={
+        'tool': job.tool, 'backend': job.settings.backend, 'model': job.settings.model, 'ttft': status['ttft'], 'total': status['total']
+    })
+    # Time-to-first-token is reported separately from the total generation time. A truncated
+    # answer comes with the URL that continues it.
+    done = {'ttft': status['ttft'], 'total': status['total'], 'truncated': status['truncated']}
+    if job.truncated:
+        done['continue_url'] = url_for('main.continue_job', job_id=job.id)
+    yield sse(done, event='done')
+
+def sse_response(events):
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@bp.route('/jobs/<job_id>/events')
+def job_event_stream(job_id):
+    # The tool pages follow their job here with EventSource (and poll /jobs/<id> if that fails,
+    # so losing the connection doesn't cancel the job)
+    job = current_app.extensions['job_queue'].get(job_id)
+    if job is None:
+        abort(404)
+    return sse_response(job_events(job, cancel_on_disconnect=False))
+
+@bp.route('/stream/<tool>', methods=['POST'])
+def stream_tool(tool):
+    # Server-Sent-Events version of the tool routes, in one request: the generation runs as a
+    # queued job and its chunks are forwarded to the client as the model produces them. A full
+    # queue or a client over its limits gets 429 with Retry-After before the stream starts.
+    build_prompt = PROMPT_BUILDERS.get(tool)
+    if build_prompt is None:
+        abort(404)
+
+    try:
+        prompt = build_prompt(request.form)
+    except PromptInputError as e:
+        return sse_response(iter([sse({'text': str(e)}), sse({'ttft': None, 'total': 0.0}, event='done')]))
+    try:
+        job = submit_generation_job(tool, prompt)
+    except QueueFullError as e:
+        return queue_full_response(e)
+    return sse_response(job_events(job, cancel_on_disconnect=True))
+
+@bp.route('/metrics')
+def metrics():
+    # Prometheus scrape endpoint
+    return Response(REGISTRY.render(app_families(current_app)), mimetype='text/plain; version=0.0.4')
+
 # Add routes for other tools here as you implement them
\ No newline at end of file
@@ -0,0 +1,145 @@
+# Per-user settings kept on the server.
+# The session cookie only carries a random settings id; the chosen backend, hosts and models
+# live in a SettingsStore: a dict in this process, or a SQLite file under the instance folder
+# that every worker process shares (needed when running several gunicorn workers).
+# Each request turns the user's settings plus the app config into a GenerationSettings object
+# that is passed explicitly down to the generation code and backends.
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from .backends import get_backend
+
+logger = logging.getLogger(__name__)
+
+USER_SETTING_FIELDS = ('inference_server', 'ollama_ip', 'ollama_model', 'openai_model', 'openai_compatible_model')
+
+
+class UserSettings:
+    def __init__(self, inference_server='ollama', ollama_ip=None, ollama_model=None, openai_model=None,
+                 openai_compatible_model=None):
+        self.inference_server = inference_server
+        self.ollama_ip = ollama_ip
+        self.ollama_model = ollama_model
+        self.openai_model = openai_model
+        self.openai_compatible_model = openai_compatible_model
+
+    @classmethod
+    def defaults(cls, config):
+        return cls(
+            inference_server='ollama',
+            ollama_ip=config['OLLAMA_HOSTS'],
+            ollama_model=config['DEFAULT_OLLAMA_MODEL'],
+            openai_model=config['DEFAULT_OPENAI_MODEL'],
+            openai_compatible_model=config['DEFAULT_OPENAI_COMPATIBLE_MODEL']
+        )
+
+    def update(self, values):
+        # Copy known, non-empty fields from a dict (stored settings or a submitted form)
+        for name in USER_SETTING_FIELDS:
+            if values.get(name):
+                setattr(self, name, values.get(name))
+        return self
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in USER_SETTING_FIELDS}
+
+    def model_for(self, backend):
+        return getattr(self, f"{backend}_model", None)
+
+
+class GenerationSettings:
+    # Where and how one generation runs, resolved once per request
+    def __init__(self, backend, model, hosts=(), api_key=None, keep_alive=None, num_ctx=None):
+        self.backend = backend
+        self.model = model
+        self.hosts = tuple(hosts)
+        self.api_key = api_key
+        self.keep_alive = keep_alive
+        self.num_ctx = num_ctx # smallest Ollama context window; see profiles.context_window
+
+    def to_dict(self):
+        # Without the API key; for logs and job status
+        return {'backend': self.backend, 'model': self.model, 'hosts': list(self.hosts)}
+
+
+def generation_settings(user, config):
+    # Resolve a user's settings against the app config; the selected backend knows which
+    # config values it needs. Unknown backends give settings that generate_text refuses.
+    backend = get_backend(user.inference_server)
+    if backend is None:
+        return GenerationSettings(user.inference_server, None)
+    return backend.resolve_settings(user, config)
+
+
+class SettingsStore:
+    # How many writes between passes that forget settings nobody has saved for ttl seconds
+    PRUNE_EVERY = 100
+
+    def __init__(self, db_path=None, ttl=90 * 24 * 3600, max_entries=10000):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries # in-memory mode only; the SQLite file is pruned by age
+        self._memory = OrderedDict() # settings id -> (saved_at, values)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+
+        if self.db_path:
+            self._db().execute(
+                "CREATE TABLE IF NOT EXISTS settings (id TEXT PRIMARY KEY, value TEXT NOT NULL, saved_at REAL NOT NULL)"
+            )
+
+    def _db(self):
+        # sqlite3 connections can't be shared between threads, so keep one per thread (and per process)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, settings_id):
+        # The stored values for settings_id, or None. With SQLite every read goes to the file,
+        # so a change saved through one worker is seen by all of them on their next request.
+        if self.db_path:
+            try:
+                row = self._db().execute("SELECT value FROM settings WHERE id = ?", (settings_id,)).fetchone()
+            except sqlite3.Error as e:
+                logger.warning("could not read settings", extra={'error': str(e)})
+                return None
+            return json.loads(row[0]) if row is not None else None
+        with self._lock:
+            entry = self._memory.get(settings_id)
+            if entry is None:
+                return None
+            self._memory.move_to_end(settings_id)
+            return dict(entry[1])
+
+    def set(self, settings_id, values):
+        now = time.time()
+        if self.db_path:
+            try:
+                self._db().execute(
+                    "INSERT OR REPLACE INTO settings (id, value, saved_at) VALUES (?, ?, ?)",
+                    (settings_id, json.dumps(values), now)
+                )
+                with self._lock:
+                    self._writes += 1
+                    prune = self._writes % self.PRUNE_EVERY == 0
+                if prune:
+                    self._db().execute("DELETE FROM settings WHERE saved_at < ?", (now - self.ttl,))
+            except sqlite3.Error as e:
+                logger.warning("could not save settings", extra={'error': str(e)})
+            return
+        with self._lock:
+            self._memory[settings_id] = (now, dict(values))
+            self._memory.move_to_end(settings_id)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
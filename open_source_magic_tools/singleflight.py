@@ -0,0 +1,239 @@
+# Single-flight coalescing of identical in-flight generations.
+# Concurrent calls with the same key (backend + model + prompt + options) share one upstream
+# inference: the first caller (the leader) runs it, the others wait and receive its result, or
+# its chunks as they arrive when streaming. If a streaming leader's consumer stops early (its
+# job was cancelled), the generation goes on in the background while any followers remain.
+# Across worker processes, the leader also holds an exclusive file lock for the key under
+# lock_dir; a leader in another process waits on that lock and then looks in the shared disk
+# cache before deciding to run the inference itself. File locks need fcntl, so on platforms
+# without it (Windows) coalescing is per process only.
+import contextvars
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class _Call:
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.followers = 0 # callers coalesced onto this one that are still reading; guarded by SingleFlight._lock
+        self.cond = threading.Condition()
+
+    def publish(self, chunk):
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+    def finish(self, error=None):
+        with self.cond:
+            self.done = True
+            self.error = error
+            self.cond.notify_all()
+
+    def follow(self):
+        # Yields the leader's chunks, including those published before we joined
+        seen = 0
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: len(self.chunks) > seen or self.done)
+                chunks = self.chunks[seen:]
+                done, error = self.done, self.error
+            for chunk in chunks:
+                yield chunk
+            seen += len(chunks)
+            if done and seen == len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+
+class SingleFlight:
+    def __init__(self, lock_dir=None, lock_timeout=300):
+        self.lock_dir = lock_dir if fcntl is not None else None
+        self.lock_timeout = lock_timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.counters = {'leaders': 0, 'coalesced': 0, 'coalesced_cross_process': 0}
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, exist_ok=True)
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _join(self, key):
+        # Returns (call, is_leader)
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.counters['coalesced'] += 1
+                call.followers += 1
+                return call, False
+            call = self._calls[key] = _Call()
+            self.counters['leaders'] += 1
+            return call, True
+
+    def _leave(self, key, call, error=None):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.finish(error)
+
+    def _unfollow(self, call):
+        with self._lock:
+            call.followers -= 1
+
+    def _keep_for_followers(self, key, call):
+        # Whether anyone still follows a call whose leader went away; if not, the call is over
+        with self._lock:
+            if call.followers:
+                return True
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.finish(RuntimeError("The shared generation was cancelled."))
+        return False
+
+    def do(self, key, fn, recheck=None):
+        # Run fn() once for all concurrent callers with this key and return its result.
+        # recheck() looks for a result another process stored while we waited for its lock.
+        call, leader = self._join(key)
+        if not leader:
+            try:
+                return ''.join(call.follow())
+            finally:
+                self._unfollow(call)
+        try:
+            with self._process_lock(key) as waited:
+                result = recheck() if waited and recheck is not None else None
+                if result is not None:
+                    self._count('coalesced_cross_process')
+                else:
+                    result = fn()
+        except BaseException as e:
+            self._leave(key, call, e)
+            raise
+        call.publish(result)
+        self._leave(key, call)
+        return result
+
+    def stream(self, key, make_stream, recheck=None):
+        # Streaming version of do(): yields the chunks of one shared make_stream() iterator
+        call, leader = self._join(key)
+        if not leader:
+            try:
+                yield from call.follow()
+            finally:
+                self._unfollow(call)
+            return
+        upstream = self._lead(key, call, make_stream, recheck)
+        try:
+            # Not `yield from`, which would close upstream along with us
+            for chunk in upstream:
+                yield chunk
+        except GeneratorExit:
+            # Our consumer stopped early (e.g. its job was cancelled). That mustn't fail the callers
+            # coalesced onto us, so they get the rest of the generation from a background thread.
+            if self._keep_for_followers(key, call):
+                threading.Thread(
+                    target=contextvars.copy_context().run, args=(self._drain, key, call, upstream),
+                    name="single-flight-drain", daemon=True
+                ).start()
+            else:
+                upstream.close()
+            raise
+        except BaseException as e:
+            self._leave(key, call, e if isinstance(e, Exception) else RuntimeError("The shared generation was cancelled."))
+            raise
+        self._leave(key, call)
+
+    def _lead(self, key, call, make_stream, recheck):
+        # The leader's side of stream(): runs make_stream() under the process lock, publishing each chunk
+        with self._process_lock(key) as waited:
+            result = recheck() if waited and recheck is not None else None
+            if result is not None:
+                self._count('coalesced_cross_process')
+                call.publish(result)
+                yield result
+            else:
+                for chunk in make_stream():
+                    call.publish(chunk)
+                    yield chunk
+
+    def _drain(self, key, call, upstream):
+        # Finishes a generation whose leader went away, for as long as someone follows it
+        try:
+            for _ in upstream:
+                if not self._keep_for_followers(key, call):
+                    upstream.close()
+                    return
+        except Exception as e:
+            self._leave(key, call, e)
+            return
+        self._leave(key, call)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['in_flight'] = len(self._calls)
+        return stats
+
+    def _process_lock(self, key):
+        return _FileLock(os.path.join(self.lock_dir, f"{key}.lock"), self.lock_timeout) if self.lock_dir else _NoLock()
+
+
+class _NoLock:
+    def __enter__(self):
+        return False
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _FileLock:
+    # Exclusive flock on path. __enter__ returns True if another process held it and we had to wait.
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, path, timeout):
+        self.path = path
+        self.timeout = timeout
+        self.fd = None
+        self.acquired = False
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self.acquired = True
+            return False
+        except BlockingIOError:
+            pass
+        deadline = time.time() + self.timeout
+        while time.time() < deadline:
+            time.sleep(self.POLL_INTERVAL)
+            try:
+                fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self.acquired = True
+                return True
+            except BlockingIOError:
+                continue
+        # The other process is taking too long; go ahead without the lock
+        return True
+
+    def __exit__(self, *exc):
+        # Only the holder removes the file: after a timeout it's still another process's lock
+        if self.acquired:
+            try:
+                # Remove the file before unlocking; a process already waiting on it just
+                # finds the result in the cache (or, at worst, runs its own inference)
+                os.unlink(self.path)
+            except OSError:
+                pass
+        os.close(self.fd) # closing the descriptor releases the lock
+        return False
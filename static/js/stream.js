@@ -0,0 +1,556 @@
+// Shows tool output in the page as the model produces it.
+// The tool form is posted to its own URL with Accept: application/json, which queues a
+// generation job and answers with its status URL right away. The page then follows the job's
+// Server-Sent Events (<status URL>/events) and fills the generated-output block with the output
+// as it arrives; without EventSource, or if the connection fails, it polls the status URL instead.
+// When the answer stopped at the tool's length limit, a Continue button queues a follow-up job
+// whose output is appended to the answer, instead of regenerating it from scratch.
+// If similar inputs were answered before, the server offers those answers first: the page
+// lists them to reuse one right away, or to generate a fresh answer anyway.
+// Sectioned answers (a lesson plan's sections generated side by side) come back as one job per
+// section: the page polls them all, shows them stitched together in order, and offers a button
+// per section that regenerates just that section.
+// options.afterGenerate(formData), if given, is called once an answer is complete (e.g. to
+// check it), with the form data it was generated from; decodabilityChecker builds one for the
+// decodable text tool.
+// Without JavaScript the form posts normally and the page waits for the result.
+const POLL_INTERVAL_MS = 500;
+
+function streamToolForm(formId, blockId, outputId, timingId, options) {
+    options = options || {};
+    const form = document.getElementById(formId);
+    if (!form || !window.fetch) {
+        return;
+    }
+
+    form.addEventListener('submit', function (event) {
+        event.preventDefault();
+
+        const formData = new FormData(form);
+        // Keep the name/value of the clicked button (e.g. action=regenerate_hook)
+        if (event.submitter && event.submitter.name) {
+            formData.append(event.submitter.name, event.submitter.value);
+        }
+
+        const block = document.getElementById(blockId);
+        const output = document.getElementById(outputId);
+        const timing = document.getElementById(timingId);
+        const buttons = form.querySelectorAll('button[type="submit"]');
+
+        // Cancel button for the running job, created once per page
+        let cancel = document.getElementById('cancel_button');
+        if (!cancel) {
+            cancel = document.createElement('button');
+            cancel.id = 'cancel_button';
+            cancel.type = 'button';
+            cancel.className = 'copy-button';
+            cancel.textContent = 'Cancel';
+            timing.insertAdjacentElement('afterend', cancel);
+        }
+
+        // Continue button for answers cut off at the length limit, created once per page
+        let resume = document.getElementById('continue_button');
+        if (!resume) {
+            resume = document.createElement('button');
+            resume.id = 'continue_button';
+            resume.type = 'button';
+            resume.className = 'copy-button';
+            resume.textContent = 'Continue';
+            cancel.insertAdjacentElement('afterend', resume);
+        }
+        resume.style.display = 'none';
+
+        // Earlier answers to similar inputs, listed above the output when the server offers them
+        let similar = document.getElementById('similar_generations');
+        if (!similar) {
+            similar = document.createElement('div');
+            similar.id = 'similar_generations';
+            output.insertAdjacentElement('beforebegin', similar);
+        }
+        similar.style.display = 'none';
+
+        // Per-section regenerate buttons for sectioned answers, created once per page
+        let sectionButtons = document.getElementById('section_buttons');
+        if (!sectionButtons) {
+            sectionButtons = document.createElement('div');
+            sectionButtons.id = 'section_buttons';
+            resume.insertAdjacentElement('afterend', sectionButtons);
+        }
+        sectionButtons.style.display = 'none';
+
+        output.textContent = '';
+        timing.textContent = 'Queued...';
+        block.style.display = 'block';
+        buttons.forEach(function (button) { button.disabled = true; });
+
+        function finish(message) {
+            if (message) {
+                output.textContent += (output.textContent ? '\n\n' : '') + message;
+            }
+            cancel.style.display = 'none';
+            buttons.forEach(function (button) { button.disabled = false; });
+            const regenerate = document.getElementById('regenerate_button');
+            if (regenerate) {
+                regenerate.style.display = '';
+            }
+        }
+
+        // Refusals from a busy queue (429) say when to try again
+        function errorMessage(data) {
+            return data.retry_after ? data.error + ' (Try again in ' + data.retry_after + 's.)' : data.error;
+        }
+
+        function showTimings(job) {
+            const parts = [];
+            if (job.ttft !== null) {
+                parts.push('First token: ' + job.ttft.toFixed(2) + 's');
+            }
+            if (job.total !== null) {
+                parts.push('Total: ' + job.total.toFixed(2) + 's');
+            }
+            timing.textContent = parts.join(' | ');
+        }
+
+        function offerContinue(statusUrl) {
+            resume.style.display = '';
+            resume.onclick = function () {
+                resume.style.display = 'none';
+                buttons.forEach(function (button) { button.disabled = true; });
+                timing.textContent = 'Queued...';
+                fetch(statusUrl + '/continue', { method: 'POST', headers: { 'Accept': 'application/json' } })
+                    .then(function (response) {
+                        return response.json().then(function (data) {
+                            if (!response.ok) {
+                                timing.textContent = '';
+                                finish(errorMessage(data));
+                                return;
+                            }
+                            watch(data.status_url, output.textContent);
+                        });
+                    })
+                    .catch(function (err) {
+                        console.error('Continuing failed: ', err);
+                        timing.textContent = '';
+                        finish('An error occurred while generating the response.');
+                    });
+            };
+        }
+
+        function watch(statusUrl, prefix) {
+            cancel.style.display = '';
+            cancel.onclick = function () {
+                fetch(statusUrl + '/cancel', { method: 'POST' });
+            };
+            if (window.EventSource) {
+                listen(statusUrl, prefix);
+            } else {
+                poll(statusUrl, prefix);
+            }
+        }
+
+        function done(job, statusUrl) {
+            finish();
+            if (job.truncated) {
+                timing.textContent += ' | Stopped at the length limit';
+                offerContinue(statusUrl);
+            }
+            if (options.afterGenerate) {
+                options.afterGenerate(formData);
+            }
+        }
+
+        // prefix is the answer so far when this job continues an earlier one
+        function listen(statusUrl, prefix) {
+            const source = new EventSource(statusUrl + '/events');
+            let text = '';
+            source.addEventListener('queued', function (event) {
+                const data = JSON.parse(event.data);
+                timing.textContent = data.queue_position ? 'Queued (position ' + data.queue_position + ')...' : 'Queued...';
+            });
+            source.onmessage = function (event) {
+                if (!text) {
+                    timing.textContent = 'Generating...';
+                }
+                text += JSON.parse(event.data).text;
+                output.textContent = prefix + text;
+            };
+            source.addEventListener('done', function (event) {
+                source.close();
+                const job = JSON.parse(event.data);
+                output.textContent = prefix + text;
+                showTimings(job);
+                done(job, statusUrl);
+            });
+            source.addEventListener('error', function (event) {
+                source.close();
+                if (event.data) {
+                    // The job failed, was cancelled or timed out
+                    timing.textContent = '';
+                    finish(JSON.parse(event.data).message);
+                    return;
+                }
+                // The connection failed; the job goes on, so poll it instead
+                poll(statusUrl, prefix);
+            });
+        }
+
+        // prefix is the answer so far when this job continues an earlier one
+        function poll(statusUrl, prefix) {
+            fetch(statusUrl, { headers: { 'Accept': 'application/json' } })
+                .then(function (response) { return response.json(); })
+                .then(function (job) {
+                    output.textContent = prefix + job.output;
+                    if (job.status === 'queued') {
+                        timing.textContent = job.queue_position
+                            ? 'Queued (position ' + job.queue_position + ')...'
+                            : 'Queued...';
+                    } else {
+                        showTimings(job);
+                    }
+                    if (job.status === 'queued' || job.status === 'running') {
+                        setTimeout(function () { poll(statusUrl, prefix); }, POLL_INTERVAL_MS);
+                    } else if (job.status === 'done') {
+                        done(job, statusUrl);
+                    } else {
+                        finish(job.error || 'The generation was ' + job.status + '.');
+                    }
+                })
+                .catch(function (err) {
+                    console.error('Polling failed: ', err);
+                    finish('An error occurred while generating the response.');
+                });
+        }
+
+        function showSections(sections) {
+            output.textContent = sections.map(function (section) {
+                return section.heading + '\n\n' + (section.text || (section.status === 'queued' ? '(Queued...)' : ''));
+            }).join('\n\n');
+            const done = sections.filter(function (section) { return section.finished; }).length;
+            timing.textContent = 'Sections: ' + done + '/' + sections.length + ' done';
+        }
+
+        function watchSections(sections) {
+            const started = Date.now();
+            sectionButtons.style.display = 'none';
+            cancel.style.display = '';
+            cancel.onclick = function () {
+                sections.forEach(function (section) {
+                    fetch(section.status_url + '/cancel', { method: 'POST' });
+                });
+            };
+            sections.forEach(function (section) {
+                section.finished = false;
+                pollSection(sections, section, started);
+            });
+        }
+
+        function pollSection(sections, section, started) {
+            fetch(section.status_url, { headers: { 'Accept': 'application/json' } })
+                .then(function (response) { return response.json(); })
+                .then(function (job) {
+                    section.status = job.status;
+                    section.text = job.output;
+                    if (job.status === 'queued' || job.status === 'running') {
+                        showSections(sections);
+                        setTimeout(function () { pollSection(sections, section, started); }, POLL_INTERVAL_MS);
+                        return;
+                    }
+                    if (job.status !== 'done') {
+                        section.text += (section.text ? '\n\n' : '') + '(' + (job.error || 'The section was ' + job.status + '.') + ')';
+                    }
+                    sectionFinished(sections, section, started);
+                })
+                .catch(function (err) {
+                    console.error('Polling failed: ', err);
+                    section.text = '(An error occurred while generating this section.)';
+                    sectionFinished(sections, section, started);
+                });
+        }
+
+        function sectionFinished(sections, section, started) {
+            section.finished = true;
+            showSections(sections);
+            if (sections.every(function (other) { return other.finished; })) {
+                timing.textContent = 'Total: ' + ((Date.now() - started) / 1000).toFixed(2) + 's';
+                finish();
+                offerSectionRegenerate(sections);
+            }
+        }
+
+        function offerSectionRegenerate(sections) {
+            sectionButtons.textContent = '';
+            sections.forEach(function (section) {
+                const button = document.createElement('button');
+                button.type = 'button';
+                button.className = 'copy-button';
+                button.textContent = 'Regenerate ' + section.heading.replace(/^#+\s*/, '');
+                button.onclick = function () {
+                    sectionButtons.style.display = 'none';
+                    buttons.forEach(function (button) { button.disabled = true; });
+                    fetch(section.regenerate_url, {
+                        method: 'POST',
+                        body: formData,
+                        headers: { 'Accept': 'application/json' }
+                    })
+                        .then(function (response) {
+                            return response.json().then(function (data) {
+                                if (!response.ok) {
+                                    timing.textContent = errorMessage(data);
+                                    finish();
+                                    sectionButtons.style.display = '';
+                                    return;
+                                }
+                                section.status_url = data.status_url;
+                                section.status = 'queued';
+                                section.text = '';
+                                section.finished = false;
+                                cancel.style.display = '';
+                                cancel.onclick = function () { fetch(section.status_url + '/cancel', { method: 'POST' }); };
+                                pollSection(sections, section, Date.now());
+                            });
+                        })
+                        .catch(function (err) {
+                            console.error('Regenerating the section failed: ', err);
+                            timing.textContent = 'An error occurred while regenerating the section.';
+                            finish();
+                            sectionButtons.style.display = '';
+                        });
+                };
+                sectionButtons.appendChild(button);
+            });
+            sectionButtons.style.display = '';
+        }
+
+        function reuse(match) {
+            fetch(match.url, { headers: { 'Accept': 'application/json' } })
+                .then(function (response) { return response.json(); })
+                .then(function (generation) {
+                    similar.style.display = 'none';
+                    output.textContent = generation.output;
+                    timing.textContent = 'Reused an earlier answer';
+                    finish();
+                    if (options.afterGenerate) {
+                        options.afterGenerate(formData);
+                    }
+                })
+                .catch(function (err) {
+                    console.error('Loading the earlier answer failed: ', err);
+                    finish('An error occurred while loading the earlier answer.');
+                });
+        }
+
+        function offerSimilar(matches) {
+            similar.textContent = '';
+            matches.forEach(function (match) {
+                const preview = document.createElement('pre');
+                preview.textContent = match.preview + (match.preview.length >= 300 ? '...' : '');
+                const use = document.createElement('button');
+                use.type = 'button';
+                use.className = 'copy-button';
+                use.textContent = 'Use this (' + Math.round(match.similarity * 100) + '% similar)';
+                use.onclick = function () { reuse(match); };
+                similar.appendChild(preview);
+                similar.appendChild(use);
+            });
+            const fresh = document.createElement('button');
+            fresh.type = 'button';
+            fresh.className = 'copy-button';
+            fresh.textContent = 'Generate fresh';
+            fresh.onclick = function () {
+                similar.style.display = 'none';
+                formData.set('skip_similar', '1');
+                timing.textContent = 'Queued...';
+                buttons.forEach(function (button) { button.disabled = true; });
+                submit();
+            };
+            similar.appendChild(document.createElement('hr'));
+            similar.appendChild(fresh);
+            similar.style.display = '';
+            timing.textContent = 'Similar requests were answered before. Use one of these, or generate a fresh answer.';
+            buttons.forEach(function (button) { button.disabled = false; });
+        }
+
+        function submit() {
+            fetch(window.location.href, {
+                method: 'POST',
+                body: formData,
+                headers: { 'Accept': 'application/json' }
+            })
+                .then(function (response) {
+                    return response.json().then(function (data) {
+                        if (!response.ok) {
+                            timing.textContent = '';
+                            finish(errorMessage(data));
+                            return;
+                        }
+                        if (data.similar) {
+                            offerSimilar(data.similar);
+                            return;
+                        }
+                        if (data.sections) {
+                            watchSections(data.sections);
+                            return;
+                        }
+                        watch(data.status_url, '');
+                    });
+                })
+                .catch(function (err) {
+                    console.error('Submitting failed: ', err);
+                    timing.textContent = '';
+                    finish('An error occurred while generating the response.');
+                });
+        }
+
+        submit();
+    });
+}
+
+// afterGenerate hook for the decodable text tool: scores each text of the answer in outputId
+// against the selected phonics patterns and the ones taught before them (POST to urls.check),
+// lists the words outside them and counts the words practising the selected ones in reportId,
+// and offers to regenerate only the texts below the threshold (POST to urls.fix).
+// The new versions are polled and put in place of the old ones, then the answer is scored again.
+// An answer that doesn't split into the number of texts asked for is regenerated as a whole
+// instead, since replacing one of its "texts" could drop the stories inside it.
+function decodabilityChecker(formId, outputId, timingId, reportId, urls) {
+    const TEXT_LABEL = /^[^\w\n]*Text\s+\d+\b/i;
+    const form = document.getElementById(formId);
+    const output = document.getElementById(outputId);
+    const timing = document.getElementById(timingId);
+    const report = document.getElementById(reportId);
+
+    // An earlier answer's scores don't apply to the next one
+    form.addEventListener('submit', function () {
+        report.textContent = '';
+    });
+
+    // The form data the answer was generated from, plus the answer itself
+    function answerForm(formData) {
+        const body = new FormData();
+        formData.forEach(function (value, name) { body.append(name, value); });
+        body.set('text', output.textContent);
+        return body;
+    }
+
+    function check(formData) {
+        fetch(urls.check, { method: 'POST', body: answerForm(formData), headers: { 'Accept': 'application/json' } })
+            .then(function (response) { return response.json(); })
+            .then(function (data) { showReport(data.texts, data.threshold, data.complete, formData); })
+            .catch(function (err) { console.error('Checking decodability failed: ', err); });
+    }
+
+    function showReport(texts, threshold, complete, formData) {
+        report.textContent = '';
+        const list = document.createElement('ul');
+        const low = [];
+        texts.forEach(function (text) {
+            if (text.number === null) {
+                return;
+            }
+            const item = document.createElement('li');
+            item.textContent = 'Text ' + text.number + ': ' + text.decodability + '% decodable'
+                + ', ' + text.focus_words.length + ' focus words'
+                + (text.flagged.length ? ' (check: ' + text.flagged.join(', ') + ')' : '');
+            list.appendChild(item);
+            if (text.decodability < threshold) {
+                low.push(text);
+            }
+        });
+        report.appendChild(list);
+        if (low.length) {
+            const fix = document.createElement('button');
+            fix.type = 'button';
+            fix.className = 'copy-button';
+            fix.textContent = complete
+                ? 'Regenerate ' + low.length + (low.length === 1 ? ' text' : ' texts') + ' below ' + threshold + '%'
+                : 'Regenerate all texts (some are below ' + threshold + '%)';
+            fix.onclick = function () {
+                fix.disabled = true;
+                fixTexts(formData);
+            };
+            report.appendChild(fix);
+        }
+    }
+
+    function fixTexts(formData) {
+        timing.textContent = 'Regenerating...';
+        fetch(urls.fix, { method: 'POST', body: answerForm(formData), headers: { 'Accept': 'application/json' } })
+            .then(function (response) {
+                return response.json().then(function (data) {
+                    if (!response.ok) {
+                        timing.textContent = data.retry_after ? data.error + ' (Try again in ' + data.retry_after + 's.)' : data.error;
+                        return;
+                    }
+                    if (data.status_url) {
+                        pollSet(data.status_url, formData);
+                        return;
+                    }
+                    const retried = data.texts.filter(function (text) { return text.status_url; });
+                    retried.forEach(function (text) { pollText(data.texts, retried, text, formData); });
+                });
+            })
+            .catch(function (err) {
+                console.error('Regenerating texts failed: ', err);
+                timing.textContent = 'An error occurred while regenerating the texts.';
+            });
+    }
+
+    // The whole set regenerated; the old one stays on the page until the new one is complete
+    function pollSet(statusUrl, formData) {
+        fetch(statusUrl, { headers: { 'Accept': 'application/json' } })
+            .then(function (response) { return response.json(); })
+            .then(function (job) {
+                if (job.status === 'queued' || job.status === 'running') {
+                    setTimeout(function () { pollSet(statusUrl, formData); }, POLL_INTERVAL_MS);
+                    return;
+                }
+                if (job.status !== 'done' || !job.output.trim()) {
+                    timing.textContent = job.error || 'The generation was ' + job.status + '.';
+                    return;
+                }
+                output.textContent = job.output;
+                timing.textContent = 'Regenerated all texts';
+                check(formData);
+            })
+            .catch(function (err) {
+                console.error('Polling failed: ', err);
+                timing.textContent = 'An error occurred while regenerating the texts.';
+            });
+    }
+
+    function pollText(texts, retried, text, formData) {
+        fetch(text.status_url, { headers: { 'Accept': 'application/json' } })
+            .then(function (response) { return response.json(); })
+            .then(function (job) {
+                if (job.status === 'queued' || job.status === 'running') {
+                    setTimeout(function () { pollText(texts, retried, text, formData); }, POLL_INTERVAL_MS);
+                    return;
+                }
+                if (job.status === 'done' && job.output.trim()) {
+                    // Keep the old text's label and the spacing after it
+                    let replacement = job.output.trim();
+                    if (!TEXT_LABEL.test(replacement)) {
+                        replacement = 'Text ' + text.number + '\n' + replacement;
+                    }
+                    text.text = replacement + text.text.slice(text.text.trimEnd().length);
+                }
+                textFinished(texts, retried, text, formData);
+            })
+            .catch(function (err) {
+                console.error('Polling failed: ', err);
+                textFinished(texts, retried, text, formData);
+            });
+    }
+
+    function textFinished(texts, retried, text, formData) {
+        // Once every retried text is back, show the new set and score it again
+        text.finished = true;
+        if (retried.every(function (other) { return other.finished; })) {
+            output.textContent = texts.map(function (other) { return other.text; }).join('');
+            timing.textContent = 'Regenerated ' + retried.length + (retried.length === 1 ? ' text' : ' texts');
+            check(formData);
+        }
+    }
+
+    return check;
+}
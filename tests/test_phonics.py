@@ -0,0 +1,29 @@
+from open_source_magic_tools.phonics import PhonicsMatcher, decodability_report
+
+SH_CH_CK = ['sh /sh/ ship, shop', 'ch /ch/ chin, chip', 'ck /k/ back, duck']
+SH_CH_CK_TEXT = """Text 1
+Chad has a duck. The duck can shop. Chip and the duck sit on a ship.
+The ship is big. Chad and Chip pick up a rock and get in the hut."""
+
+
+def test_well_formed_focus_text_passes():
+    matcher = PhonicsMatcher()
+    text, = decodability_report(SH_CH_CK_TEXT, matcher, matcher.mask(SH_CH_CK))
+    assert text['decodability'] >= 90
+    assert text['flagged'] == []
+    assert {'ship', 'chip', 'duck'} <= set(text['focus_words'])
+
+
+def test_words_outside_the_base_and_focus_are_flagged():
+    matcher = PhonicsMatcher()
+    score, flagged, focus_words = matcher.score("Chip and the duck sit in the rain.", matcher.mask(SH_CH_CK))
+    assert flagged == ['rain'] # ai isn't taught before sh, so r-a-i-n doesn't count
+    assert focus_words == ['chip', 'duck']
+    assert score < 90
+
+
+def test_patterns_earlier_in_the_list_are_part_of_the_base():
+    matcher = PhonicsMatcher()
+    mask = matcher.mask(['ai /ā/ rain, sail'])
+    assert matcher.decode('rain', mask) and matcher.decodable('shop', mask)
+    assert not matcher.decodable('catch', mask) # tch comes after ai
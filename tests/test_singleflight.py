@@ -0,0 +1,76 @@
+import threading
+from open_source_magic_tools.singleflight import SingleFlight
+
+
+def _upstream(finished, closed):
+    def make_stream():
+        try:
+            yield from ['Text 1', ' A cat', ' sat.']
+            finished.set()
+        finally:
+            closed.set()
+    return make_stream
+
+
+def _no_upstream():
+    raise AssertionError("a follower must not start its own generation")
+
+
+def test_follower_gets_the_whole_answer_when_the_leader_cancels():
+    single_flight = SingleFlight()
+    finished, closed = threading.Event(), threading.Event()
+    leader = single_flight.stream('key', _upstream(finished, closed))
+    assert next(leader) == 'Text 1'
+    follower = single_flight.stream('key', _no_upstream)
+    assert next(follower) == 'Text 1'
+
+    leader.close() # the leader's job was cancelled
+
+    assert ''.join(follower) == ' A cat sat.'
+    assert finished.is_set()
+    assert single_flight.stats()['in_flight'] == 0
+
+
+def test_leader_cancel_without_followers_stops_the_upstream():
+    single_flight = SingleFlight()
+    finished, closed = threading.Event(), threading.Event()
+    leader = single_flight.stream('key', _upstream(finished, closed))
+    assert next(leader) == 'Text 1'
+
+    leader.close()
+
+    assert closed.is_set() and not finished.is_set()
+    assert single_flight.stats()['in_flight'] == 0
+
+
+def test_upstream_stops_once_the_last_follower_leaves():
+    single_flight = SingleFlight()
+    finished, closed = threading.Event(), threading.Event()
+    release = threading.Event()
+
+    def make_stream():
+        yield 'Text 1'
+        release.wait(5)
+        yield from _upstream(finished, closed)()
+
+    leader = single_flight.stream('key', make_stream)
+    next(leader)
+    follower = single_flight.stream('key', _no_upstream)
+    next(follower)
+    leader.close()
+    follower.close()
+    release.set()
+
+    assert closed.wait(5) and not finished.is_set()
+    assert single_flight.stats()['in_flight'] == 0
+
+
+def test_lock_timeout_leaves_the_holders_lock_file(tmp_path):
+    holder = SingleFlight(lock_dir=str(tmp_path))._process_lock('key')
+    waiter = SingleFlight(lock_dir=str(tmp_path), lock_timeout=0.1)._process_lock('key')
+    assert holder.__enter__() is False
+    assert waiter.__enter__() is True # gave up waiting
+    waiter.__exit__(None, None, None)
+    assert (tmp_path / 'key.lock').exists()
+    holder.__exit__(None, None, None)
+    assert not (tmp_path / 'key.lock').exists()